@@ -1,41 +1,273 @@
+import math
 import time
-import requests
-import RPi.GPIO as GPIO
+import struct
+
+import telemetry
+import sample_bus
+import alert_dispatcher
+import service_loop
+import hal
 
 # --- Config ---
 SERVER_URL = "http://10.137.73.214:5000/api/alcohol"
 SENSOR_PIN = 26  # GPIO 26 (Pin 37)
+# Most MQ-3 modules pull the digital output LOW when the threshold is exceeded.
+# Check your specific sensor! If it's reversed, set this to 1.
+ACTIVE_LEVEL = 0
+DETECTED_VALUE = 90.0   # Reported from the digital output: High / Drunk
+CLEAR_VALUE = 5.0       # Safe / Clean
+
+# warming_up -> clear <-> detected
+WARMUP_S = 60.0         # MQ-3 heater settling time after power-up; readings are ignored
+DEBOUNCE_S = 0.03       # The input must hold a level this long to count (comparator chatter)
+DETECT_AFTER_S = 0.2    # ...and stay active this long to enter "detected"
+CLEAR_AFTER_S = 5.0     # ...and stay inactive this long to return to "clear"
+HEARTBEAT_S = 60.0      # Re-send the current state this often when nothing changes
+EDGE_MODE = True        # GPIO interrupts; falls back to polling if edge detection fails
+POLL_INTERVAL = 0.1     # Polling fallback
+WAIT_MAX = 1.0          # Longest a step waits for an edge (keeps the supervisor heartbeat going)
+
+# Analog MQ-3 output on an ADS1115 (A0). Used instead of the digital pin when
+# the ADC answers on the bus.
+ADC_ENABLED = True
+ADC_BUS = 1
+ADC_ADDRESS = 0x48
+ADC_CONFIG = 0x40E3         # A0 vs GND, +/-6.144 V, continuous conversion, 860 SPS, comparator off
+ADC_VOLTS_PER_LSB = 6.144 / 32768
+ADC_SAMPLE_HZ = 200
+ADC_WINDOW_S = 1.0          # One statistics window per loop step
+ADC_BASELINE_V = 0.4        # Clean-air output until warm-up measures it
+ADC_BASELINE_MAX_V = 1.5    # Never learn a baseline above this (alcohol present at power-up)
+ADC_FULL_SCALE_V = 4.0      # Output reported as 100%
+ADC_ENTER_PCT = 60.0        # Hysteresis on the analog level
+ADC_EXIT_PCT = 40.0
+ADC_REPORT_DELTA = 5.0      # Also report a window whose mean moved this much (percentage points)
+
+# GPIO, opened when the loop starts (see hal.py)
+gpio = None
+
+
+class AlcoholState:
+    # Fed (active, t) samples or edges. A level counts once it has held for
+    # DEBOUNCE_S; a state change needs that level to last DETECT_AFTER_S /
+    # CLEAR_AFTER_S. feed() / update() return the new state on a change.
+    def __init__(self, now):
+        self.state = "warming_up"
+        self.since = now
+        self.warm_until = now + WARMUP_S
+        self.raw = False
+        self.raw_since = now
+        self.level = False          # Debounced input
+        self.level_since = now
+
+    def feed(self, active, t):
+        # The previous level may have settled (and changed the state) before this edge
+        change = self.update(t)
+        if active != self.raw:
+            self.raw = active
+            self.raw_since = t
+        return change
+
+    def update(self, t):
+        if self.raw != self.level and t - self.raw_since >= DEBOUNCE_S:
+            self.level = self.raw
+            self.level_since = self.raw_since
+        if self.state == "warming_up":
+            return self._enter("clear", t) if t >= self.warm_until else None
+        held = t - max(self.level_since, self.warm_until)
+        if self.state == "clear" and self.level and held >= DETECT_AFTER_S:
+            return self._enter("detected", t)
+        if self.state == "detected" and not self.level and held >= CLEAR_AFTER_S:
+            return self._enter("clear", t)
+        return None
 
-# Setup GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(SENSOR_PIN, GPIO.IN)
-
-print(f"✅ Alcohol Monitor Started (Digital Mode on GPIO {SENSOR_PIN})")
-
-def get_alcohol_status():
-    # Read the Digital Pin
-    # Most MQ-3 modules:
-    # LOW (0) = Alcohol Detected (Threshold exceeded)
-    # HIGH (1) = Clean Air
-    
-    # Check your specific sensor! If it's reversed, swap the 90.0 and 5.0 below.
-    if GPIO.input(SENSOR_PIN) == 0:
-        return 90.0  # High / Drunk
+    def _enter(self, state, t):
+        self.state = state
+        self.since = t
+        return state
+
+    def next_deadline(self):
+        # When update() next has something to decide
+        deadlines = []
+        if self.raw != self.level:
+            deadlines.append(self.raw_since + DEBOUNCE_S)
+        if self.state == "warming_up":
+            deadlines.append(self.warm_until)
+        elif self.level != (self.state == "detected"):
+            hold = DETECT_AFTER_S if self.level else CLEAR_AFTER_S
+            deadlines.append(max(self.level_since, self.warm_until) + hold)
+        return min(deadlines) if deadlines else None
+
+
+def publish(machine, value, heartbeat=False, window=None):
+    # Only state changes, heartbeats and (analog) significant moves are sent
+    payload = {'value': round(value, 1), 'state': machine.state}
+    if heartbeat:
+        payload['heartbeat'] = True
+    if window:
+        payload['window'] = window
+    telemetry.post(SERVER_URL, payload)
+    # The black-box recorder (blackbox.py) keeps the same reports
+    sample_bus.publish("alcohol", t=time.time(), state=sample_bus.ALCOHOL_STATES.index(machine.state), value=value)
+
+
+def on_change(machine, value, window=None):
+    publish(machine, value, window=window)
+    if machine.state == "detected":
+        alert_dispatcher.raise_alert("alcohol", {'value': round(value, 1)})
+        print(f"Status: DETECTED 🍺 ({value:.0f}%)")
     else:
-        return 5.0   # Safe / Clean
+        print(f"Status: Safe 🟢 ({value:.0f}%)")
+
+
+# --- Digital output (GPIO) ---
+def digital_value(machine):
+    return DETECTED_VALUE if machine.state == "detected" else CLEAR_VALUE
+
 
-try:
-    while True:
-        val = get_alcohol_status()
-        
+def digital_loop():
+    gpio.setup_input(SENSOR_PIN)
+    watcher = None
+    if EDGE_MODE:
         try:
-            requests.post(SERVER_URL, json={'value': val}, timeout=0.1)
-            state = "DETECTED 🍺" if val > 50 else "Safe 🟢"
-            print(f"Status: {state} ({val}%)")
-        except:
-            pass
-            
-        time.sleep(1)
-
-except KeyboardInterrupt:
-    GPIO.cleanup()
+            watcher = gpio.watch(SENSOR_PIN)
+        except RuntimeError as e:
+            # RPi.GPIO: "Failed to add edge detection" (pin claimed by another driver)
+            print(f"⚠️ Edge detection unavailable ({e}), polling every {POLL_INTERVAL}s")
+    print(f"✅ Alcohol Monitor Started (Digital Mode on GPIO {SENSOR_PIN}, "
+          f"{'interrupts' if watcher else 'polling'}, warming up {WARMUP_S:.0f}s)")
+
+    now = hal.monotonic()
+    machine = AlcoholState(now)
+    machine.feed(gpio.input(SENSOR_PIN) == ACTIVE_LEVEL, now)
+    publish(machine, CLEAR_VALUE)
+    last_report = now
+    try:
+        while True:
+            changes = []
+            if watcher is not None:
+                now = hal.monotonic()
+                deadline = min(d for d in (machine.next_deadline(), last_report + HEARTBEAT_S) if d is not None)
+                edges = watcher.wait(min(max(deadline - now, 0.0), WAIT_MAX))
+                now = hal.monotonic()
+                for age, level in edges:
+                    changes.append(machine.feed(level == ACTIVE_LEVEL, now - age))
+            else:
+                now = hal.monotonic()
+                changes.append(machine.feed(gpio.input(SENSOR_PIN) == ACTIVE_LEVEL, now))
+            changes.append(machine.update(now))
+
+            for change in changes:
+                if change is not None:
+                    on_change(machine, digital_value(machine))
+                    last_report = now
+            if now - last_report >= HEARTBEAT_S:
+                publish(machine, digital_value(machine), heartbeat=True)
+                last_report = now
+            yield 0 if watcher is not None else POLL_INTERVAL
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+# --- Analog output (ADS1115) ---
+def open_adc():
+    if not ADC_ENABLED:
+        return None
+    try:
+        bus = hal.i2c_bus(ADC_BUS)
+    except (OSError, ImportError):
+        return None
+    try:
+        # Probe with a read first: a missing ADC fails here (and in a replay of it)
+        bus.read_i2c_block_data(ADC_ADDRESS, 0x01, 2)
+        bus.write_i2c_block_data(ADC_ADDRESS, 0x01, [ADC_CONFIG >> 8, ADC_CONFIG & 0xFF])
+    except OSError:
+        bus.close()
+        return None
+    return bus
+
+
+def read_volts(bus):
+    raw, = struct.unpack(">h", bytes(bus.read_i2c_block_data(ADC_ADDRESS, 0x00, 2)))
+    return raw * ADC_VOLTS_PER_LSB
+
+
+def window_stats(percents, volts):
+    n = len(percents)
+    mean = sum(percents) / n
+    ranked = sorted(percents)
+    return {
+        'n': n,
+        'mean': round(mean, 1),
+        'min': round(ranked[0], 1),
+        'max': round(ranked[-1], 1),
+        'p95': round(ranked[min(n - 1, int(0.95 * n))], 1),
+        'std': round(math.sqrt(sum((p - mean) ** 2 for p in percents) / n), 2),
+        'volts': round(sum(volts) / n, 3),
+    }
+
+
+def adc_loop(bus):
+    print(f"✅ Alcohol Monitor Started (Analog Mode, ADS1115 @ 0x{ADC_ADDRESS:02X}, "
+          f"{ADC_SAMPLE_HZ} Hz, warming up {WARMUP_S:.0f}s)")
+    now = hal.monotonic()
+    machine = AlcoholState(now)
+    baseline = ADC_BASELINE_V
+    active = False
+    window = None
+    reported_mean = 0.0
+    publish(machine, 0.0)
+    last_report = now
+    try:
+        while True:
+            percents, volts = [], []
+            end = hal.monotonic() + ADC_WINDOW_S
+            while True:
+                v = read_volts(bus)
+                t = hal.monotonic()
+                pct = min(100.0, max(0.0, 100.0 * (v - baseline) / (ADC_FULL_SCALE_V - baseline)))
+                active = pct > (ADC_EXIT_PCT if active else ADC_ENTER_PCT)
+                percents.append(pct)
+                volts.append(v)
+                if machine.feed(active, t) is not None:
+                    # Report now, with the last complete window
+                    on_change(machine, pct, window)
+                    last_report = t
+                    reported_mean = pct
+                if t >= end:
+                    break
+                hal.sleep(1.0 / ADC_SAMPLE_HZ)
+
+            window = window_stats(percents, volts)
+            if machine.state == "warming_up":
+                # Clean-air output as the heater settles; the last window before
+                # warm-up ends is the one that sticks
+                baseline = min(window['volts'], ADC_BASELINE_MAX_V)
+            elif abs(window['mean'] - reported_mean) >= ADC_REPORT_DELTA:
+                publish(machine, window['mean'], window=window)
+                last_report = t
+                reported_mean = window['mean']
+            if t - last_report >= HEARTBEAT_S:
+                publish(machine, window['mean'], heartbeat=True, window=window)
+                last_report = t
+            yield 0
+    finally:
+        bus.close()
+
+
+def monitor_loop():
+    global gpio
+    bus = open_adc()
+    if bus is not None:
+        yield from adc_loop(bus)
+    else:
+        gpio = hal.gpio()
+        yield from digital_loop()
+
+if __name__ == "__main__":
+    try:
+        service_loop.run_blocking(monitor_loop())
+    finally:
+        if gpio is not None:
+            gpio.cleanup()
@@ -0,0 +1,231 @@
+import os
+import time
+import threading
+import collections
+
+import telemetry
+import gps_fix
+
+# --- Configuration ---
+# SOS / SMS alerts from the detectors. raise_alert() only appends to a
+# deque (microseconds); a background thread forwards alerts to gsm_service,
+# which runs the one AlertDispatcher that owns the SMS path:
+#   - priority classes: crash before drowsiness before alcohol
+#   - a per-type de-duplication window (repeats are counted, not re-sent)
+#   - a token bucket per recipient
+#   - everything pending goes out as one SMS with the latest GPS fix
+# Without gsm_service, the process runs its own dispatcher and sends directly.
+ALERT_LOG_URL = "http://localhost:5000/api/alerts"
+RECIPIENTS = [n.strip() for n in os.environ.get("ISARTHI_ALERT_RECIPIENTS", "+919876543210").split(",") if n.strip()]
+
+# kind: (priority, dedup window s, batch delay s, headline)
+ALERT_TYPES = {
+    'crash': (0, 60.0, 0.5, "CRASH detected"),
+    'drowsiness': (1, 300.0, 5.0, "Driver severely drowsy"),
+    'alcohol': (2, 600.0, 5.0, "Alcohol detected"),
+}
+BUCKET_CAPACITY = 3         # SMS a recipient can get back to back...
+BUCKET_REFILL_S = 300.0     # ...then one more every 5 minutes
+SMS_MAX_CHARS = 160         # One GSM-7 SMS (the modem sends text mode, no concatenation)
+RETRY_DELAY = 30.0
+QUEUE_MAX = 256
+
+
+class TokenBucket:
+    def __init__(self, capacity=BUCKET_CAPACITY, refill_s=BUCKET_REFILL_S, now=None):
+        self.capacity = capacity
+        self.refill_s = refill_s
+        self.tokens = float(capacity)
+        self.stamp = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) / self.refill_s)
+        self.stamp = now
+
+    def take(self, now):
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def refund(self):
+        # The SMS it paid for never went out
+        self.tokens = min(self.capacity, self.tokens + 1.0)
+
+    def wait_time(self, now):
+        self._refill(now)
+        return max(0.0, (1.0 - self.tokens) * self.refill_s)
+
+
+class AlertDispatcher:
+    # send(number, text, priority) -> bool; runs on the dispatcher thread only
+    def __init__(self, send, recipients=RECIPIENTS, log_url=ALERT_LOG_URL):
+        self.send = send
+        self.recipients = list(recipients)
+        self.log_url = log_url
+        self.inbox = collections.deque(maxlen=QUEUE_MAX)
+        self.wake = threading.Event()
+        self.buckets = {n: TokenBucket() for n in self.recipients}
+        # Per recipient: kind -> pending alert (coalesced)
+        self.pending = {n: {} for n in self.recipients}
+        self.last_sent = {}         # kind -> monotonic time it was last included in an SMS
+        self.suppressed = collections.Counter()
+        self.stats = {'raised': 0, 'sent': 0, 'failed': 0, 'deduplicated': 0, 'rate_limited': 0}
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # --- Producer side ---
+    def raise_alert(self, kind, detail=None, t=None):
+        if kind not in ALERT_TYPES:
+            raise ValueError(f"unknown alert type '{kind}'")
+        self.inbox.append((kind, detail, time.time() if t is None else t, time.monotonic()))
+        self.wake.set()
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+                    self._thread.start()
+
+    # --- Dispatcher thread ---
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            self._collect(now)
+            delay = self._flush(now)
+            self.wake.wait(delay)
+            self.wake.clear()
+
+    def _collect(self, now):
+        while self.inbox:
+            kind, detail, t, mono = self.inbox.popleft()
+            self.stats['raised'] += 1
+            _, window, _, _ = ALERT_TYPES[kind]
+            if mono - self.last_sent.get(kind, -window) < window:
+                # Already told everyone recently
+                self.suppressed[kind] += 1
+                self.stats['deduplicated'] += 1
+                continue
+            for number in self.recipients:
+                alert = self.pending[number].get(kind)
+                if alert is None:
+                    self.pending[number][kind] = {'kind': kind, 'first': t, 'count': 1, 'detail': detail, 'since': mono}
+                else:
+                    alert['count'] += 1
+                    alert['detail'] = detail or alert['detail']
+
+    def _flush(self, now):
+        # Sends what is due; returns how long to sleep before the next check
+        next_check = None
+        for number, alerts in self.pending.items():
+            if not alerts:
+                continue
+            due = min(a['since'] + ALERT_TYPES[a['kind']][2] for a in alerts.values())
+            if due > now:
+                wait = due - now
+            elif not self.buckets[number].take(now):
+                self.stats['rate_limited'] += 1
+                wait = self.buckets[number].wait_time(now)
+            else:
+                batch = sorted(alerts.values(), key=lambda a: ALERT_TYPES[a['kind']][0])
+                if self._deliver(number, batch):
+                    alerts.clear()
+                    for a in batch:
+                        self.last_sent[a['kind']] = now
+                    continue
+                self.buckets[number].refund()
+                wait = RETRY_DELAY
+            next_check = wait if next_check is None else min(next_check, wait)
+        return next_check
+
+    def _deliver(self, number, batch):
+        fix = gps_fix.read_best(max_age=None)
+        text = compose(batch, fix)
+        # Crash goes to the front of the modem queue
+        priority = 0 if batch[0]['kind'] == 'crash' else 5
+        try:
+            ok = self.send(number, text, priority)
+        except Exception as e:
+            print(f"❌ Alert SMS error: {e}")
+            ok = False
+        if not ok:
+            self.stats['failed'] += 1
+            return False
+        self.stats['sent'] += 1
+        print(f"🚨 Alert SMS to {number}: {text}")
+        log = {'types': [a['kind'] for a in batch], 'count': sum(a['count'] for a in batch), 'message': text}
+        if fix:
+            log['latitude'] = fix['latitude']
+            log['longitude'] = fix['longitude']
+        telemetry.post(self.log_url, log)
+        return True
+
+
+def compose(batch, fix):
+    # "URGENT: CRASH detected 14:02; Driver severely drowsy x3 14:01. https://maps.google.com/?q=..."
+    parts = []
+    for a in batch:
+        part = ALERT_TYPES[a['kind']][3]
+        if a['count'] > 1:
+            part += f" x{a['count']}"
+        part += time.strftime(" %H:%M", time.localtime(a['first']))
+        parts.append(part)
+    text = "URGENT: " + "; ".join(parts) + "."
+    if fix:
+        age = time.time() - fix['timestamp']
+        text += f" https://maps.google.com/?q={fix['latitude']:.5f},{fix['longitude']:.5f}"
+        if age > 60:
+            text += f" ({age / 60:.0f} min old)"
+    else:
+        text += " Location unknown."
+    return text[:SMS_MAX_CHARS]
+
+
+# --- Client side: forward to gsm_service, or dispatch locally ---
+_forward = collections.deque(maxlen=QUEUE_MAX)
+_forward_wake = threading.Event()
+_forwarder = None
+_forwarder_lock = threading.Lock()
+_local = None
+
+
+def _send_direct(number, text, priority):
+    import gsm_utils
+    return gsm_utils.send_sms(number, text, priority=priority)
+
+
+def _forward_loop():
+    global _local
+    import gsm_utils
+    while True:
+        _forward_wake.wait()
+        _forward_wake.clear()
+        while _forward:
+            kind, detail, t = _forward.popleft()
+            try:
+                reply = gsm_utils.service_request({'op': 'alert', 'kind': kind, 'detail': detail, 't': t}, timeout=2.0)
+                if reply.get('ok'):
+                    continue
+            except (OSError, ValueError):
+                pass
+            if _local is None:
+                print("⚠️ GSM service not reachable, dispatching alerts from this process")
+                _local = AlertDispatcher(_send_direct)
+            _local.raise_alert(kind, detail, t)
+
+
+def raise_alert(kind, detail=None):
+    # Safe to call from any hot loop: queues and returns
+    global _forwarder
+    if kind not in ALERT_TYPES:
+        raise ValueError(f"unknown alert type '{kind}'")
+    _forward.append((kind, detail, time.time()))
+    if _forwarder is None:
+        with _forwarder_lock:
+            if _forwarder is None:
+                _forwarder = threading.Thread(target=_forward_loop, name="alert-forwarder", daemon=True)
+                _forwarder.start()
+    _forward_wake.set()
@@ -0,0 +1,98 @@
+import sys
+import time
+import argparse
+import cv2
+
+import drowsiness_detector as dd
+from bench_vision import simulate_drowsiness
+from frame_sources import open_source
+
+# Benchmark: full-frame Haar detection vs. tracking mode on recorded clips.
+# Usage: python3 bench_face_tracking.py clip1.mp4 [clip2.mp4 | image_folder ...]
+#
+# Frames are decoded and equalized up front so only detection is timed.
+# Both modes are run through the same drowsiness rules (using the clip's own
+# timestamps) and their drowsiness events are compared.
+
+
+def load_clip(path, max_frames=None, width=None):
+    source = open_source(path, realtime=False)
+    if not source.isOpened():
+        raise SystemExit(f"❌ Cannot open {path}")
+    frames = []
+    while max_frames is None or len(frames) < max_frames:
+        ok, frame = source.read()
+        if not ok:
+            break
+        if width and frame.shape[1] != width:
+            frame = cv2.resize(frame, (width, int(frame.shape[0] * width / frame.shape[1])))
+        gray = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        frames.append(gray)
+    source.release()
+    return frames, getattr(source, "fps", 30.0)
+
+
+def run_mode(frames, detect_fn):
+    closed = []
+    t0 = time.perf_counter()
+    for gray in frames:
+        faces, results = detect_fn(gray)
+        eyes = sum(len(e) for _, e in results)
+        closed.append(len(faces) > 0 and eyes < dd.MIN_EYES_OPEN)
+    elapsed = time.perf_counter() - t0
+    return closed, elapsed
+
+
+def match_events(a, b, tolerance):
+    # Events in a with a partner in b within tolerance seconds
+    return sum(1 for t in a if any(abs(t - u) <= tolerance for u in b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face tracking vs. full detection benchmark")
+    parser.add_argument("clips", nargs="+")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--width", type=int, default=None, help="Resize frames to this width first")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Event onset tolerance (s)")
+    parser.add_argument("--min-speedup", type=float, default=3.0)
+    args = parser.parse_args()
+
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye_tree_eyeglasses.xml")
+
+    ok = True
+    for path in args.clips:
+        frames, fps = load_clip(path, args.max_frames, args.width)
+        if not frames:
+            print(f"⚠️ {path}: no frames")
+            continue
+        timestamps = [i / fps for i in range(len(frames))]
+
+        base_closed, base_time = run_mode(frames, lambda g: dd.detect(g, face_cascade, eye_cascade))
+        tracker = dd.make_tracker(face_cascade, eye_cascade)
+        track_closed, track_time = run_mode(frames, tracker.process)
+
+        base_events = simulate_drowsiness(base_closed, timestamps)
+        track_events = simulate_drowsiness(track_closed, timestamps)
+        agree = sum(a == b for a, b in zip(base_closed, track_closed)) / len(frames)
+        matched = match_events(base_events, track_events, args.tolerance)
+        speedup = base_time / track_time if track_time > 0 else float("inf")
+        same_decisions = matched == len(base_events) == len(track_events)
+
+        print(f"📼 {path} ({len(frames)} frames, {frames[0].shape[1]}x{frames[0].shape[0]})")
+        print(f"   Full detection : {len(frames) / base_time:7.1f} fps")
+        print(f"   Tracking mode  : {len(frames) / track_time:7.1f} fps  "
+              f"({tracker.full_detections} full detections, {tracker.tracked_frames} tracked)")
+        print(f"   Speedup        : {speedup:.2f}x")
+        print(f"   Eyes-closed frame agreement: {agree * 100:.1f}%")
+        print(f"   Drowsy events  : full={len(base_events)} tracking={len(track_events)} matched={matched}")
+
+        if speedup < args.min_speedup or not same_decisions:
+            ok = False
+
+    print("✅ PASS" if ok else "❌ FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
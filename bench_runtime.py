@@ -0,0 +1,75 @@
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Cold start and memory of the two ways to run the car's sensor modules:
+# one process per module under the supervisor, or all loops in one
+# process (car_runtime.py). Run on the Pi with the hardware attached:
+#
+#   python3 bench_runtime.py --runs 5
+#
+# Cold start is measured from spawning start_car.py to "all modules ready"
+# (every loop completed its first step). Memory is the total over the
+# supervisor and its children; PSS counts shared library pages once, so it
+# is the fair comparison (RSS counts them per process).
+
+
+def run_once(mode, timeout):
+    cmd = [sys.executable, "start_car.py", "--exit-when-ready"]
+    if mode == "single":
+        cmd.append("--single")
+    t0 = time.monotonic()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    result = {"mode": mode}
+    try:
+        deadline = t0 + timeout
+        for line in proc.stdout:
+            if line.startswith("READY "):
+                result["cold_start_s"] = time.monotonic() - t0
+                result.update({"ready_" + k: v for k, v in json.loads(line[6:]).items() if k.endswith("_kb")})
+            elif line.startswith("STEADY "):
+                result.update({k: v for k, v in json.loads(line[7:]).items() if k.endswith("_kb")})
+                break
+            if time.monotonic() > deadline:
+                break
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process vs single-process runtime")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Give up on a run after this many seconds")
+    args = parser.parse_args()
+
+    results = {"multi": [], "single": []}
+    for i in range(args.runs):
+        for mode in ("multi", "single"):
+            r = run_once(mode, args.timeout)
+            print(f"run {i + 1} {mode:<6} " + " ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}"
+                                                     for k, v in r.items() if k != "mode"))
+            results[mode].append(r)
+
+    print()
+    print(f"{'mode':<8} {'cold start s':>12} {'RSS MB':>8} {'PSS MB':>8}")
+    for mode, runs in results.items():
+        ok = [r for r in runs if "cold_start_s" in r and "pss_kb" in r]
+        if not ok:
+            print(f"{mode:<8} {'(never ready)':>12}")
+            continue
+        starts = sorted(r["cold_start_s"] for r in ok)
+        print(f"{mode:<8} {starts[len(starts) // 2]:12.2f} "
+              f"{sum(r['rss_kb'] for r in ok) / len(ok) / 1024:8.1f} "
+              f"{sum(r['pss_kb'] for r in ok) / len(ok) / 1024:8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import drowsiness_detector as dd
+import pothole_detector as pd
+from frame_sources import open_source
+from pothole_analysis import PotholeAnalyzer
+
+# Offline benchmark for the vision modules. Runs a recorded clip (or image
+# folder) through the same detection code the live apps use and reports
+# throughput, per-frame latency percentiles, per-stage time and peak RSS.
+#
+#   python3 bench_vision.py drive.mp4 --module drowsiness --mode tracking
+#   python3 bench_vision.py drive.mp4 --write-golden drive.golden.json
+#   python3 bench_vision.py drive.mp4 --golden drive.golden.json
+#
+# A golden file is a list of per-frame outputs (recorded with --write-golden
+# from a trusted run, or labelled by hand). Comparing against it catches
+# performance changes that also change what gets detected.
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.current = defaultdict(float)
+
+    def add(self, name, seconds):
+        self.current[name] += seconds
+
+    def end_frame(self, stages):
+        for name in stages:
+            self.samples[name].append(self.current.get(name, 0.0))
+        self.current = defaultdict(float)
+
+
+class TimedCascade:
+    # Wraps a CascadeClassifier so its time is charged to a named stage
+    def __init__(self, cascade, name, timer):
+        self.cascade = cascade
+        self.name = name
+        self.timer = timer
+
+    def detectMultiScale(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        result = self.cascade.detectMultiScale(*args, **kwargs)
+        self.timer.add(self.name, time.perf_counter() - t0)
+        return result
+
+
+def timed(timer, name, fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timer.add(name, time.perf_counter() - t0)
+    return result
+
+
+def simulate_drowsiness(closed_flags, timestamps):
+    # Same rules as drowsiness_detector.update_state, without side effects.
+    # Returns the timestamps at which a drowsiness event starts.
+    events = []
+    closed_since = None
+    drowsy = False
+    for closed, ts in zip(closed_flags, timestamps):
+        if closed:
+            if closed_since is None:
+                closed_since = ts
+            if ts - closed_since >= dd.DROWSINESS_THRESHOLD_SECONDS and not drowsy:
+                drowsy = True
+                events.append(ts)
+        else:
+            closed_since = None
+            drowsy = False
+    return events
+
+
+# --- Per-module pipelines (one frame in, one output record out) ---
+
+def drowsiness_pipeline(mode):
+    timer = StageTimer()
+    face_cascade = TimedCascade(cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml"),
+                                "face_cascade", timer)
+    eye_cascade = TimedCascade(cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye_tree_eyeglasses.xml"),
+                               "eye_cascade", timer)
+    tracker = dd.make_tracker(face_cascade, eye_cascade) if mode == "tracking" else None
+    stages = ["equalize", "face_cascade", "eye_cascade", "track", "overlay", "encode"]
+
+    def process(frame):
+        gray = timed(timer, "equalize", lambda f: cv2.equalizeHist(cv2.cvtColor(f, cv2.COLOR_BGR2GRAY)), frame)
+
+        t0 = time.perf_counter()
+        if tracker is not None:
+            faces, results = tracker.process(gray)
+        else:
+            faces, results = dd.detect(gray, face_cascade, eye_cascade)
+        # Whatever detection time was not spent inside a cascade is tracking overhead
+        spent = time.perf_counter() - t0
+        timer.add("track", max(0.0, spent - timer.current["face_cascade"] - timer.current["eye_cascade"]))
+
+        eyes = sum(len(e) for _, e in results)
+        timed(timer, "overlay", dd.draw_overlay, frame, results, len(faces), eyes)
+        timed(timer, "encode", cv2.imencode, ".jpg", frame)
+        return {"faces": len(faces), "eyes": eyes, "closed": bool(len(faces) > 0 and eyes < dd.MIN_EYES_OPEN)}
+
+    return timer, stages, process
+
+
+def pothole_pipeline(mode):
+    timer = StageTimer()
+    analyzer = PotholeAnalyzer()
+    stages = ["analyze", "overlay", "encode"]
+
+    def process(frame):
+        result = timed(timer, "analyze", analyzer.analyze, frame)
+        timed(timer, "overlay", pd.draw_overlay, frame, analyzer, result)
+        timed(timer, "encode", cv2.imencode, ".jpg", frame)
+        return {"detected": result["detected"], "confidence": result["confidence"]}
+
+    return timer, stages, process
+
+
+PIPELINES = {
+    "drowsiness": drowsiness_pipeline,
+    "pothole": pothole_pipeline,
+}
+
+
+# --- Golden comparison ---
+
+def compare_golden(module, outputs, timestamps, golden, tolerance):
+    # Returns (ok, lines)
+    expected = golden["frames"]
+    n = min(len(expected), len(outputs))
+    lines = []
+    if n == 0:
+        return False, ["golden run is empty"]
+
+    key = "closed" if module == "drowsiness" else "detected"
+    agree = sum(bool(outputs[i][key]) == bool(expected[i][key]) for i in range(n)) / n
+    lines.append(f"'{key}' agreement with golden: {agree * 100:.2f}% over {n} frames")
+    ok = agree >= golden.get("min_agreement", 0.98)
+
+    if module == "drowsiness":
+        got = simulate_drowsiness([o["closed"] for o in outputs[:n]], timestamps[:n])
+        want = simulate_drowsiness([e["closed"] for e in expected[:n]], timestamps[:n])
+        matched = sum(1 for t in want if any(abs(t - u) <= tolerance for u in got))
+        lines.append(f"drowsy events: golden={len(want)} run={len(got)} matched={matched}")
+        ok = ok and matched == len(want) == len(got)
+    return ok, lines
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss / 1024.0 if sys.platform != "darwin" else rss / (1024.0 * 1024.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the vision modules")
+    parser.add_argument("source", help="Video file, image folder, or camera index")
+    parser.add_argument("--module", choices=sorted(PIPELINES), default="drowsiness")
+    parser.add_argument("--mode", choices=["full", "tracking"], default="tracking")
+    parser.add_argument("--realtime", action="store_true", help="Pace frames at the recording's rate")
+    parser.add_argument("--fps", type=float, default=30.0, help="Frame rate for image folders")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--warmup", type=int, default=5, help="Frames excluded from timing")
+    parser.add_argument("--golden", help="Compare outputs against this golden run")
+    parser.add_argument("--write-golden", help="Save this run's outputs as a golden run")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Event onset tolerance (s)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    source = open_source(args.source, realtime=args.realtime, fps=args.fps)
+    if not source.isOpened():
+        print(f"❌ Cannot open {args.source}")
+        return 2
+
+    timer, stages, process = PIPELINES[args.module](args.mode)
+    outputs, timestamps, latencies = [], [], []
+
+    t_begin = None
+    while args.max_frames is None or len(outputs) < args.max_frames:
+        ok, frame = source.read()
+        if not ok:
+            break
+        t0 = time.perf_counter()
+        outputs.append(process(frame))
+        elapsed = time.perf_counter() - t0
+        timestamps.append(getattr(source, "timestamp", len(outputs) / args.fps))
+
+        if len(outputs) <= args.warmup:
+            timer.current.clear()
+            continue
+        if t_begin is None:
+            t_begin = t0
+        latencies.append(elapsed)
+        timer.end_frame(stages)
+    source.release()
+
+    if not latencies:
+        print("❌ Not enough frames to measure")
+        return 2
+
+    wall = time.perf_counter() - t_begin
+    lat_ms = np.array(latencies) * 1000.0
+    report = {
+        "source": args.source,
+        "module": args.module,
+        "mode": args.mode,
+        "frames": len(outputs),
+        "fps": len(latencies) / wall,
+        "latency_ms": {"p50": float(np.percentile(lat_ms, 50)), "p99": float(np.percentile(lat_ms, 99)),
+                       "max": float(lat_ms.max())},
+        "stages_ms": {
+            name: {"mean": float(np.mean(timer.samples[name]) * 1000.0),
+                   "p99": float(np.percentile(timer.samples[name], 99) * 1000.0)}
+            for name in stages
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"📊 {args.module} ({args.mode}) on {args.source}: {report['frames']} frames")
+    print(f"   Throughput : {report['fps']:.1f} fps")
+    print(f"   Latency    : p50 {report['latency_ms']['p50']:.2f} ms | p99 {report['latency_ms']['p99']:.2f} ms")
+    for name, s in report["stages_ms"].items():
+        print(f"   {name:<13}: mean {s['mean']:7.2f} ms | p99 {s['p99']:7.2f} ms")
+    if report["peak_rss_mb"] is not None:
+        print(f"   Peak RSS   : {report['peak_rss_mb']:.1f} MB")
+
+    ok = True
+    if args.golden:
+        with open(args.golden) as f:
+            golden = json.load(f)
+        ok, lines = compare_golden(args.module, outputs, timestamps, golden, args.tolerance)
+        for line in lines:
+            print(f"   {line}")
+        report["golden_ok"] = ok
+        print("✅ Matches golden run" if ok else "❌ Differs from golden run")
+
+    if args.write_golden:
+        with open(args.write_golden, "w") as f:
+            json.dump({"module": args.module, "source": args.source, "frames": outputs}, f)
+        print(f"💾 Golden run written to {args.write_golden}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
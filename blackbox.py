@@ -0,0 +1,333 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+
+import sample_bus
+import metrics
+import service_loop
+
+# --- Configuration ---
+# Black-box recorder: every sensor stream on the sample bus goes into a ring
+# of columnar files on disk, one fixed-size binary column per record field
+# (blackbox/live/<topic>/<field>.bin, memory-mapped, preallocated), so the
+# last couple of minutes are always on the SD card, whatever the network did.
+# When an impact is detected (a "crash" on the events topic, or
+# `python3 blackbox.py freeze` on the freeze topic) the window from PRE_S before to POST_S after
+# it is copied out to blackbox/events/<time>_<kind>/ in the same layout: the
+# part before the trigger right away, the whole window once POST_S has passed.
+#
+#   python3 blackbox.py list
+#   python3 blackbox.py export blackbox/events/20250101-120000_crash --format csv
+BLACKBOX_DIR = os.environ.get(
+    "ISARTHI_BLACKBOX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "blackbox"),
+)
+LIVE_DIR = os.path.join(BLACKBOX_DIR, "live")
+EVENTS_DIR = os.path.join(BLACKBOX_DIR, "events")
+TOPICS = ("imu", "radar_sweep", "gps_fix", "drowsiness", "alcohol", "events")
+# Rows kept per topic: ~160 s at the expected rates
+CAPACITY = {
+    "imu": 16384,           # 2 sensors x 50 drains/s, ~400 B per row (6.5 MB)
+    "radar_sweep": 512,     # ~2.4 sweeps/s
+    "gps_fix": 2048,        # 10 Hz
+    "drowsiness": 8192,     # One per camera frame
+    "alcohol": 1024,
+    "events": 256,
+}
+PRE_S = 30.0
+POST_S = 30.0
+MAX_WINDOW_S = 90.0         # Triggers inside a window extend it, up to this long
+FREEZE_KINDS = ("crash", "manual")
+SETTLE_S = 1.0              # Grace for records stamped before the window end that arrive after it
+SYNC_INTERVAL = 1.0         # msync the live rings at most this often
+WAIT_MAX = 1.0
+
+WRITE_TIME = metrics.histogram("stage_seconds", stage="blackbox_write")
+FREEZE_TIME = metrics.histogram("stage_seconds", stage="blackbox_freeze")
+
+
+class ColumnRing:
+    # One topic in a directory: meta.json (layout), a <field>.bin column per
+    # field with `capacity` fixed-size rows, and head.bin (rows ever written,
+    # u64). Row k lives in slot k % capacity. One writer; rows are written
+    # before the head moves past them.
+    def __init__(self, path, dtype=None, capacity=None, readonly=False):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        existing = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)
+        if dtype is None:
+            meta = existing
+        else:
+            meta = {"capacity": capacity,
+                    "fields": [[name, dtype[name].base.str, list(dtype[name].shape)] for name in dtype.names]}
+        self.capacity = meta["capacity"]
+        self.dtype = np.dtype([(name, base, tuple(shape)) for name, base, shape in meta["fields"]])
+
+        if readonly:
+            mode = "r"
+        elif meta == existing:
+            mode = "r+"
+        else:
+            # New ring, or the layout changed: start over
+            mode = "w+"
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+        self.columns = {
+            name: np.memmap(os.path.join(path, f"{name}.bin"), dtype=self.dtype[name].base, mode=mode,
+                            shape=(self.capacity,) + self.dtype[name].shape)
+            for name in self.dtype.names
+        }
+        self.head_mm = np.memmap(os.path.join(path, "head.bin"), dtype="<u8", mode=mode, shape=(1,))
+
+    @property
+    def head(self):
+        return int(self.head_mm[0])
+
+    def append(self, records):
+        # Bus records (or a structured array in this layout), oldest first
+        rows = np.asarray(records, dtype=self.dtype)
+        if len(rows) > self.capacity:
+            rows = rows[-self.capacity:]
+        head = self.head
+        start = head % self.capacity
+        first = min(len(rows), self.capacity - start)
+        for name, column in self.columns.items():
+            column[start:start + first] = rows[name][:first]
+            column[:len(rows) - first] = rows[name][first:]
+        self.head_mm[0] = head + len(rows)
+
+    def slots(self):
+        # Slot of every row still held, oldest first
+        head = self.head
+        return np.arange(max(0, head - self.capacity), head) % self.capacity
+
+    def rows(self, t0=None, t1=None):
+        # Rows with t0 <= t <= t1 as a structured array, oldest first
+        slots = self.slots()
+        if t0 is not None or t1 is not None:
+            t = self.columns["t"][slots]
+            keep = np.ones(len(slots), dtype=bool)
+            if t0 is not None:
+                keep &= t >= t0
+            if t1 is not None:
+                keep &= t <= t1
+            slots = slots[keep]
+        out = np.empty(len(slots), dtype=self.dtype)
+        for name, column in self.columns.items():
+            out[name] = column[slots]
+        return out
+
+    def flush(self):
+        for column in self.columns.values():
+            column.flush()
+        self.head_mm.flush()
+
+
+def save_rows(path, rows):
+    ring = ColumnRing(path, rows.dtype, max(len(rows), 1))
+    ring.append(rows)
+    ring.flush()
+
+
+class FrozenWindow:
+    # [first trigger - PRE_S, last trigger + POST_S] of every live ring
+    def __init__(self, rec):
+        self.t = float(rec["t"])
+        self.kind = rec["kind"].decode(errors="replace")
+        self.start = self.t - PRE_S
+        self.end = self.t + POST_S
+        self.triggers = []
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.t))
+        self.path = os.path.join(EVENTS_DIR, f"{stamp}_{self.kind}")
+        self.fold(rec)
+
+    def fold(self, rec):
+        t = float(rec["t"])
+        self.triggers.append({"t": t, "kind": rec["kind"].decode(errors="replace"),
+                              "peak_g": round(float(rec["peak_g"]), 2)})
+        self.end = min(max(self.end, t + POST_S), self.start + MAX_WINDOW_S)
+
+    def save(self, rings, complete):
+        # Written next to the final name, then swapped in
+        t0 = metrics.now()
+        end = self.end if complete else time.time()
+        tmp = self.path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        counts = {}
+        for topic, ring in rings.items():
+            rows = ring.rows(self.start, end)
+            counts[topic] = len(rows)
+            save_rows(os.path.join(tmp, topic), rows)
+        with open(os.path.join(tmp, "event.json"), "w") as f:
+            json.dump({"t": self.t, "kind": self.kind, "start": self.start, "end": end,
+                       "complete": complete, "triggers": self.triggers, "rows": counts}, f, indent=1)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.rename(tmp, self.path)
+        FREEZE_TIME.record_since(t0)
+        return counts
+
+
+def record_loop():
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    rings = {t: ColumnRing(os.path.join(LIVE_DIR, t), sample_bus.TOPICS[t][0], CAPACITY[t]) for t in TOPICS}
+    rows_total = {t: metrics.counter("blackbox_rows_total", topic=t) for t in TOPICS}
+    frozen_total = metrics.counter("blackbox_windows_total")
+    subs = [sample_bus.subscribe(t) for t in TOPICS + ("freeze",)]
+    print(f"✅ Black Box Recorder Started ({LIVE_DIR}, freezing ±{PRE_S:.0f}/{POST_S:.0f}s on {', '.join(FREEZE_KINDS)})")
+    window = None
+    last_sync = time.monotonic()
+    try:
+        while True:
+            for topic, records in sample_bus.wait_any(subs, WAIT_MAX).items():
+                if topic in rings:
+                    t0 = metrics.now()
+                    rings[topic].append(records)
+                    WRITE_TIME.record_since(t0)
+                    rows_total[topic].inc(len(records))
+                if topic not in ("events", "freeze"):
+                    continue
+                for rec in records:
+                    if rec["kind"].decode(errors="replace") not in FREEZE_KINDS:
+                        continue
+                    if window is not None and float(rec["t"]) <= window.end:
+                        window.fold(rec)
+                        continue
+                    if window is not None:
+                        window.save(rings, complete=True)
+                    # Persist what led up to it now: the car may lose power
+                    window = FrozenWindow(rec)
+                    window.save(rings, complete=False)
+                    print(f"🧊 Black box: {window.kind} at {time.strftime('%H:%M:%S', time.localtime(window.t))}, "
+                          f"saving ±{PRE_S:.0f}/{POST_S:.0f}s to {window.path}")
+
+            if window is not None and time.time() >= window.end + SETTLE_S:
+                counts = window.save(rings, complete=True)
+                frozen_total.inc()
+                print(f"💾 Black box window saved: {window.path} ({sum(counts.values())} rows)")
+                window = None
+
+            now = time.monotonic()
+            if now - last_sync >= SYNC_INTERVAL:
+                for ring in rings.values():
+                    ring.flush()
+                last_sync = now
+            yield 0
+    finally:
+        if window is not None:
+            window.save(rings, complete=False)
+        for ring in rings.values():
+            ring.flush()
+        for s in subs:
+            s.close()
+
+
+# --- Export ---
+def load(path):
+    # {topic: rows} of an event directory (or LIVE_DIR)
+    out = {}
+    for topic in TOPICS:
+        if os.path.exists(os.path.join(path, topic, "meta.json")):
+            out[topic] = ColumnRing(os.path.join(path, topic), readonly=True).rows()
+    return out
+
+
+def tables(data):
+    # Flat tables: one row per IMU sample (in g) and per radar reading,
+    # one row per record for the rest
+    out = {}
+    imu = data.get("imu")
+    if imu is not None:
+        n = imu["n"].astype(np.int64)
+        rec = np.repeat(np.arange(len(imu)), n)
+        # Position of each sample in its record; the record's t is its last sample
+        pos = np.arange(len(rec)) - np.repeat(np.cumsum(n) - n, n)
+        accel = imu["accel"][rec, pos] / imu["lsb_per_g"][rec, None]
+        out["imu"] = {
+            "t": imu["t"][rec] - (n[rec] - 1 - pos) / imu["rate_hz"][rec],
+            "sensor": imu["sensor"][rec],
+            "ax_g": accel[:, 0], "ay_g": accel[:, 1], "az_g": accel[:, 2],
+        }
+    radar = data.get("radar_sweep")
+    if radar is not None:
+        n = radar["n"].astype(np.int64)
+        rec = np.repeat(np.arange(len(radar)), n)
+        pos = np.arange(len(rec)) - np.repeat(np.cumsum(n) - n, n)
+        out["radar"] = {
+            "t": radar["t"][rec] + radar["dt_ms"][rec, pos] / 1000.0,
+            "sweep": rec,
+            "direction": radar["direction"][rec],
+            "angle": radar["angle"][rec, pos],
+            "distance_mm": radar["distance_mm"][rec, pos],
+        }
+    for topic in ("gps_fix", "drowsiness", "alcohol", "events"):
+        rows = data.get(topic)
+        if rows is not None:
+            out[topic] = {name: rows[name].astype(str) if rows.dtype[name].kind == "S" else rows[name]
+                          for name in rows.dtype.names}
+    return out
+
+
+def export(path, fmt="npz", out=None):
+    flat = tables(load(path))
+    out = out or path.rstrip("/") + ("" if fmt == "csv" else ".npz")
+    if fmt == "npz":
+        # One structured array per table: np.load(out)["imu"]["az_g"]
+        np.savez(out, **{name: np.rec.fromarrays(list(cols.values()), names=list(cols))
+                         for name, cols in flat.items()})
+        return [out]
+    os.makedirs(out, exist_ok=True)
+    written = []
+    for name, cols in flat.items():
+        target = os.path.join(out, f"{name}.csv")
+        fmts = ["%.6f" if c.dtype.kind == "f" else "%s" if c.dtype.kind == "U" else "%d" for c in cols.values()]
+        np.savetxt(target, np.rec.fromarrays(list(cols.values()), names=list(cols)), fmt=fmts,
+                   delimiter=",", header=",".join(cols), comments="")
+        written.append(target)
+    return written
+
+
+def list_events():
+    names = sorted(os.listdir(EVENTS_DIR)) if os.path.isdir(EVENTS_DIR) else []
+    for name in names:
+        try:
+            with open(os.path.join(EVENTS_DIR, name, "event.json")) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+        rows = ", ".join(f"{t} {n}" for t, n in info["rows"].items() if n)
+        print(f"{name}: {info['kind']} x{len(info['triggers'])}, {info['end'] - info['start']:.0f}s"
+              f"{'' if info['complete'] else ' (partial)'} | {rows}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Black-box recorder")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("list", help="saved windows")
+    exp = commands.add_parser("export", help="window (or live) directory to NumPy / CSV")
+    exp.add_argument("path")
+    exp.add_argument("--format", choices=("npz", "csv"), default="npz")
+    exp.add_argument("--out")
+    commands.add_parser("freeze", help="save the window around now")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_events()
+    elif args.command == "export":
+        t = time.perf_counter()
+        written = export(args.path, args.format, args.out)
+        print(f"📦 {', '.join(written)} ({time.perf_counter() - t:.2f}s)")
+    elif args.command == "freeze":
+        if not sample_bus.publish("freeze", t=time.time(), kind=b"manual"):
+            sys.exit("❌ Sample bus unavailable")
+        print("🧊 Freeze requested")
+    else:
+        service_loop.run_blocking(record_loop())
@@ -0,0 +1,111 @@
+import math
+import threading
+
+import telemetry
+import sample_bus
+import service_loop
+import gps_tracker
+import radar_sweep
+import radar_system
+
+# --- Configuration ---
+# The HTTP upload is one subscriber of the sample bus (sample_bus.py) among
+# others: the producers only publish, and this turns their records into the
+# same server posts the modules used to make themselves.
+#   gps_fix      live position to /api/location, once per UPLOAD_INTERVAL
+#   radar_sweep  raw sweeps to /api/radar/sweep (when PUBLISH_RAW_SWEEPS)
+#   drowsiness   state to /api/drowsiness on every change, else every 2 s
+# start_car.py runs it for the car's sensor topics; the camera apps start
+# their own topic's uploader in-process (they may run on another machine).
+CAR_TOPICS = ("gps_fix", "radar_sweep")
+DROWSINESS_URL = "http://localhost:5000/api/drowsiness"
+DROWSINESS_SYNC_INTERVAL = 2.0
+WAIT_MAX = 1.0
+
+
+class GpsUpload:
+    def __init__(self):
+        self.last = 0.0
+
+    def push(self, records):
+        rec = records[-1]
+        t = float(rec["t"])
+        if t - self.last < gps_tracker.UPLOAD_INTERVAL:
+            return
+        self.last = t
+        heading = float(rec["heading"])
+        hdop = float(rec["hdop"])
+        telemetry.post(gps_tracker.SERVER_URL, {
+            'latitude': float(rec["lat"]),
+            'longitude': float(rec["lon"]),
+            'speed': float(rec["speed"]),
+            'heading': None if math.isnan(heading) else heading,
+            'hdop': None if math.isnan(hdop) else hdop,
+            'satellites': int(rec["satellites"]),
+            # With compressed tracks the live position is not logged again
+            'log': not gps_tracker.TRACK_UPLOAD
+        })
+
+
+class SweepUpload:
+    def push(self, records):
+        if not radar_system.PUBLISH_RAW_SWEEPS:
+            return
+        for rec in records:
+            radar_sweep.publish(radar_sweep.frame_from_record(rec))
+
+
+class DrowsinessUpload:
+    def __init__(self):
+        self.state = None
+        self.last = 0.0
+
+    def push(self, records):
+        for rec in records:
+            state = (bool(rec["drowsy"]), int(rec["events"]))
+            t = float(rec["t"])
+            if state != self.state or t - self.last > DROWSINESS_SYNC_INTERVAL:
+                self.state = state
+                self.last = t
+                telemetry.post(DROWSINESS_URL, {"isDrowsy": state[0], "events": state[1]})
+
+
+UPLOADS = {
+    "gps_fix": GpsUpload,
+    "radar_sweep": SweepUpload,
+    "drowsiness": DrowsinessUpload,
+}
+
+
+def upload_loop(topics=CAR_TOPICS):
+    subs = [sample_bus.subscribe(t) for t in topics]
+    uploads = {t: UPLOADS[t]() for t in topics}
+    print(f"✅ Bus Uploader Started ({', '.join(topics)})")
+    lost = 0
+    try:
+        while True:
+            for topic, records in sample_bus.wait_any(subs, WAIT_MAX).items():
+                uploads[topic].push(records)
+            if sum(s.lost for s in subs) > lost:
+                lost = sum(s.lost for s in subs)
+                print(f"⚠️ Bus Uploader fell behind: {lost} records skipped")
+            yield 0
+    finally:
+        for s in subs:
+            s.close()
+
+
+def _run(topics):
+    for _ in upload_loop(topics):
+        pass
+
+
+def start_background(topics):
+    # For apps with their own main loop (Flask): upload from a daemon thread
+    thread = threading.Thread(target=_run, args=(topics,), name="bus-uploader", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    service_loop.run_blocking(upload_loop())
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import asyncio
+import signal
+import importlib
+import concurrent.futures
+
+import hal
+import metrics
+
+from start_car import proc_stats, BACKOFF_MIN, BACKOFF_MAX, STABLE_AFTER, STATS_INTERVAL, STOP_TIMEOUT
+
+# --- Configuration ---
+# All sensor loops in one process: each module's loop generator (see
+# service_loop.py) becomes an asyncio task. A step (bus I/O + processing)
+# runs on a small thread pool; the sleeps between steps are asyncio sleeps,
+# so an idle loop holds no thread. Python, numpy, requests and the telemetry
+# sender are loaded once instead of once per module.
+LOOPS = [
+    # (key, module, loop function)
+    ("vibration", "vibration_monitor", "monitor_loop"),
+    ("radar", "radar_system", "scan_loop"),
+    ("gps", "gps_tracker", "tracker_loop"),
+    ("alcohol", "alcohol_monitor", "monitor_loop"),
+    ("gsm", "gsm_service", "gsm_loop"),
+    ("uploader", "bus_uploader", "upload_loop"),
+    ("blackbox", "blackbox", "record_loop"),
+    ("metrics", "metrics_sidecar", "serve_loop"),
+]
+# At most one step per loop is in flight, so this many workers never makes a
+# loop wait for another one's I/O
+POOL_WORKERS = len(LOOPS)
+RUNTIME_CPUS = {0, 1}       # Same cores the supervisor gives the sensor modules
+STALL_AFTER = 10.0          # A step running longer than this is reported (threads can't be killed)
+
+_DONE = object()
+
+
+class LoopTask:
+    def __init__(self, key, module, func):
+        self.key = key
+        self.module = module
+        self.func = func
+        self.state = "starting"
+        self.ready_at = None
+        self.step_started = None
+        self.steps = 0
+        self.restarts = 0
+        self.gen = None
+        self.step = None            # Future of the step running on the pool
+
+    async def run(self, loop, pool, t0, on_ready):
+        backoff = BACKOFF_MIN
+        step_time = metrics.histogram("loop_step_seconds", loop=self.key)
+        metrics.gauge("loop_restarts_total", lambda: self.restarts, loop=self.key)
+        while True:
+            try:
+                # Imports touch hardware and take a while: off the event loop too
+                module = await loop.run_in_executor(pool, importlib.import_module, self.module)
+                self.gen = getattr(module, self.func)()
+                while True:
+                    self.step_started = time.monotonic()
+                    # Shielded: cancelling the task must not abandon a step mid-I/O
+                    self.step = loop.run_in_executor(pool, next, self.gen, _DONE)
+                    delay = await asyncio.shield(self.step)
+                    step_time.record(int((time.monotonic() - self.step_started) * 1e9))
+                    self.step_started = None
+                    if delay is _DONE:
+                        raise RuntimeError("loop returned")
+                    self.steps += 1
+                    if self.ready_at is None:
+                        self.state = "ready"
+                        self.ready_at = time.monotonic()
+                        print(f"✅ {self.key} ready ({self.ready_at - t0:.1f}s)")
+                        on_ready()
+                    await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                raise
+            except hal.ReplayFinished:
+                self.state = "finished"
+                print(f"⏹️ {self.key}: end of replay")
+                return
+            except (Exception, SystemExit) as e:
+                # A module's sys.exit() must not take the other loops down
+                self.step_started = None
+                now = time.monotonic()
+                if self.ready_at is not None and now - self.ready_at >= STABLE_AFTER:
+                    backoff = BACKOFF_MIN
+                self.state = "backoff"
+                self.ready_at = None
+                self.restarts += 1
+                print(f"♻️ {self.key} failed ({e!r}), restarting in {backoff:.0f}s")
+                await loop.run_in_executor(pool, self.close)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, BACKOFF_MAX)
+                self.state = "starting"
+
+    def close(self):
+        # Runs the generator's finally blocks (close ports, flush tracks)
+        if self.gen is not None:
+            try:
+                self.gen.close()
+            except Exception as e:
+                print(f"⚠️ {self.key} cleanup error: {e}")
+            self.gen = None
+
+
+class CarRuntime:
+    def __init__(self, loops=LOOPS):
+        self.tasks = [LoopTask(*spec) for spec in loops]
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix="car-io")
+        self.all_ready = asyncio.Event()
+        self.stop = asyncio.Event()
+
+    def _on_ready(self):
+        if all(t.state == "ready" for t in self.tasks):
+            self.all_ready.set()
+
+    def print_stats(self, now, prev):
+        s = proc_stats(os.getpid())
+        cpu_pct = 100.0 * (s["cpu"] - prev[0]) / max(now - prev[1], 1e-3)
+        print("📊 Loop                  State     Steps/s  Restarts")
+        for t in self.tasks:
+            stalled = ""
+            if t.step_started is not None and now - t.step_started > STALL_AFTER:
+                stalled = f"  ⚠️ step running {now - t.step_started:.0f}s"
+            print(f"   {t.key:<20}  {t.state:<8}  {t.steps / max(now - prev[1], 1e-3):7.1f}  {t.restarts:>8}{stalled}")
+            t.steps = 0
+        print(f"   Process CPU {cpu_pct:.1f}% | RSS {s['rss_kb'] / 1024:.1f} MB | PSS {s['pss_kb'] / 1024:.1f} MB")
+        return s["cpu"], now
+
+    async def run(self, exit_when_ready=False):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop.set)
+        try:
+            os.sched_setaffinity(0, RUNTIME_CPUS)
+        except (OSError, AttributeError):
+            pass
+
+        metrics.start_exporter("car_runtime")
+        t0 = time.monotonic()
+        print("🚀 Starting I-SARTHI Road Monitor (single process)...")
+        runners = [asyncio.create_task(t.run(loop, self.pool, t0, self._on_ready)) for t in self.tasks]
+        stop = asyncio.create_task(self.stop.wait())
+        try:
+            ready = asyncio.create_task(self.all_ready.wait())
+            await asyncio.wait([ready, stop], return_when=asyncio.FIRST_COMPLETED)
+            if self.all_ready.is_set():
+                s = proc_stats(os.getpid())
+                print(f"✅ All Loops Running! (ready in {time.monotonic() - t0:.1f}s, {s['pss_kb'] / 1024:.0f} MB PSS)")
+                if exit_when_ready:
+                    print("READY " + json.dumps({"mode": "single", "ready_s": round(time.monotonic() - t0, 3),
+                                                 "rss_kb": s["rss_kb"], "pss_kb": s["pss_kb"]}), flush=True)
+                    await asyncio.sleep(5.0)
+                    s = proc_stats(os.getpid())
+                    print("STEADY " + json.dumps({"mode": "single", "rss_kb": s["rss_kb"], "pss_kb": s["pss_kb"]}), flush=True)
+                    return
+
+            prev = (proc_stats(os.getpid())["cpu"], time.monotonic())
+            while not self.stop.is_set():
+                try:
+                    await asyncio.wait_for(self.stop.wait(), STATS_INTERVAL)
+                except asyncio.TimeoutError:
+                    prev = self.print_stats(time.monotonic(), prev)
+        finally:
+            print("\n🛑 Stopping all loops...")
+            stop.cancel()
+            for r in runners:
+                r.cancel()
+            await asyncio.gather(*runners, return_exceptions=True)
+            steps = [t.step for t in self.tasks if t.step is not None and not t.step.done()]
+            if steps:
+                await asyncio.wait(steps, timeout=STOP_TIMEOUT)
+            for t in self.tasks:
+                await loop.run_in_executor(self.pool, t.close)
+            # A step stuck in bus I/O can't be interrupted; don't wait for it
+            self.pool.shutdown(wait=False)
+            hal.close()
+            print("✅ System Shutdown Complete.")
+
+
+def main(exit_when_ready=False):
+    asyncio.run(CarRuntime().run(exit_when_ready=exit_when_ready))
+
+
+if __name__ == "__main__":
+    import sys
+    main(exit_when_ready="--exit-when-ready" in sys.argv)
@@ -1,13 +1,26 @@
+import os
 import cv2
 import time
-import requests
-import json
-from flask import Flask, Response
+import threading
+import alert_dispatcher
+import sample_bus
+import bus_uploader
+import metrics
+import video_ring
+import service_loop
+from flask import Flask, Response, jsonify
+from vision_pipeline import FrameGrabber, FrameBroadcaster, StageStats
+from face_tracking import FaceTracker
+from vision_governor import VisionGovernor
+import hal
 
 app = Flask(__name__)
 
 # -------- Configuration --------
-SERVER_URL = "http://localhost:5000/api/drowsiness"
+# State goes out on the sample bus after every frame; bus_uploader.py posts
+# it to /api/drowsiness (on change, else every 2 s)
+# Camera index, or a recorded video file / image folder to replay
+CAMERA_SOURCE = os.environ.get("DROWSINESS_SOURCE", "0")
 
 # Tuned Parameters (Stricter Eyes)
 FACE_SCALE_FACTOR = 1.1  # Keep face detection sensitive
@@ -18,135 +31,227 @@ EYE_SCALE_FACTOR = 1.1
 EYE_MIN_NEIGHBORS = 5     # INCREASED: Harder to find eyes -> Easier to trigger "Closed"
 EYE_MIN_SIZE = (22, 22)   # INCREASED: Ensure only distinct eyes are counted
 
+# Tracking Mode: full face detection every N frames, template tracking in
+# between, eye search only in the upper face band (see face_tracking.py)
+TRACKING_MODE = True
+
+# Per-frame processing budget held by the governor (vision_governor.py): under
+# load it lowers the resolution, coarsens the face cascade and skips frames.
+# The eye cascade is never coarsened (a missed eye reads as "closed"), and
+# frames are processed at least every vision_governor.MAX_FRAME_GAP.
+LATENCY_BUDGET_MS = 60
+# Keep the last seconds of (annotated) video and save a clip around every
+# drowsy event (video_ring.py)
+CLIP_RECORDING = True
+
 DROWSINESS_THRESHOLD_SECONDS = 1.5 # Faster trigger
 MIN_EYES_OPEN = 1 # At least one eye must be detected to be "awake"
+CRITICAL_EVENTS = 10 # Beyond this many events, an SMS alert goes out (see alert_dispatcher.py)
+# The per-frame DEBUG line, at most this often (0 = every frame). Timings
+# and counts are on /metrics.
+DEBUG_PRINT_INTERVAL = 1.0
 
-# Global State
-camera = None
+# Global State (written only by the detection worker)
 eyes_closed_start_time = None
 current_drowsy = False
 drowsiness_events_count = 0
-last_api_update = 0
+last_debug_print = None
 
-def send_alert(is_drowsy, event_count):
-    try:
-        payload = {"isDrowsy": is_drowsy, "events": event_count}
-        headers = {'Content-Type': 'application/json'}
-        requests.post(SERVER_URL, data=json.dumps(payload), headers=headers, timeout=0.1)
-    except Exception:
-        pass
+# Pipeline: capture thread -> detection worker -> broadcaster (encodes once for all viewers)
+grabber = None
+governor = None
+broadcaster = FrameBroadcaster("drowsiness")
+clips = video_ring.attach(broadcaster) if CLIP_RECORDING else None
+stats = {
+    "detect": StageStats("detect"),
+    "overlay": StageStats("overlay"),
+}
+_engine_lock = threading.Lock()
+_worker = None
+# Liveness for start_car.py: a beat per processed frame (or while the camera is away)
+heartbeat = service_loop.Heartbeat()
 
-def generate_frames():
-    global camera, eyes_closed_start_time, current_drowsy, drowsiness_events_count, last_api_update
-    
+def open_camera():
+    return hal.open_camera(CAMERA_SOURCE, realtime=True)
+
+def cascade_params(level=None):
+    # (face_params, eye_params): the tuned values above, or as a governor
+    # level has them (sizes follow the processing resolution)
+    if level is None:
+        return ({"scaleFactor": FACE_SCALE_FACTOR, "minNeighbors": FACE_MIN_NEIGHBORS, "minSize": FACE_MIN_SIZE},
+                {"scaleFactor": EYE_SCALE_FACTOR, "minNeighbors": EYE_MIN_NEIGHBORS, "minSize": EYE_MIN_SIZE})
+    face = max(24, int(FACE_MIN_SIZE[0] * level["scale"] * level["min_size"]))   # Haar face window is 24 px
+    eye = int(EYE_MIN_SIZE[0] * level["scale"])
+    return ({"scaleFactor": max(FACE_SCALE_FACTOR, level["scale_factor"]), "minNeighbors": FACE_MIN_NEIGHBORS,
+             "minSize": (face, face)},
+            {"scaleFactor": EYE_SCALE_FACTOR, "minNeighbors": EYE_MIN_NEIGHBORS, "minSize": (eye, eye)})
+
+def detect(gray, face_cascade, eye_cascade, params=None):
+    # Returns (faces, [(face, eyes), ...])
+    face_params, eye_params = params or cascade_params()
+    faces = face_cascade.detectMultiScale(gray, **face_params)
+
+    results = []
+    for (x, y, w, h) in faces:
+        roi_gray = gray[y:y + h, x:x + w]
+
+        # Detect Eyes in ROI
+        eyes = eye_cascade.detectMultiScale(roi_gray, **eye_params)
+        results.append(((x, y, w, h), eyes))
+    return faces, results
+
+def make_tracker(face_cascade, eye_cascade, params=None):
+    face_params, eye_params = params or cascade_params()
+    return FaceTracker(face_cascade, eye_cascade, face_params=face_params, eye_params=eye_params)
+
+def update_state(face_count, eyes_detected, now):
+    global eyes_closed_start_time, current_drowsy, drowsiness_events_count, last_debug_print
+
+    # Drowsiness Logic: Face present but NO EYES detected (or closed)
+    face_present = face_count > 0
+    eyes_closed = face_present and eyes_detected < MIN_EYES_OPEN
+
+    # Debug Print (CRITICAL for User to see)
+    if last_debug_print is None or now - last_debug_print >= DEBUG_PRINT_INTERVAL:
+        last_debug_print = now
+        print(f"DEBUG: Faces={face_count}, Eyes={eyes_detected}, TimeClosed={0 if eyes_closed_start_time is None else round(now - eyes_closed_start_time, 2)}s")
+
+    if eyes_closed:
+        if eyes_closed_start_time is None:
+            eyes_closed_start_time = now
+
+        duration = now - eyes_closed_start_time
+        if duration >= DROWSINESS_THRESHOLD_SECONDS:
+            if not current_drowsy:
+                current_drowsy = True
+                drowsiness_events_count += 1
+                if clips is not None:
+                    clips.trigger("drowsy", now)
+                # --- CRITICAL DROWSINESS ALERT (GSM) ---
+                # Once per new event past the limit; the dispatcher de-duplicates and
+                # rate-limits, and sends from its own thread
+                if drowsiness_events_count > CRITICAL_EVENTS:
+                    print(f"🚨 CRITICAL: Drowsiness events > {CRITICAL_EVENTS}. Raising SMS alert...")
+                    alert_dispatcher.raise_alert("drowsiness", {"events": drowsiness_events_count})
+
+        # If closed for > 1s, show warning in console
+        if duration > 1.0:
+             print(f"⚠️ Eyes Closed for {duration:.2f}s...")
+
+    else:
+        eyes_closed_start_time = None
+        if current_drowsy:
+            print("✅ Eyes Opened. Status: Active")
+            current_drowsy = False
+
+    sample_bus.publish("drowsiness", t=now, drowsy=current_drowsy, events=drowsiness_events_count,
+                       faces=min(face_count, 255), eyes=min(eyes_detected, 255),
+                       closed_s=0.0 if eyes_closed_start_time is None else now - eyes_closed_start_time)
+
+def draw_overlay(frame, results, face_count, eyes_detected):
+    for (x, y, w, h), eyes in results:
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
+        roi_color = frame[y:y + h, x:x + w]
+        for (ex, ey, ew, eh) in eyes:
+            cv2.rectangle(roi_color, (ex, ey), (ex + ew, ey + eh), (0, 255, 0), 2)
+
+    # Overlay Info
+    status = "DROWSY!" if current_drowsy else "Active"
+    color = (0, 0, 255) if current_drowsy else (0, 255, 0)
+
+    cv2.putText(frame, f"Status: {status}", (20, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+    cv2.putText(frame, f"Faces: {face_count} Eyes: {eyes_detected}", (20, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    cv2.putText(frame, f"Events: {drowsiness_events_count}", (20, 130), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+
+def detection_loop():
     # Load Classifiers
     face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
     eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye_tree_eyeglasses.xml")
+    params = cascade_params(governor.level)
+    tracker = make_tracker(face_cascade, eye_cascade, params) if TRACKING_MODE else None
 
-    if camera is None or not camera.isOpened():
-        camera = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+    def apply_level(level):
+        # Runs on this thread (from governor.observe); box coordinates change with the resolution
+        nonlocal params
+        params = cascade_params(level)
+        if tracker is not None:
+            tracker.face_params, tracker.eye_params = params
+            tracker.reset()
+    governor.on_change = apply_level
 
+    seq = 0
     while True:
-        success, frame = camera.read()
-        if not success:
-            break
+        item = grabber.next_frame(seq, timeout=1.0)
+        if item is None:
+            if not grabber.connected:
+                heartbeat.beat()
+            continue
+        seq, captured_at, frame = item
+        heartbeat.beat()
+        if not governor.take(captured_at):
+            continue
 
+        started = t0 = time.perf_counter()
+        frame = governor.fit(frame)
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         gray = cv2.equalizeHist(gray)
-
-        # Better Face Detection
-        faces = face_cascade.detectMultiScale(
-            gray, 
-            scaleFactor=FACE_SCALE_FACTOR, 
-            minNeighbors=FACE_MIN_NEIGHBORS, 
-            minSize=FACE_MIN_SIZE
-        )
-
-        eyes_detected = 0
-        
-        # Process Faces
-        for (x, y, w, h) in faces:
-            roi_gray = gray[y:y + h, x:x + w]
-            roi_color = frame[y:y + h, x:x + w]
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-            
-            # Detect Eyes in ROI
-            eyes = eye_cascade.detectMultiScale(
-                roi_gray,
-                scaleFactor=EYE_SCALE_FACTOR,
-                minNeighbors=EYE_MIN_NEIGHBORS,
-                minSize=EYE_MIN_SIZE
-            )
-            
-            eyes_detected += len(eyes)
-            
-            for (ex, ey, ew, eh) in eyes:
-                cv2.rectangle(roi_color, (ex, ey), (ex + ew, ey + eh), (0, 255, 0), 2)
-
-        # Drowsiness Logic: Face present but NO EYES detected (or closed)
-        face_present = len(faces) > 0
-        eyes_closed = face_present and eyes_detected < MIN_EYES_OPEN
-        
-        # Debug Print (CRITICAL for User to see)
-        print(f"DEBUG: Faces={len(faces)}, Eyes={eyes_detected}, TimeClosed={0 if eyes_closed_start_time is None else round(time.time() - eyes_closed_start_time, 2)}s")
-
-        now = time.time()
-
-        if eyes_closed:
-            if eyes_closed_start_time is None:
-                eyes_closed_start_time = now
-            
-            duration = now - eyes_closed_start_time
-            if duration >= DROWSINESS_THRESHOLD_SECONDS:
-                if not current_drowsy:
-                    current_drowsy = True
-                    drowsiness_events_count += 1
-                    send_alert(True, drowsiness_events_count)
-            
-            # If closed for > 1s, show warning in console
-            if duration > 1.0:
-                 print(f"⚠️ Eyes Closed for {duration:.2f}s...")
-                 
+        if tracker is not None:
+            faces, results = tracker.process(gray)
         else:
-            eyes_closed_start_time = None
-            if current_drowsy:
-                print("✅ Eyes Opened. Status: Active")
-                current_drowsy = False
-                send_alert(False, drowsiness_events_count)
-
-        # Periodic API Sync
-        if now - last_api_update > 2.0:
-            # heartbeat
-            send_alert(current_drowsy, drowsiness_events_count)
-            last_api_update = now
-            
-        # --- CRITICAL DROWSINESS ALERT (GSM) ---
-        if drowsiness_events_count > 10 and drowsiness_events_count % 5 == 1: 
-            # Trigger every 10th+ event (throttle slightly)
-            try:
-                print("🚨 CRITICAL: Drowsiness events > 10. Sending SMS...")
-                payload = {"type": "drowsiness"}
-                requests.post("http://localhost:5000/api/sos", json=payload, timeout=1)
-            except:
-                pass
-
-        # Overlay Info
-        status = "DROWSY!" if current_drowsy else "Active"
-        color = (0, 0, 255) if current_drowsy else (0, 255, 0)
-        
-        cv2.putText(frame, f"Status: {status}", (20, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
-        cv2.putText(frame, f"Faces: {len(faces)} Eyes: {eyes_detected}", (20, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        cv2.putText(frame, f"Events: {drowsiness_events_count}", (20, 130), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame_bytes = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            faces, results = detect(gray, face_cascade, eye_cascade, params)
+        eyes_detected = sum(len(eyes) for _, eyes in results)
+        stats["detect"].record(t0)
+
+        # Timing uses the capture timestamp, not when we got around to it
+        update_state(len(faces), eyes_detected, captured_at)
+
+        # Annotated frames are only needed while someone is watching (or for the clip ring)
+        if broadcaster.wants_frames(captured_at):
+            t0 = time.perf_counter()
+            draw_overlay(frame, results, len(faces), eyes_detected)
+            stats["overlay"].record(t0)
+            broadcaster.publish(frame, captured_at)
+        governor.observe(started)
+
+def start_engine():
+    # Detection runs whether or not anyone is streaming
+    global grabber, governor, _worker
+    with _engine_lock:
+        if _worker is None:
+            bus_uploader.start_background(("drowsiness",))
+            grabber = FrameGrabber(open_camera, name="drowsiness").start()
+            governor = VisionGovernor("drowsiness", LATENCY_BUDGET_MS, grabber=grabber, broadcaster=broadcaster)
+            _worker = threading.Thread(target=detection_loop, name="drowsiness-detect", daemon=True)
+            _worker.start()
+
+def generate_frames():
+    # Every viewer shares the single detection pipeline and the same JPEG bytes
+    start_engine()
+    return broadcaster.stream()
 
 @app.route('/video_feed')
 def video_feed():
     return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(module="drowsiness_detector"), mimetype=metrics.CONTENT_TYPE)
+
+@app.route('/stats')
+def pipeline_stats():
+    start_engine()
+    return jsonify({
+        "capture": dict(grabber.stats.snapshot(), dropped=grabber.dropped, connected=grabber.connected),
+        **{name: s.snapshot() for name, s in stats.items()},
+        "encode": dict(broadcaster.stats.snapshot(), skipped=broadcaster.skipped),
+        "viewers": broadcaster.subscribers,
+        "governor": governor.snapshot(),
+        "drowsy": current_drowsy,
+        "events": drowsiness_events_count,
+    })
+
 if __name__ == '__main__':
     print("Starting Optimized Drowsiness Detector (Haar)...")
+    start_engine()
+    heartbeat.ready()
     app.run(host='0.0.0.0', port=5001, threaded=True)
@@ -0,0 +1,137 @@
+import cv2
+
+# --- Configuration ---
+# Full-frame face detection is the most expensive step of the drowsiness
+# pipeline. In tracking mode we only run it every DETECT_EVERY_N frames (or
+# when the tracker loses confidence) and follow the face with cheap template
+# matching in between. The eye cascade only looks at the upper half of a
+# downscaled face crop.
+DETECT_EVERY_N = 10
+MIN_TRACK_CONFIDENCE = 0.55     # TM_CCOEFF_NORMED score below this forces a re-detect
+TRACK_SCALE = 0.5               # Template matching runs on a half-resolution crop
+SEARCH_MARGIN = 0.35            # Search window = face box grown by this fraction per side
+FACE_SIZE_CLAMP = (0.75, 1.35)  # Re-detect only at scales near the last seen face size
+EYE_ROI_FACE_WIDTH = 160        # Face crops are downscaled to about this width for eyes
+EYE_REGION = (0.15, 0.6)        # Eyes sit in this vertical band of the face box
+HAAR_EYE_WINDOW = 20            # Training window of the eye cascade (px)
+
+
+class FaceTracker:
+    def __init__(self, face_cascade, eye_cascade, face_params, eye_params,
+                 detect_every_n=DETECT_EVERY_N, min_confidence=MIN_TRACK_CONFIDENCE):
+        # face_params / eye_params: dicts with scaleFactor, minNeighbors, minSize
+        self.face_cascade = face_cascade
+        self.eye_cascade = eye_cascade
+        self.face_params = face_params
+        self.eye_params = eye_params
+        self.detect_every_n = detect_every_n
+        self.min_confidence = min_confidence
+
+        self.box = None             # (x, y, w, h) in full-frame pixels
+        self.template = None        # Downscaled gray face patch
+        self.confidence = 0.0
+        self.frames_since_detect = 0
+
+        # Stats
+        self.full_detections = 0
+        self.tracked_frames = 0
+
+    def reset(self):
+        self.box = None
+        self.template = None
+        self.confidence = 0.0
+
+    def process(self, gray):
+        # Same contract as drowsiness_detector.detect():
+        # returns (faces, [((x, y, w, h), eyes_relative_to_face), ...])
+        tracked = False
+        if (self.box is not None and self.frames_since_detect < self.detect_every_n
+                and self.confidence >= self.min_confidence):
+            tracked = self._track(gray)
+
+        if not tracked:
+            self._detect(gray)
+
+        if self.box is None:
+            return [], []
+
+        face = self.box
+        return [face], [(face, self._find_eyes(gray, face))]
+
+    # --- Full detection (scale-clamped when we know the face size) ---
+    def _detect(self, gray):
+        params = dict(self.face_params)
+        if self.box is not None:
+            w = self.box[2]
+            lo, hi = FACE_SIZE_CLAMP
+            min_side = max(params["minSize"][0], int(w * lo))
+            params["minSize"] = (min_side, min_side)
+            params["maxSize"] = (int(w * hi), int(w * hi))
+
+        faces = self.face_cascade.detectMultiScale(gray, **params)
+        if len(faces) == 0 and "maxSize" in params:
+            # Driver moved closer/further than the clamp allows: unclamped retry
+            faces = self.face_cascade.detectMultiScale(gray, **self.face_params)
+
+        self.full_detections += 1
+        self.frames_since_detect = 0
+        if len(faces) == 0:
+            self.reset()
+            return
+
+        # The driver is the largest face in the cabin camera
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        self.box = (int(x), int(y), int(w), int(h))
+        self.template = cv2.resize(gray[y:y + h, x:x + w], None, fx=TRACK_SCALE, fy=TRACK_SCALE,
+                                   interpolation=cv2.INTER_AREA)
+        self.confidence = 1.0
+
+    # --- Cheap tracking between detections ---
+    def _track(self, gray):
+        x, y, w, h = self.box
+        mx, my = int(w * SEARCH_MARGIN), int(h * SEARCH_MARGIN)
+        H, W = gray.shape[:2]
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(W, x + w + mx), min(H, y + h + my)
+
+        search = cv2.resize(gray[y0:y1, x0:x1], None, fx=TRACK_SCALE, fy=TRACK_SCALE,
+                            interpolation=cv2.INTER_AREA)
+        th, tw = self.template.shape[:2]
+        if search.shape[0] < th or search.shape[1] < tw:
+            return False
+
+        scores = cv2.matchTemplate(search, self.template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (bx, by) = cv2.minMaxLoc(scores)
+        self.confidence = best
+        self.frames_since_detect += 1
+        if best < self.min_confidence:
+            return False
+
+        self.box = (x0 + int(bx / TRACK_SCALE), y0 + int(by / TRACK_SCALE), w, h)
+        self.tracked_frames += 1
+        return True
+
+    # --- Eyes: upper band of a downscaled face crop ---
+    def _find_eyes(self, gray, face):
+        x, y, w, h = face
+        top, bottom = EYE_REGION
+        ey0, ey1 = y + int(h * top), y + int(h * bottom)
+        roi = gray[ey0:ey1, x:x + w]
+        if roi.size == 0:
+            return []
+
+        scale = min(1.0, EYE_ROI_FACE_WIDTH / float(w))
+        if scale < 1.0:
+            roi = cv2.resize(roi, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        params = dict(self.eye_params)
+        min_eye = max(HAAR_EYE_WINDOW, int(round(params["minSize"][0] * scale)))
+        max_eye = max(min_eye + 1, int(w * scale * 0.5))
+        params["minSize"] = (min_eye, min_eye)
+        params["maxSize"] = (max_eye, max_eye)
+
+        eyes = self.eye_cascade.detectMultiScale(roi, **params)
+        # Back to face-relative, full-resolution coordinates
+        offset = ey0 - y
+        return [(int(ex / scale), int(ey / scale) + offset, int(ew / scale), int(eh / scale))
+                for (ex, ey, ew, eh) in eyes]
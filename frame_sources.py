@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import cv2
+
+# --- Frame sources ---
+# Everything the vision modules read frames from looks like a
+# cv2.VideoCapture (isOpened / read / release), so a recorded clip or a folder
+# of images can stand in for the live camera.
+#
+# realtime=False delivers frames as fast as they can be decoded (benchmarks);
+# realtime=True paces them at the recording's frame rate (replaying a drive).
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# Live cameras: V4L2 on Linux (the Pi), DirectShow on Windows. USB webcams
+# only reach 30 fps at 640x480 and up in MJPG, and a one-frame driver queue
+# keeps what we read current.
+CAMERA_FOURCC = "MJPG"
+CAMERA_BUFFERS = 1
+
+
+def camera_backend():
+    if sys.platform.startswith("linux"):
+        return cv2.CAP_V4L2
+    if sys.platform == "win32":
+        return cv2.CAP_DSHOW
+    return cv2.CAP_ANY
+
+
+class _PacedSource:
+    def __init__(self, fps, realtime, loop):
+        self.fps = fps or 30.0
+        self.realtime = realtime
+        self.loop = loop
+        self.index = 0              # Frames delivered so far
+        self.timestamp = 0.0        # Media time of the last frame (seconds)
+        self._start = None
+
+    def _pace(self):
+        self.timestamp = self.index / self.fps
+        if self.realtime:
+            if self._start is None:
+                self._start = time.monotonic()
+            delay = self._start + self.timestamp - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.index += 1
+
+
+class CameraSource:
+    # index: camera number or a device path (/dev/video2)
+    def __init__(self, index=0, backend=None):
+        self.capture = cv2.VideoCapture(index, camera_backend() if backend is None else backend)
+        if not self.capture.isOpened():
+            # Backend not built into this OpenCV: let it pick
+            self.capture = cv2.VideoCapture(index)
+        if self.capture.isOpened():
+            if CAMERA_FOURCC:
+                self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*CAMERA_FOURCC))
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, CAMERA_BUFFERS)
+        self.timestamp = 0.0
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        ok, frame = self.capture.read()
+        self.timestamp = time.time()
+        return ok, frame
+
+    def set_size(self, width, height):
+        # The driver picks the nearest mode it supports; returns that
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        return int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource(_PacedSource):
+    def __init__(self, path, realtime=False, loop=False):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        super().__init__(self.capture.get(cv2.CAP_PROP_FPS), realtime, loop)
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        ok, frame = self.capture.read()
+        if not ok and self.loop and self.index > 0:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read()
+        if ok:
+            self._pace()
+        return ok, frame
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageDirSource(_PacedSource):
+    def __init__(self, path, fps=30.0, realtime=False, loop=False):
+        self.path = path
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self._pos = 0
+        self._open = True
+        super().__init__(fps, realtime, loop)
+
+    def isOpened(self):
+        return self._open and bool(self.files)
+
+    def read(self):
+        if self._pos >= len(self.files):
+            if not (self.loop and self.files):
+                return False, None
+            self._pos = 0
+        frame = cv2.imread(self.files[self._pos])
+        self._pos += 1
+        if frame is None:
+            return False, None
+        self._pace()
+        return True, frame
+
+    def release(self):
+        self._open = False
+
+
+def open_source(spec, realtime=True, loop=False, fps=30.0):
+    # spec: camera index ("0", 1) or device (/dev/video0), a video file, or a directory of images
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CameraSource(int(spec))
+    if str(spec).startswith("/dev/video"):
+        return CameraSource(spec)
+    if os.path.isdir(spec):
+        return ImageDirSource(spec, fps=fps, realtime=realtime, loop=loop)
+    return VideoFileSource(spec, realtime=realtime, loop=loop)
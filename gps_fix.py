@@ -0,0 +1,95 @@
+import os
+import mmap
+import struct
+import tempfile
+import time
+
+# --- Latest GPS fix, shared between processes ---
+# gps_tracker writes every valid fix into a tiny memory-mapped file; any other
+# module (hazard tagging, alerts, ...) reads it without touching the UART or
+# the server. A sequence counter (odd while a write is in progress) lets
+# readers detect and retry torn reads.
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+FIX_PATH = os.environ.get("ISARTHI_GPS_FIX", os.path.join(SHM_DIR, "isarthi_gps_fix"))
+STALE_AFTER = 5.0   # Seconds; older fixes are ignored by default
+# GPS + IMU estimate from position_fusion (50 Hz, same layout)
+FUSED_PATH = os.environ.get("ISARTHI_GPS_FUSED", os.path.join(SHM_DIR, "isarthi_gps_fused"))
+FUSED_STALE_AFTER = 0.5
+
+# seq, timestamp, lat, lon, speed km/h, heading deg, hdop, satellites
+LAYOUT = struct.Struct("<Qdddfffh")
+
+
+class FixSlot:
+    def __init__(self, path=FIX_PATH):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < LAYOUT.size:
+                os.ftruncate(fd, LAYOUT.size)
+            self.mm = mmap.mmap(fd, LAYOUT.size)
+        finally:
+            os.close(fd)
+
+    def write(self, lat, lon, speed=0.0, heading=float("nan"), hdop=float("nan"), satellites=-1, timestamp=None):
+        seq = struct.unpack_from("<Q", self.mm, 0)[0]
+        if seq % 2:
+            seq += 1  # A previous writer died mid-write
+        struct.pack_into("<Q", self.mm, 0, seq + 1)
+        LAYOUT.pack_into(self.mm, 0, seq + 1, time.time() if timestamp is None else timestamp,
+                         lat, lon, speed, heading, hdop, satellites)
+        struct.pack_into("<Q", self.mm, 0, seq + 2)
+
+    def read(self, max_age=STALE_AFTER):
+        # Returns the latest fix as a dict, or None if there is none (or it is stale)
+        for _ in range(10):
+            values = LAYOUT.unpack_from(self.mm, 0)
+            if values[0] % 2 == 0 and struct.unpack_from("<Q", self.mm, 0)[0] == values[0]:
+                break
+        else:
+            return None
+        seq, ts, lat, lon, speed, heading, hdop, sats = values
+        if seq == 0 or (max_age is not None and time.time() - ts > max_age):
+            return None
+        return {
+            "timestamp": ts,
+            "latitude": lat,
+            "longitude": lon,
+            "speed": speed,
+            "heading": heading,
+            "hdop": hdop,
+            "satellites": sats,
+        }
+
+
+_slots = {}
+
+
+def _get_slot(path=FIX_PATH):
+    slot = _slots.get(path)
+    if slot is None:
+        slot = _slots[path] = FixSlot(path)
+    return slot
+
+
+def write_fix(lat, lon, **kwargs):
+    _get_slot().write(lat, lon, **kwargs)
+
+
+def read_fix(max_age=STALE_AFTER):
+    try:
+        return _get_slot().read(max_age)
+    except OSError:
+        return None
+
+
+def read_fused(max_age=FUSED_STALE_AFTER):
+    try:
+        return _get_slot(FUSED_PATH).read(max_age)
+    except OSError:
+        return None
+
+
+def read_best(max_age=STALE_AFTER):
+    # Fused GPS+IMU position when position_fusion is running, else the last GPS fix
+    return read_fused() or read_fix(max_age)
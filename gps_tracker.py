@@ -1,7 +1,11 @@
 import time
-import requests
-import serial
-import pynmea2
+import gps_fix
+import sample_bus
+import metrics
+import hal
+import trajectory
+import service_loop
+from nmea_stream import NmeaReader, FixFuser, ubx_set_rate, ubx_set_uart_baud, ubx_set_nmea_output
 
 # --- Config ---
 SERVER_URL = "http://10.137.73.214:5000/api/location"
@@ -11,57 +15,135 @@ SERVER_URL = "http://10.137.73.214:5000/api/location"
 # LCD is using UART3/GPIO 4/5 (TP_INT)
 # SO WE MOVE GPS TO UART5 (GPIO 12/13)
 # YOU MUST ENABLE UART5: Add 'dtoverlay=uart5' to /boot/firmware/config.txt
-SERIAL_PORT = "/dev/ttyAMA5" 
-BAUD_RATE = 9600
+SERIAL_PORT = "/dev/ttyAMA5"
+BAUD_RATE = 9600            # Receiver's power-on default
+
+# High-rate mode: the receiver is switched to FAST_BAUD_RATE and
+# UPDATE_RATE_HZ at startup (u-blox UBX commands). Set to None to leave the
+# receiver at its defaults.
+FAST_BAUD_RATE = 115200
+UPDATE_RATE_HZ = 10
+UPLOAD_INTERVAL = 1.0       # Seconds between live positions sent to the server by bus_uploader.py
+# History goes up as compressed track segments (trajectory.py) instead of a
+# sensor_logs row per fix; the live position above is then not logged.
+TRACK_UPLOAD = True
+READ_CHUNK = 4096
+
+FIXES = metrics.counter("gps_fixes_total")
+
+
+def sync_baud(ser, timeout=2.0):
+    # True if valid NMEA arrives at the port's current baud rate
+    reader = NmeaReader()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if reader.feed(ser.read(max(1, ser.in_waiting))):
+            return True
+    return False
+
+
+def configure_receiver(ser):
+    # Receivers keep their port settings until power-off, so first check
+    # whether a previous run already switched it to the fast baud rate.
+    if FAST_BAUD_RATE is None or UPDATE_RATE_HZ is None:
+        return
+    ser.baudrate = FAST_BAUD_RATE
+    if not sync_baud(ser):
+        ser.baudrate = BAUD_RATE
+        ser.write(ubx_set_uart_baud(FAST_BAUD_RATE))
+        ser.flush()
+        hal.sleep(0.1)
+        ser.baudrate = FAST_BAUD_RATE
+    for sentence in ("GSV", "GSA", "GLL"):
+        ser.write(ubx_set_nmea_output(sentence, False))
+    ser.write(ubx_set_rate(UPDATE_RATE_HZ))
+    ser.flush()
+    ser.reset_input_buffer()
+    if sync_baud(ser):
+        print(f"⚡ GPS configured: {UPDATE_RATE_HZ} Hz @ {FAST_BAUD_RATE} baud")
+    else:
+        # Not a u-blox receiver (or it ignored us): back to the defaults
+        print("⚠️ GPS did not accept high-rate config, staying at 1 Hz")
+        ser.baudrate = BAUD_RATE
+
 
 def read_gps():
+    # One serial session; yields after every chunk read
+    track = None
     try:
-        # Open Serial Port
-        with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
+        # Open Serial Port (short timeout: read() returns whatever has arrived)
+        with hal.open_serial(SERIAL_PORT, BAUD_RATE, timeout=0.05) as ser:
             print(f"📡 GPS Tracker Started on {SERIAL_PORT}")
-            
+            configure_receiver(ser)
+
+            reader = NmeaReader()
+            fuser = FixFuser()
+            last_upload = 0.0
+            track = trajectory.TrackUploader() if TRACK_UPLOAD else None
+            last_status = hal.monotonic()
+            waiting_printed = False
+
             while True:
-                # Read line from GPS
-                try:
-                    line = ser.readline().decode('utf-8', errors='ignore')
-                    
-                    # Look for GPGGA or GPRMC sentences
-                    # GPRMC is better for Speed + Coords
-                    if "$GPRMC" in line:
-                        msg = pynmea2.parse(line)
-                        
-                        if msg.status == 'A': # A = Data Valid
-                            lat = msg.latitude
-                            lon = msg.longitude
-                            # Convert knots to km/h (1 knot = 1.852 km/h)
-                            speed = float(msg.spd_over_grnd) * 1.852
-                            
-                            payload = {
-                                'latitude': lat,
-                                'longitude': lon,
-                                'speed': speed
-                            }
-                            
-                            # Send to Server
-                            requests.post(SERVER_URL, json=payload, timeout=0.5)
-                            print(f"📍 Lat: {lat:.6f}, Lon: {lon:.6f}, Speed: {speed:.1f} km/h")
-                        else:
-                            print("Waiting for Satellite Fix... (Go outside!)")
-                            
-                except pynmea2.ParseError:
+                # Raw bytes, as many as are buffered; sentences can span chunks
+                chunk = ser.read(max(1, min(ser.in_waiting, READ_CHUNK)))
+                # The read itself waits (serial timeout); no extra sleep
+                yield 0
+                if not chunk:
                     continue
-                except Exception as e:
-                    # Ignore occasional read errors
-                    pass
-                    
+
+                for kind, fields in reader.feed(chunk):
+                    if kind == "RMC" and len(fields) > 2 and fields[2] != "A" and not waiting_printed:
+                        print("Waiting for Satellite Fix... (Go outside!)")
+                        waiting_printed = True
+
+                    fix = fuser.push(kind, fields)
+                    if fix is None:
+                        continue
+                    waiting_printed = False
+                    FIXES.inc()
+
+                    lat = fix['latitude']
+                    lon = fix['longitude']
+                    speed = fix['speed']
+
+                    # Every fix goes to the other modules on the car: the latest
+                    # one in gps_fix, the stream on the sample bus
+                    gps_fix.write_fix(lat, lon, speed=speed, heading=fix['heading'],
+                                      hdop=fix['hdop'], satellites=fix['satellites'])
+                    sample_bus.publish("gps_fix", t=time.time(), lat=lat, lon=lon, speed=speed,
+                                       heading=fix['heading'], hdop=fix['hdop'], satellites=fix['satellites'])
+
+                    if track is not None:
+                        track.add(time.time(), lat, lon, speed)
+
+                    # The live position goes up through bus_uploader.py
+                    now = hal.monotonic()
+                    if now - last_upload >= UPLOAD_INTERVAL:
+                        last_upload = now
+                        print(f"📍 Lat: {lat:.6f}, Lon: {lon:.6f}, Speed: {speed:.1f} km/h, Sats: {fix['satellites']}")
+
+                if hal.monotonic() - last_status >= 60.0:
+                    last_status = hal.monotonic()
+                    print(f"📈 GPS: {fuser.fixes} fixes | {reader.bad_checksum} bad checksums | {reader.garbage} bytes noise")
+                    if track is not None:
+                        print(f"🗜️ Track: {track.simplifier.kept}/{track.simplifier.seen} points kept | "
+                              f"{track.segments} segments, {track.bytes_sent} bytes")
+
     except Exception as e:
         print(f"❌ GPS Error: {e}")
         print("Check if Serial is enabled in raspi-config and wiring is correct.")
-        time.sleep(2)
+        yield 2
+    finally:
+        # Don't lose the last stretch of the trace on a serial error
+        if track is not None:
+            track.close()
+
+def tracker_loop():
+    while True:
+        yield from read_gps()
+        yield 1
 
 if __name__ == "__main__":
     # Install dependencies first:
-    # pip3 install pyserial pynmea2 requests
-    while True:
-        read_gps()
-        time.sleep(1)
+    # pip3 install pyserial requests
+    service_loop.run_blocking(tracker_loop())
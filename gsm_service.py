@@ -1,54 +1,132 @@
+import os
+import json
 import time
-import serial
-import requests
+import threading
+import socketserver
+
+import alert_dispatcher
+import service_loop
+from modem_engine import ModemEngine, ModemError, parse_cmti, GSM_PORT, BAUD_RATE, PRIORITY_NORMAL
 
 # --- Configuration ---
-GSM_PORT = "/dev/serial0"
-BAUD_RATE = 115200
-SERVER_URL = "http://localhost:5000/api/gsm-status"
+# The service owns the modem (modem_engine.py) and serves other modules over
+# a local Unix socket, one JSON request per line:
+#   {"op": "sms", "to": "+91...", "text": "...", "priority": 0}
+#   {"op": "at", "cmd": "AT+CSQ"}
+#   {"op": "status"}
+#   {"op": "alert", "kind": "crash", "detail": {...}}   (see alert_dispatcher.py)
+# gsm_utils.py is the client.
+SOCKET_PATH = os.environ.get("ISARTHI_GSM_SOCKET", "/tmp/isarthi_gsm.sock")
+STATUS_INTERVAL = 30        # Seconds between signal / registration polls
+
+engine = None
+alerts = None
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            try:
+                request = json.loads(raw)
+                reply = handle_request(request)
+            except (ValueError, KeyError) as e:
+                reply = {'ok': False, 'error': f"bad request: {e}"}
+            except ModemError as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+def handle_request(request):
+    op = request['op']
+    if op == 'sms':
+        t0 = time.monotonic()
+        ref = engine.send_sms(request['to'], request['text'], priority=request.get('priority', PRIORITY_NORMAL))
+        print(f"✅ SMS sent to {request['to']} (ref {ref}, {time.monotonic() - t0:.1f}s)")
+        return {'ok': True, 'ref': ref}
+    if op == 'at':
+        return {'ok': True, 'lines': engine.command(request['cmd'], timeout=request.get('timeout', 5.0))}
+    if op == 'status':
+        return dict(engine.status, ok=True, alerts=alerts.stats)
+    if op == 'alert':
+        # Queued; dedup, rate limiting and batching happen on the dispatcher thread
+        alerts.raise_alert(request['kind'], request.get('detail'), request.get('t'))
+        return {'ok': True}
+    return {'ok': False, 'error': f"unknown op '{op}'"}
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve():
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+    server = UnixServer(SOCKET_PATH, RequestHandler)
+    os.chmod(SOCKET_PATH, 0o660)
+    threading.Thread(target=server.serve_forever, name="gsm-api", daemon=True).start()
+    print(f"🔌 GSM API listening on {SOCKET_PATH}")
+    return server
+
+
+def on_new_sms(line):
+    # +CMTI arrives on the reader thread: fetch and delete the message from a worker
+    where = parse_cmti(line)
+    if where is None:
+        return
+
+    def fetch():
+        storage, index = where
+        try:
+            lines = engine.command(f"AT+CMGR={index}")
+            print(f"📨 Incoming SMS: {' | '.join(lines)}")
+            engine.command(f"AT+CMGD={index}")
+        except ModemError as e:
+            print(f"⚠️ Could not read SMS {storage}/{index}: {e}")
+
+    threading.Thread(target=fetch, daemon=True).start()
+
+
+def send_alert_sms(number, text, priority):
+    engine.send_sms(number, text, priority=priority)
+    return True
+
 
 def setup_gsm():
+    global engine
     try:
-        ser = serial.Serial(GSM_PORT, BAUD_RATE, timeout=1)
         print(f"📡 GSM Service: Connecting to {GSM_PORT}...")
-        
-        # Simple Handshake
-        ser.write(b'AT\r')
-        time.sleep(0.5)
-        resp = ser.read_all().decode('utf-8', errors='ignore')
-        
-        if "OK" in resp:
-            print("✅ GSM Module Connected & Ready!")
-            return ser
-        else:
-            print("⚠️ GSM Module not responding. Retrying...")
-            return None
+        engine = ModemEngine(GSM_PORT, BAUD_RATE).start()
+        engine.on_urc("+CMTI", on_new_sms)
+        engine.on_urc("+CREG", lambda line: print(f"📶 Network registration: {line}"))
+        print("✅ GSM Module Connected & Ready!")
+        return engine
     except Exception as e:
         print(f"❌ GSM Setup Error: {e}")
+        if engine is not None:
+            engine.close()
+        engine = None
         return None
 
-def main():
+def gsm_loop():
+    global alerts
     print("🚀 Starting GSM Background Service...")
-    ser = setup_gsm()
-    
+    while setup_gsm() is None:
+        print("⚠️ GSM Module not responding. Retrying...")
+        yield 5
+    alerts = alert_dispatcher.AlertDispatcher(send_alert_sms)
+    serve()
+
     while True:
-        if ser:
-            try:
-                # 1. Keep Alive / Check Network
-                # ser.write(b'AT+CREG?\r')
-                # time.sleep(0.1)
-                # resp = ser.read_all().decode('utf-8', errors='ignore')
-                
-                # 2. Check for Incoming SMS (CNMI should offer live updates, but polling is safer for simple logic)
-                # ser.write(b'AT+CMGL="REC UNREAD"\r')
-                
-                # Placeholder for future logic
-                pass
-            except:
-                pass
-        
+        # Keep Alive / Check Network (background priority: never delays an SMS)
+        try:
+            engine.registration()
+            engine.signal_quality()
+        except ModemError as e:
+            print(f"⚠️ GSM status check failed: {e}")
+
         # Wait before next check
-        time.sleep(5)
+        yield STATUS_INTERVAL
 
 if __name__ == "__main__":
-    main()
+    service_loop.run_blocking(gsm_loop())
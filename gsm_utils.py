@@ -1,67 +1,84 @@
-import serial
-import time
+import os
 import sys
+import json
+import socket
+
+import modem_engine
 
 # --- Configuration ---
 # A77670C / SIM800 via GPIO Pins (UART)
 # Uses GPIO 14 (TX) and GPIO 15 (RX) on Raspberry Pi
 # Ensure Serial is enabled in raspi-config
-GSM_PORT = "/dev/serial0" 
+GSM_PORT = "/dev/serial0"
 BAUD_RATE = 115200
+# gsm_service.py owns the modem and listens here; without it we open the port ourselves
+SOCKET_PATH = os.environ.get("ISARTHI_GSM_SOCKET", "/tmp/isarthi_gsm.sock")
+# A healthy service can take its queue wait + the SMS + the '>' prompt; wait longer than that
+SMS_TIMEOUT = modem_engine.QUEUE_TIMEOUT + modem_engine.SMS_TIMEOUT + modem_engine.PROMPT_TIMEOUT + 10.0
 
 # Emergency Contact Number (Replace with actual number)
-EMERGENCY_PHONE = "+919876543210" # TODO: Load from config or env if needed 
+EMERGENCY_PHONE = "+919876543210" # TODO: Load from config or env if needed
+
+
+def service_request(request, timeout=SMS_TIMEOUT):
+    # One request to gsm_service; FileNotFoundError / ConnectionRefusedError if it isn't running
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(SOCKET_PATH)
+        s.sendall(json.dumps(request).encode() + b"\n")
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = s.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    return json.loads(reply)
 
-def send_sms(phone_no, message):
+
+def send_sms_direct(phone_no, message, priority):
+    # No service: own the modem for the duration of this one SMS
+    engine = None
     try:
         print(f"📡 Connecting to GSM Module on {GSM_PORT}...")
-        ser = serial.Serial(GSM_PORT, BAUD_RATE, timeout=2)
-        
-        # 1. Check AT Command
-        ser.write(b'AT\r')
-        time.sleep(0.5)
-        response = ser.read_all().decode('utf-8', errors='ignore')
-        if "OK" not in response:
-            print("❌ GSM Module not responding to AT command.")
-            return False
-
-        # 2. Set Text Mode
-        ser.write(b'AT+CMGF=1\r')
-        time.sleep(0.5)
-        
-        # 3. Send SMS Command
-        cmd = f'AT+CMGS="{phone_no}"\r'
-        ser.write(cmd.encode())
-        time.sleep(0.5)
-        
-        # 4. Send Message Body
-        ser.write(message.encode() + b'\x1A') # \x1A is ASCII code for Ctrl+Z
-        time.sleep(3)
-        
-        response = ser.read_all().decode('utf-8', errors='ignore')
-        print(f"📩 SMS Response: {response}")
-        
-        if "OK" in response or "+CMGS" in response:
-            print(f"✅ SMS sent to {phone_no}")
-            return True
-        else:
-            print("❌ Failed to send SMS")
-            return False
-            
-        ser.close()
-        
-    except Exception as e:
+        engine = modem_engine.ModemEngine(GSM_PORT, BAUD_RATE).start()
+        engine.send_sms(phone_no, message, priority=priority)
+        return True
+    except (modem_engine.ModemError, OSError) as e:
         print(f"❌ GSM Error: {e}")
         return False
+    finally:
+        if engine is not None:
+            engine.close()
+
+
+def send_sms(phone_no, message, priority=0):
+    try:
+        reply = service_request({'op': 'sms', 'to': phone_no, 'text': message, 'priority': priority})
+    except (FileNotFoundError, ConnectionRefusedError):
+        ok = send_sms_direct(phone_no, message, priority)
+    except (OSError, ValueError) as e:
+        # The service is up and owns the UART (it may still send this one): never open a second engine
+        print(f"📩 GSM service error: {e!r}")
+        ok = False
+    else:
+        ok = reply.get('ok', False)
+        if not ok:
+            print(f"📩 SMS Response: {reply.get('error')}")
+
+    if ok:
+        print(f"✅ SMS sent to {phone_no}")
+    else:
+        print("❌ Failed to send SMS")
+    return ok
 
 if __name__ == "__main__":
     # Can be run as: python3 gsm_utils.py "Hello World" "+919999999999"
     msg = "Test Alert from Road Monitor"
     phone = EMERGENCY_PHONE
-    
+
     if len(sys.argv) > 1:
         msg = sys.argv[1]
     if len(sys.argv) > 2:
         phone = sys.argv[2]
-        
-    send_sms(phone, msg)
+
+    sys.exit(0 if send_sms(phone, msg) else 1)
@@ -0,0 +1,958 @@
+import os
+import json
+import math
+import time
+import random
+import struct
+import threading
+import collections
+
+# --- Configuration ---
+# Device layer between the sensor modules and the hardware. Modules ask for
+# devices here (nothing is opened at import time) and get one of:
+#   real            smbus2 / RPi.GPIO / pyserial / adafruit_vl53l0x / gpiozero / OpenCV
+#   sim             models of the car's devices, no hardware needed
+#   record:<dir>    real devices, with every read and write logged to <dir>
+#   replay:<dir>    reads answered from a recording, as fast as the loop runs
+# chosen with ISARTHI_HAL (default: real). See hal_capture.py.
+BACKEND = os.environ.get("ISARTHI_HAL", "real")
+# Each recording process writes its own bus.<module>.jsonl into the capture
+# directory, so a whole start_car.py run can be recorded at once
+LOG_PREFIX = "bus."
+LOG_FLUSH_INTERVAL = 1.0
+REPLAY_LOOKAHEAD = 256          # Records searched for a read that matches the call
+
+# Simulation
+SIM_GPS_PORT = "/dev/ttyAMA5"
+SIM_MODEM_PORT = "/dev/serial0"
+SIM_ORIGIN = (28.6139, 77.2090)
+SIM_SPEED_MPS = 8.0
+SIM_POTHOLE_INTERVAL = 7.0      # Seconds between simulated pothole hits
+SIM_ALCOHOL_PIN = 26            # MQ-3 comparator output (LOW = alcohol)
+SIM_ALCOHOL_INTERVAL = 180.0    # An alcohol exposure every 3 minutes...
+SIM_ALCOHOL_START = 90.0        # ...starting this far into the period...
+SIM_ALCOHOL_LENGTH = 25.0       # ...for this long
+EDGE_QUEUE = 1024               # GPIO edges kept between two wait() calls
+
+
+class ReplayFinished(BaseException):
+    # Not an Exception: the loops' catch-all error handlers must not retry on it
+    pass
+
+
+_SIM_T0 = time.monotonic()
+
+
+def _mode():
+    kind, _, arg = BACKEND.partition(":")
+    return kind, arg
+
+
+def fast():
+    # True when sleeps are skipped (replay runs at maximum speed)
+    return _mode()[0] == "replay"
+
+
+def sleep(seconds):
+    if seconds > 0 and not fast():
+        time.sleep(seconds)
+
+
+def monotonic():
+    # Loop timing (holdoffs, summary intervals) should use this: during a
+    # replay it follows the recording's timestamps, so results don't depend
+    # on how fast the replay runs
+    if fast():
+        return _get_log().now
+    return time.monotonic()
+
+
+# --- Record / replay log ---
+def _encode(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"x": bytes(value).hex()}
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and "x" in value:
+        return bytes.fromhex(value["x"])
+    return value
+
+
+class BusLog:
+    # One JSON line per operation: [t, channel, op, args, result]
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        name = os.environ.get("ISARTHI_MODULE") or f"pid{os.getpid()}"
+        self.file = open(os.path.join(directory, f"{LOG_PREFIX}{name}.jsonl"), "a")
+        self.t0 = time.monotonic()
+        self.lock = threading.Lock()
+        self.last_flush = self.t0
+        self.records = 0
+
+    def write(self, channel, op, args, result=None):
+        now = time.monotonic()
+        line = json.dumps([round(now - self.t0, 6), channel, op, [_encode(a) for a in args], _encode(result)],
+                          separators=(",", ":"))
+        with self.lock:
+            self.file.write(line + "\n")
+            self.records += 1
+            if now - self.last_flush >= LOG_FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class ReplayLog:
+    def __init__(self, directory):
+        self.channels = collections.defaultdict(list)
+        self.duration = 0.0     # Longest recording in the capture (s)
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith(LOG_PREFIX) and name.endswith(".jsonl")):
+                continue
+            with open(os.path.join(directory, name)) as f:
+                for line in f:
+                    try:
+                        t, channel, op, args, result = json.loads(line)
+                    except ValueError:
+                        continue    # Torn last line from a capture that was killed
+                    self.channels[channel].append((op, args, _decode(result), t))
+                    self.duration = max(self.duration, t)
+        self.cursor = collections.defaultdict(int)
+        self.now = 0.0          # Timestamp of the latest replayed read
+        self.lock = threading.Lock()
+        self.replayed = 0
+
+    def read(self, channel, op, args):
+        # The next recorded result of this op; same arguments preferred, so a
+        # loop that reads a little differently from the recording stays in step
+        args = [_encode(a) for a in args]
+        with self.lock:
+            records = self.channels.get(channel, ())
+            start = self.cursor[channel]
+            end = min(len(records), start + REPLAY_LOOKAHEAD)
+            fallback = None
+            match = None
+            for i in range(start, end):
+                r_op, r_args = records[i][:2]
+                if r_op != op:
+                    continue
+                if r_args == args:
+                    match = i
+                    break
+                if fallback is None:
+                    fallback = i
+            if match is None:
+                match = fallback
+            if match is None:
+                raise ReplayFinished(f"{channel}: no more '{op}' records")
+            self.cursor[channel] = match + 1
+            self.replayed += 1
+            result, t = records[match][2:]
+            self.now = max(self.now, t)
+        if isinstance(result, dict) and "e" in result:
+            raise OSError(result["e"], result["m"])
+        return result
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def _get_log():
+    global _log
+    with _log_lock:
+        if _log is None:
+            kind, arg = _mode()
+            _log = BusLog(arg) if kind == "record" else ReplayLog(arg)
+        return _log
+
+
+class _Recorded:
+    # Wraps a real device; calls listed in `reads` / `writes` are logged
+    def __init__(self, channel, device, reads, writes):
+        self._channel = channel
+        self._device = device
+        self._log = _get_log()
+        for name in reads:
+            setattr(self, name, self._wrap(name, True))
+        for name in writes:
+            setattr(self, name, self._wrap(name, False))
+
+    def _wrap(self, name, read):
+        method = getattr(self._device, name)
+
+        def call(*args):
+            try:
+                result = method(*args)
+            except OSError as e:
+                # Replayed as the same error (e.g. probing a device that isn't fitted)
+                self._log.write(self._channel, name, args, {"e": e.errno, "m": e.strerror})
+                raise
+            self._log.write(self._channel, name, args, result if read else None)
+            return result
+        return call
+
+
+class _Replayed:
+    # Reads come from the recording; writes are accepted and dropped
+    def __init__(self, channel, reads, writes):
+        self._channel = channel
+        self._log = _get_log()
+        for name in reads:
+            setattr(self, name, self._wrap(name))
+        for name in writes:
+            setattr(self, name, lambda *args: None)
+
+    def _wrap(self, name):
+        def call(*args):
+            return self._log.read(self._channel, name, args)
+        return call
+
+
+# --- I2C ---
+I2C_READS = ("read_byte_data", "read_i2c_block_data", "read_block")
+I2C_WRITES = ("write_byte_data", "write_i2c_block_data")
+
+
+class RealI2C:
+    def __init__(self, bus_id):
+        try:
+            # smbus2 can do combined write/read transfers longer than 32 bytes
+            from smbus2 import SMBus, i2c_msg
+        except ImportError:
+            from smbus import SMBus
+            i2c_msg = None
+        self.bus = SMBus(bus_id)
+        self.i2c_msg = i2c_msg
+
+    def write_byte_data(self, addr, reg, value):
+        self.bus.write_byte_data(addr, reg, value)
+
+    def write_i2c_block_data(self, addr, reg, data):
+        self.bus.write_i2c_block_data(addr, reg, list(data))
+
+    def read_byte_data(self, addr, reg):
+        return self.bus.read_byte_data(addr, reg)
+
+    def read_i2c_block_data(self, addr, reg, length):
+        return self.bus.read_i2c_block_data(addr, reg, length)
+
+    def read_block(self, addr, reg, length, chunk=30):
+        # `length` bytes from one register (e.g. a FIFO port) as bytes; one
+        # transaction with smbus2, otherwise 30-byte block reads
+        if self.i2c_msg is not None:
+            write = self.i2c_msg.write(addr, [reg])
+            read = self.i2c_msg.read(addr, length)
+            self.bus.i2c_rdwr(write, read)
+            return bytes(read)
+        out = bytearray()
+        while len(out) < length:
+            out += bytes(self.bus.read_i2c_block_data(addr, reg, min(chunk, length - len(out))))
+        return bytes(out)
+
+    def close(self):
+        self.bus.close()
+
+
+class SimMPU6050:
+    # Register-level MPU6050: accelerometer samples (gravity + road noise +
+    # a pothole every SIM_POTHOLE_INTERVAL s) go into a 1 KB FIFO at the
+    # configured sample rate
+    def __init__(self, seed):
+        self.regs = bytearray(128)
+        self.rng = random.Random(seed)
+        self.fifo = bytearray()
+        self.fifo_on = False
+        self.overflow = False
+        self.produced_until = time.monotonic()
+
+    def _rate(self):
+        base = 1000 if self.regs[0x1A] & 0x07 else 8000
+        return base / (1 + self.regs[0x19])
+
+    def _lsb_per_g(self):
+        return 16384 >> ((self.regs[0x1C] >> 3) & 0x03)
+
+    def _sample(self, t):
+        g = self._lsb_per_g()
+        bump = 0.0
+        phase = t % SIM_POTHOLE_INTERVAL
+        if phase < 0.04:
+            bump = 3.5 * math.sin(math.pi * phase / 0.04)
+        noise = 0.05 * g
+        x = self.rng.gauss(0, noise)
+        y = self.rng.gauss(0, noise)
+        z = g * (1.0 + bump) + self.rng.gauss(0, noise)
+        return [max(-32768, min(32767, int(v))) for v in (x, y, z)]
+
+    def _produce(self):
+        now = time.monotonic()
+        if not self.fifo_on:
+            self.produced_until = now
+            return
+        period = 1.0 / self._rate()
+        n = int((now - self.produced_until) / period)
+        if n <= 0:
+            return
+        for k in range(min(n, 200)):
+            t = self.produced_until + (k + 1) * period
+            self.fifo += struct.pack(">hhh", *self._sample(t))
+        self.produced_until += n * period
+        if len(self.fifo) > 1024:
+            del self.fifo[:len(self.fifo) - 1024]
+            self.overflow = True
+
+    def write(self, reg, value):
+        self.regs[reg] = value & 0xFF
+        if reg == 0x6A:
+            if value & 0x04:
+                self.fifo.clear()
+                self.overflow = False
+            self.fifo_on = bool(value & 0x40)
+        elif reg == 0x23 and not value:
+            self.fifo_on = False
+
+    def write_block(self, reg, data):
+        for i, value in enumerate(data):
+            self.write(reg + i, value)
+
+    def read(self, reg, length):
+        self._produce()
+        if reg == 0x74:                                     # FIFO_R_W
+            out = bytes(self.fifo[:length])
+            del self.fifo[:length]
+            return out + bytes(length - len(out))
+        if reg == 0x72:                                     # FIFO_COUNTH
+            return bytes(((len(self.fifo) >> 8) & 0xFF, len(self.fifo) & 0xFF))[:length]
+        if reg == 0x3A:                                     # INT_STATUS (clears on read)
+            status = 0x10 if self.overflow else 0
+            self.overflow = False
+            return bytes((status,))
+        if reg == 0x3B:                                     # ACCEL_XOUT_H
+            return struct.pack(">hhh", *self._sample(time.monotonic()))[:length]
+        return bytes(self.regs[reg:reg + length])
+
+
+def _sim_alcohol(t):
+    # Simulated alcohol concentration (0..1): clean air, then an exposure
+    # that rises over 2 s and clears over 8 s once every SIM_ALCOHOL_INTERVAL
+    phase = (t - _SIM_T0) % SIM_ALCOHOL_INTERVAL - SIM_ALCOHOL_START
+    if phase < 0:
+        return 0.0
+    if phase < 2.0:
+        return 0.8 * phase / 2.0
+    if phase < SIM_ALCOHOL_LENGTH:
+        return 0.8
+    return max(0.0, 0.8 * (1.0 - (phase - SIM_ALCOHOL_LENGTH) / 8.0))
+
+
+class SimADS1115:
+    # ADS1115 ADC with an MQ-3 analog output on A0 (~0.4 V in clean air,
+    # ~3.3 V at the peak of an exposure)
+    FULL_SCALE = (6.144, 4.096, 2.048, 1.024, 0.512, 0.256)
+
+    def __init__(self, seed):
+        self.config = 0x8583        # Power-on default
+        self.rng = random.Random(seed)
+
+    def write_block(self, reg, data):
+        if reg == 0x01:
+            self.config = (data[0] << 8) | data[1]
+
+    def write(self, reg, value):
+        pass
+
+    def read(self, reg, length):
+        if reg == 0x01:
+            return bytes(((self.config >> 8) & 0xFF, self.config & 0xFF))[:length]
+        volts = 0.4 + 3.6 * _sim_alcohol(time.monotonic()) + self.rng.gauss(0, 0.01)
+        fsr = self.FULL_SCALE[min((self.config >> 9) & 0x07, 5)]
+        raw = max(-32768, min(32767, int(volts / fsr * 32768)))
+        return struct.pack(">h", raw)[:length]
+
+
+class SimI2C:
+    def __init__(self, bus_id):
+        self.devices = {0x68: SimMPU6050(1), 0x69: SimMPU6050(2), 0x48: SimADS1115(4)}
+        self.lock = threading.Lock()
+
+    def _device(self, addr):
+        dev = self.devices.get(addr)
+        if dev is None:
+            raise OSError(121, "Remote I/O error")    # What smbus raises for a missing device
+        return dev
+
+    def write_byte_data(self, addr, reg, value):
+        with self.lock:
+            self._device(addr).write(reg, value)
+
+    def write_i2c_block_data(self, addr, reg, data):
+        with self.lock:
+            self._device(addr).write_block(reg, data)
+
+    def read_byte_data(self, addr, reg):
+        with self.lock:
+            return self._device(addr).read(reg, 1)[0]
+
+    def read_i2c_block_data(self, addr, reg, length):
+        with self.lock:
+            return list(self._device(addr).read(reg, length))
+
+    def read_block(self, addr, reg, length):
+        with self.lock:
+            return self._device(addr).read(reg, length)
+
+    def close(self):
+        pass
+
+
+def i2c_bus(bus_id=1):
+    kind, _ = _mode()
+    channel = f"i2c{bus_id}"
+    if kind == "sim":
+        return SimI2C(bus_id)
+    if kind == "replay":
+        return _Replayed(channel, I2C_READS, I2C_WRITES + ("close",))
+    bus = RealI2C(bus_id)
+    if kind == "record":
+        recorded = _Recorded(channel, bus, I2C_READS, I2C_WRITES)
+        recorded.close = bus.close
+        return recorded
+    return bus
+
+
+# --- GPIO ---
+class EdgeWatcher:
+    # Level changes on one input pin, pushed from an interrupt callback.
+    # wait() blocks until there is at least one edge (or the timeout) and
+    # returns them oldest first as [(seconds_ago, level), ...]; ages rather
+    # than timestamps, so they line up with hal.monotonic() in a replay.
+    def __init__(self):
+        self.edges = collections.deque(maxlen=EDGE_QUEUE)
+        self.cond = threading.Condition()
+
+    def push(self, level):
+        with self.cond:
+            self.edges.append((time.monotonic(), level))
+            self.cond.notify_all()
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while not self.edges:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            now = time.monotonic()
+            out = [(round(now - t, 6), level) for t, level in self.edges]
+            self.edges.clear()
+        return out
+
+    def close(self):
+        pass
+
+
+class RealGPIO:
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+
+    def setup_input(self, pin):
+        self.GPIO.setup(pin, self.GPIO.IN)
+
+    def input(self, pin):
+        return self.GPIO.input(pin)
+
+    def watch(self, pin):
+        # Both edges; the callback runs on RPi.GPIO's thread. No bouncetime:
+        # RPi.GPIO drops every edge inside it, including the one the level
+        # settles on, so callers debounce in software instead.
+        GPIO = self.GPIO
+        watcher = EdgeWatcher()
+        GPIO.add_event_detect(pin, GPIO.BOTH, callback=lambda channel: watcher.push(GPIO.input(channel)))
+        watcher.close = lambda: GPIO.remove_event_detect(pin)
+        return watcher
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+class SimGPIO:
+    # Inputs read as HIGH unless set() says otherwise; SIM_ALCOHOL_PIN
+    # follows the simulated exposure through a comparator with noise (so its
+    # edges chatter). Watched pins are sampled every 2 ms.
+    def __init__(self):
+        self.levels = {SIM_ALCOHOL_PIN: None}
+        self.watchers = {}
+        self.rng = random.Random(5)
+        self.thread = None
+
+    def setup_input(self, pin):
+        self.levels.setdefault(pin, 1)
+
+    def set(self, pin, level):
+        self.levels[pin] = level
+
+    def input(self, pin):
+        if pin == SIM_ALCOHOL_PIN and self.levels[pin] is None:
+            return 0 if _sim_alcohol(time.monotonic()) + self.rng.gauss(0, 0.02) > 0.5 else 1
+        return self.levels.get(pin, 1)
+
+    def watch(self, pin):
+        watcher = EdgeWatcher()
+        self.watchers[pin] = (watcher, self.input(pin))
+        watcher.close = lambda: self.watchers.pop(pin, None)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._sample, daemon=True)
+            self.thread.start()
+        return watcher
+
+    def _sample(self):
+        while True:
+            for pin, (watcher, last) in list(self.watchers.items()):
+                level = self.input(pin)
+                if level != last:
+                    self.watchers[pin] = (watcher, level)
+                    watcher.push(level)
+            time.sleep(0.002)
+
+    def cleanup(self):
+        self.watchers.clear()
+
+
+GPIO_READS = ("input",)
+GPIO_WRITES = ("setup_input", "cleanup")
+
+
+class _RecordedGPIO(_Recorded):
+    def __init__(self, device):
+        super().__init__("gpio", device, GPIO_READS, GPIO_WRITES)
+
+    def watch(self, pin):
+        return _Recorded(f"gpio{pin}", self._device.watch(pin), ("wait",), ("close",))
+
+
+class _ReplayedGPIO(_Replayed):
+    def __init__(self):
+        super().__init__("gpio", GPIO_READS, GPIO_WRITES)
+
+    def watch(self, pin):
+        return _Replayed(f"gpio{pin}", ("wait",), ("close",))
+
+
+def gpio():
+    kind, _ = _mode()
+    if kind == "sim":
+        return SimGPIO()
+    if kind == "replay":
+        return _ReplayedGPIO()
+    dev = RealGPIO()
+    if kind == "record":
+        return _RecordedGPIO(dev)
+    return dev
+
+
+# --- UART ---
+SERIAL_READS = ("read", "in_waiting_count")
+SERIAL_WRITES = ("write", "flush", "reset_input_buffer", "set_baudrate", "close")
+
+
+class _SerialBase:
+    # pyserial-like surface used by the modules (in_waiting / baudrate are properties)
+    @property
+    def in_waiting(self):
+        return self.in_waiting_count()
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self._baudrate = value
+        self.set_baudrate(value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RealSerial(_SerialBase):
+    def __init__(self, port, baud, timeout):
+        import serial
+        self.ser = serial.Serial(port, baud, timeout=timeout)
+        self._baudrate = baud
+
+    def read(self, n):
+        return self.ser.read(n)
+
+    def in_waiting_count(self):
+        return self.ser.in_waiting
+
+    def write(self, data):
+        return self.ser.write(data)
+
+    def flush(self):
+        self.ser.flush()
+
+    def reset_input_buffer(self):
+        self.ser.reset_input_buffer()
+
+    def set_baudrate(self, value):
+        self.ser.baudrate = value
+
+    def close(self):
+        self.ser.close()
+
+
+class _SimSerial(_SerialBase):
+    # Byte pipe towards a simulated device; subclasses fill self.rx
+    def __init__(self, baud, timeout):
+        self._baudrate = baud
+        self.timeout = timeout
+        self.rx = bytearray()
+        self.cond = threading.Condition()
+
+    def _pump(self):
+        pass
+
+    def _push(self, data):
+        with self.cond:
+            self.rx += data
+            self.cond.notify_all()
+
+    def read(self, n):
+        deadline = time.monotonic() + (self.timeout or 0)
+        with self.cond:
+            while True:
+                self._pump()
+                if self.rx or time.monotonic() >= deadline:
+                    break
+                self.cond.wait(min(0.01, max(0.0, deadline - time.monotonic())))
+            out = bytes(self.rx[:n])
+            del self.rx[:n]
+            return out
+
+    def in_waiting_count(self):
+        with self.cond:
+            self._pump()
+            return len(self.rx)
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self.cond:
+            self.rx.clear()
+
+    def set_baudrate(self, value):
+        pass
+
+    def close(self):
+        pass
+
+
+def _nmea(body):
+    checksum = 0
+    for ch in body.encode():
+        checksum ^= ch
+    return f"${body}*{checksum:02X}\r\n".encode()
+
+
+class SimGPS(_SimSerial):
+    # NMEA RMC + GGA at 10 Hz for a car driving a 400 m circle
+    def __init__(self, baud, timeout, rate_hz=10.0):
+        super().__init__(baud, timeout)
+        self.period = 1.0 / rate_hz
+        self.next_fix = time.monotonic()
+
+    def _pump(self):
+        now = time.monotonic()
+        while self.next_fix <= now:
+            self.rx += self._sentences(time.time() - (now - self.next_fix))
+            self.next_fix += self.period
+
+    def _sentences(self, t):
+        radius = 400.0 / (2 * math.pi)
+        angle = SIM_SPEED_MPS * t / radius
+        lat = SIM_ORIGIN[0] + radius * math.sin(angle) / 111320.0
+        lon = SIM_ORIGIN[1] + radius * (1 - math.cos(angle)) / (111320.0 * math.cos(math.radians(SIM_ORIGIN[0])))
+        course = (math.degrees(angle) + 360.0) % 360.0
+
+        def dm(value, width):
+            deg = int(abs(value))
+            return f"{deg:0{width}d}{(abs(value) - deg) * 60:07.4f}"
+
+        hms = time.strftime("%H%M%S", time.gmtime(t)) + f".{int(t * 100) % 100:02d}"
+        date = time.strftime("%d%m%y", time.gmtime(t))
+        ns, ew = ("N" if lat >= 0 else "S"), ("E" if lon >= 0 else "W")
+        knots = SIM_SPEED_MPS * 1.943844
+        return (_nmea(f"GPRMC,{hms},A,{dm(lat, 2)},{ns},{dm(lon, 3)},{ew},{knots:.2f},{course:.1f},{date},,,A")
+                + _nmea(f"GPGGA,{hms},{dm(lat, 2)},{ns},{dm(lon, 3)},{ew},1,09,0.9,215.0,M,-35.0,M,,"))
+
+
+class SimModem(_SimSerial):
+    # Answers the AT commands modem_engine.py uses
+    def __init__(self, baud, timeout):
+        super().__init__(baud, timeout)
+        self.refs = 0
+        self.pending_sms = False
+
+    def write(self, data):
+        if self.pending_sms:
+            if data.endswith(b"\x1a"):
+                self.pending_sms = False
+                self.refs += 1
+                self._push(f"\r\n+CMGS: {self.refs}\r\n\r\nOK\r\n".encode())
+            elif data == b"\x1b":
+                self.pending_sms = False
+            return len(data)
+        cmd = data.strip().decode(errors="replace")
+        if cmd.startswith("AT+CMGS"):
+            self.pending_sms = True
+            self._push(b"\r\n> ")
+        elif cmd == "AT+CSQ":
+            self._push(b"\r\n+CSQ: 20,0\r\n\r\nOK\r\n")
+        elif cmd == "AT+CREG?":
+            self._push(b"\r\n+CREG: 1,1\r\n\r\nOK\r\n")
+        else:
+            self._push(b"\r\nOK\r\n")
+        return len(data)
+
+
+def open_serial(port, baud, timeout=None):
+    kind, _ = _mode()
+    channel = f"uart:{port}"
+    if kind == "sim":
+        if port == SIM_MODEM_PORT:
+            return SimModem(baud, timeout)
+        if port == SIM_GPS_PORT:
+            return SimGPS(baud, timeout)
+        raise OSError(2, f"No simulated device on {port}")
+    if kind == "replay":
+        dev = _Replayed(channel, SERIAL_READS, SERIAL_WRITES)
+        wrapped = _ReplayedSerial(dev, baud)
+        return wrapped
+    dev = RealSerial(port, baud, timeout)
+    if kind == "record":
+        return _RecordedSerial(_Recorded(channel, dev, SERIAL_READS, SERIAL_WRITES), baud)
+    return dev
+
+
+class _RecordedSerial(_SerialBase):
+    def __init__(self, recorded, baud):
+        self._dev = recorded
+        self._baudrate = baud
+        for name in SERIAL_READS + SERIAL_WRITES:
+            setattr(self, name, getattr(recorded, name))
+
+
+class _ReplayedSerial(_RecordedSerial):
+    def read(self, n):
+        data = self._dev.read(n)
+        return data[:n]
+
+
+# --- Range sensor (VL53L0X) and servo ---
+class RealRangeSensor:
+    def __init__(self):
+        import board
+        import busio
+        import adafruit_vl53l0x
+        self.i2c = busio.I2C(board.SCL, board.SDA)
+        self.sensor = adafruit_vl53l0x.VL53L0X(self.i2c)
+
+    def read_range(self):
+        return self.sensor.range
+
+    def set_timing_budget(self, us):
+        self.sensor.measurement_timing_budget = us
+
+    def start_continuous(self):
+        self.sensor.start_continuous()
+
+    def stop_continuous(self):
+        self.sensor.stop_continuous()
+
+
+class RangeSensor:
+    # adafruit_vl53l0x-like surface (range / measurement_timing_budget properties)
+    def __init__(self, device):
+        self.device = device
+        self._budget = 33000
+
+    @property
+    def range(self):
+        return self.device.read_range()
+
+    @property
+    def measurement_timing_budget(self):
+        return self._budget
+
+    @measurement_timing_budget.setter
+    def measurement_timing_budget(self, us):
+        self._budget = us
+        self.device.set_timing_budget(us)
+
+    def start_continuous(self):
+        self.device.start_continuous()
+
+    def stop_continuous(self):
+        self.device.stop_continuous()
+
+
+class SimServo:
+    def __init__(self):
+        self.angle = 0.0
+
+
+class SimRangeSensor:
+    # A wall 1.6 m away with a box at 50-80° (0.6 m); readings follow the
+    # simulated servo and take one timing budget each
+    def __init__(self, servo):
+        self.servo = servo
+        self.budget = 0.033
+        self.last = time.monotonic()
+        self.rng = random.Random(3)
+
+    def read_range(self):
+        wait = self.last + self.budget - time.monotonic()
+        sleep(wait)
+        self.last = time.monotonic()
+        angle = getattr(self.servo, "angle", 90.0) or 0.0
+        distance = 600 if 50 <= angle <= 80 else 1600
+        return int(distance + self.rng.gauss(0, 15))
+
+    def set_timing_budget(self, us):
+        self.budget = us / 1e6
+
+    def start_continuous(self):
+        self.last = time.monotonic()
+
+    def stop_continuous(self):
+        pass
+
+
+_sim_servo = None
+
+
+def servo(pin, min_angle=0, max_angle=180, min_pulse_width=0.0005, max_pulse_width=0.0025):
+    global _sim_servo
+    kind, _ = _mode()
+    if kind in ("sim", "replay"):
+        _sim_servo = _sim_servo or SimServo()
+        return _sim_servo
+    from gpiozero import AngularServo
+    # Servo commands are outputs only; nothing to record
+    return AngularServo(pin, min_angle=min_angle, max_angle=max_angle,
+                        min_pulse_width=min_pulse_width, max_pulse_width=max_pulse_width)
+
+
+RANGE_READS = ("read_range",)
+RANGE_WRITES = ("set_timing_budget", "start_continuous", "stop_continuous")
+
+
+def range_sensor():
+    global _sim_servo
+    kind, _ = _mode()
+    if kind == "sim":
+        _sim_servo = _sim_servo or SimServo()
+        return RangeSensor(SimRangeSensor(_sim_servo))
+    if kind == "replay":
+        return RangeSensor(_Replayed("range", RANGE_READS, RANGE_WRITES))
+    dev = RealRangeSensor()
+    if kind == "record":
+        dev = _Recorded("range", dev, RANGE_READS, RANGE_WRITES)
+    return RangeSensor(dev)
+
+
+# --- Camera ---
+class SimCamera:
+    # Moving gradient frames at the requested rate (VideoCapture surface)
+    def __init__(self, width=640, height=480, fps=30.0):
+        import numpy as np
+        self.np = np
+        self.width, self.height, self.fps = width, height, fps
+        self.index = 0
+        self.timestamp = 0.0
+        self.base = np.tile(np.arange(width, dtype=np.uint8), (height, 1))
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        shifted = self.np.roll(self.base, self.index * 4, axis=1)
+        frame = self.np.dstack((shifted, shifted, shifted))
+        self.index += 1
+        self.timestamp = time.time()
+        sleep(1.0 / self.fps)
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class RecordingCamera:
+    # Saves every frame as a JPEG, readable later as an image-folder source
+    def __init__(self, source, directory, quality=90):
+        import cv2
+        self.cv2 = cv2
+        self.source = source
+        self.directory = directory
+        self.quality = quality
+        self.index = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    @property
+    def timestamp(self):
+        return self.source.timestamp
+
+    def read(self):
+        ok, frame = self.source.read()
+        if ok:
+            path = os.path.join(self.directory, f"{self.index:06d}.jpg")
+            self.cv2.imwrite(path, frame, [self.cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            self.index += 1
+        return ok, frame
+
+    def release(self):
+        self.source.release()
+
+
+def open_camera(spec, realtime=True, loop=False):
+    # spec as in frame_sources.open_source (camera index, video file, image folder)
+    from frame_sources import open_source
+    kind, arg = _mode()
+    device = str(spec).replace("/dev/video", "")
+    name = f"camera_{device}" if device.isdigit() else None
+    if kind == "sim" and name:
+        return SimCamera()
+    if kind == "replay" and name:
+        return open_source(os.path.join(arg, name), realtime=False, loop=loop)
+    source = open_source(spec, realtime=realtime, loop=loop)
+    if kind == "record" and name:
+        return RecordingCamera(source, os.path.join(arg, name))
+    return source
+
+
+def close():
+    # Flushes a recording; call before exiting
+    if _log is not None and isinstance(_log, BusLog):
+        _log.close()
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import importlib
+import collections
+
+# Records a sensor module's raw bus traffic on the car, and replays it
+# through the same loop code at maximum speed on any Linux box:
+#
+#   python3 hal_capture.py record captures/drive1 --module vibration --seconds 120
+#   python3 hal_capture.py replay captures/drive1 --module vibration
+#
+# Replay reports loop steps/s, bus operations/s and how much faster than
+# real time the capture went through, plus what the loop would have sent
+# (telemetry posts per endpoint, alerts). The same capture replayed before
+# and after a change should produce the same outputs, faster or not.
+#
+# A whole car can also be recorded at once with
+#   ISARTHI_HAL=record:captures/drive1 python3 start_car.py
+# (one log per module in the capture directory).
+
+MODULES = {
+    # key: (module, loop function) as in car_runtime.LOOPS
+    "vibration": ("vibration_monitor", "monitor_loop"),
+    "radar": ("radar_system", "scan_loop"),
+    "gps": ("gps_tracker", "tracker_loop"),
+    "alcohol": ("alcohol_monitor", "monitor_loop"),
+}
+
+
+# Car state a replayed loop would otherwise write into: the sample bus rings
+# (which the black box records), the GPS fix slots, the hazard database and
+# the metrics snapshots. A replay gets its own copies in a temp directory.
+REPLAY_ISOLATED = {
+    "ISARTHI_BUS_DIR": "",
+    "ISARTHI_GPS_FIX": "gps_fix",
+    "ISARTHI_GPS_FUSED": "gps_fused",
+    "ISARTHI_HAZARD_DB": "hazards.db",
+    "ISARTHI_METRICS_DIR": "metrics",
+    "ISARTHI_SPOOL": None,
+}
+
+
+def isolate():
+    # Must run before load() imports the module (paths are read at import)
+    scratch = tempfile.mkdtemp(prefix="isarthi_replay_")
+    for var, name in REPLAY_ISOLATED.items():
+        os.environ[var] = "0" if name is None else os.path.join(scratch, name)
+    return scratch
+
+
+def load(key, backend):
+    # The backend has to be set before hal is imported
+    os.environ["ISARTHI_HAL"] = backend
+    os.environ.setdefault("ISARTHI_MODULE", key)
+    module_name, func = MODULES[key]
+    module = importlib.import_module(module_name)
+    return getattr(module, func)
+
+
+def record(args):
+    loop_fn = load(args.module, f"record:{args.capture}")
+    import hal
+    loop = loop_fn()
+    steps = 0
+    deadline = time.monotonic() + args.seconds
+    print(f"⏺️ Recording {args.module} into {args.capture} for {args.seconds:.0f}s...")
+    try:
+        for delay in loop:
+            steps += 1
+            if time.monotonic() >= deadline:
+                break
+            hal.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+        records = hal._log.records if hal._log is not None else 0
+        hal.close()
+    print(f"✅ {steps} loop steps, {records} bus operations recorded")
+    return 0
+
+
+def replay(args):
+    scratch = isolate()
+    try:
+        return _replay(args)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _replay(args):
+    loop_fn = load(args.module, f"replay:{args.capture}")
+    import hal
+    import telemetry
+    import alert_dispatcher
+
+    # Count what the loop would send instead of sending it
+    posts = collections.Counter()
+    alerts = collections.Counter()
+    telemetry.post = lambda url, payload: posts.update([url]) or True
+    alert_dispatcher.raise_alert = lambda kind, detail=None: alerts.update([kind])
+
+    loop = loop_fn()
+    steps = 0
+    t0 = time.perf_counter()
+    try:
+        for _ in loop:
+            steps += 1
+            if args.max_steps and steps >= args.max_steps:
+                break
+    except hal.ReplayFinished:
+        pass
+    finally:
+        elapsed = time.perf_counter() - t0
+        loop.close()
+
+    log = hal._get_log()
+    print(f"⏩ Replayed {args.module}: {steps} steps in {elapsed:.2f}s "
+          f"({steps / elapsed:.0f} steps/s, {log.replayed / elapsed:.0f} bus ops/s)")
+    if log.duration:
+        print(f"   Capture length {log.duration:.1f}s -> {log.duration / elapsed:.1f}x real time")
+    for url, n in sorted(posts.items()):
+        print(f"   {n:6d} posts -> {url}")
+    for kind, n in sorted(alerts.items()):
+        print(f"   {n:6d} alerts: {kind}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record / replay sensor bus traffic")
+    parser.add_argument("action", choices=["record", "replay"])
+    parser.add_argument("capture", help="Capture directory")
+    parser.add_argument("--module", choices=sorted(MODULES), default="vibration")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Recording length")
+    parser.add_argument("--max-steps", type=int, default=0, help="Stop a replay early")
+    args = parser.parse_args()
+    return record(args) if args.action == "record" else replay(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+import os
+import math
+import time
+import sqlite3
+import threading
+import numpy as np
+
+import gps_fix
+
+# --- Configuration ---
+# Local hazard map (potholes, rough patches, impacts) keyed by a fixed-size
+# grid over a local metric projection. Repeat hits within MERGE_RADIUS_M of
+# an existing hazard of the same kind update that hazard (hit count,
+# position, confidence) instead of creating a duplicate.
+DB_PATH = os.environ.get(
+    "ISARTHI_HAZARD_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "hazards.db"),
+)
+CELL_M = 25.0               # Grid cell size (>= merge radius so merges only look at 3x3 cells)
+MERGE_RADIUS_M = 12.0
+SYNC_INTERVAL = 2.0         # Seconds between SQLite flush / pull of other processes' hazards
+EARTH_RADIUS_M = 6371000.0
+
+KINDS = ("pothole", "rough", "crash")
+
+
+class HazardStore:
+    def __init__(self, db_path=DB_PATH, cell_m=CELL_M, merge_radius_m=MERGE_RADIUS_M, capacity=1024):
+        self.cell_m = cell_m
+        self.merge_radius_m = merge_radius_m
+        self.db_path = db_path
+        self.ref_cos = None
+
+        # Column arrays (grown by doubling)
+        self.size = 0
+        self._alloc(capacity)
+
+        # (ix, iy) -> [row, ...]
+        self.grid = {}
+        self.by_db_id = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+        self._cursor = 0            # Highest hazards.version seen
+        self._version = 0
+        self._db = None
+        self._sync_thread = None
+
+    # --- Storage ---
+    def _alloc(self, capacity):
+        def grow(old, dtype):
+            new = np.zeros(capacity, dtype=dtype)
+            if old is not None:
+                new[:self.size] = old[:self.size]
+            return new
+        self.capacity = capacity
+        self.x = grow(getattr(self, "x", None), np.float64)        # Metres east
+        self.y = grow(getattr(self, "y", None), np.float64)        # Metres north
+        self.kind = grow(getattr(self, "kind", None), np.int8)
+        self.hits = grow(getattr(self, "hits", None), np.int32)
+        self.confidence = grow(getattr(self, "confidence", None), np.float32)
+        self.first_seen = grow(getattr(self, "first_seen", None), np.float64)
+        self.last_seen = grow(getattr(self, "last_seen", None), np.float64)
+        self.db_id = grow(getattr(self, "db_id", None), np.int64)
+
+    # Local equirectangular projection about a fixed reference latitude (the
+    # first hazard seen). Accurate to well under a metre over a city-sized
+    # area, and cheap enough to vectorize.
+    def project(self, lat, lon):
+        if self.ref_cos is None:
+            self.ref_cos = math.cos(math.radians(float(np.mean(lat))))
+        return (EARTH_RADIUS_M * self.ref_cos * np.radians(lon),
+                EARTH_RADIUS_M * np.radians(lat))
+
+    def unproject(self, x, y):
+        return (np.degrees(y / EARTH_RADIUS_M),
+                np.degrees(x / (EARTH_RADIUS_M * self.ref_cos)))
+
+    def _cell(self, x, y):
+        return (int(math.floor(x / self.cell_m)), int(math.floor(y / self.cell_m)))
+
+    def _insert(self, x, y, kind, hits, confidence, first_seen, last_seen, db_id=0):
+        if self.size == self.capacity:
+            self._alloc(self.capacity * 2)
+        i = self.size
+        self.x[i], self.y[i] = x, y
+        self.kind[i] = kind
+        self.hits[i] = hits
+        self.confidence[i] = confidence
+        self.first_seen[i], self.last_seen[i] = first_seen, last_seen
+        self.db_id[i] = db_id
+        self.grid.setdefault(self._cell(x, y), []).append(i)
+        if db_id:
+            self.by_db_id[db_id] = i
+        self.size += 1
+        return i
+
+    def _move(self, i, x, y):
+        old, new = self._cell(self.x[i], self.y[i]), self._cell(x, y)
+        if old != new:
+            self.grid[old].remove(i)
+            self.grid.setdefault(new, []).append(i)
+        self.x[i], self.y[i] = x, y
+
+    def _candidates(self, x, y, radius):
+        r = int(math.ceil(radius / self.cell_m))
+        cx, cy = self._cell(x, y)
+        rows = []
+        grid = self.grid
+        for ix in range(cx - r, cx + r + 1):
+            for iy in range(cy - r, cy + r + 1):
+                cell = grid.get((ix, iy))
+                if cell:
+                    rows.extend(cell)
+        return np.fromiter(rows, dtype=np.intp, count=len(rows))
+
+    # --- Reporting ---
+    def report(self, kind, lat, lon, confidence=0.5, timestamp=None):
+        # Adds a detection; returns the hazard (dict) it was merged into or created
+        code = KINDS.index(kind)
+        ts = time.time() if timestamp is None else timestamp
+        x, y = self.project(lat, lon)
+        x, y = float(x), float(y)
+
+        with self._lock:
+            rows = self._candidates(x, y, self.merge_radius_m)
+            if rows.size:
+                rows = rows[self.kind[rows] == code]
+            if rows.size:
+                d2 = (self.x[rows] - x) ** 2 + (self.y[rows] - y) ** 2
+                j = int(np.argmin(d2))
+                if d2[j] <= self.merge_radius_m ** 2:
+                    i = int(rows[j])
+                    # Confidence-weighted position, independent-evidence confidence
+                    w_old = float(self.confidence[i]) * self.hits[i]
+                    w = w_old + confidence
+                    if w > 0:
+                        self._move(i, (self.x[i] * w_old + x * confidence) / w,
+                                   (self.y[i] * w_old + y * confidence) / w)
+                    self.hits[i] += 1
+                    self.confidence[i] = 1.0 - (1.0 - self.confidence[i]) * (1.0 - confidence)
+                    self.last_seen[i] = ts
+                    self._dirty.add(i)
+                    return self._record(i)
+
+            i = self._insert(x, y, code, 1, confidence, ts, ts)
+            self._dirty.add(i)
+            return self._record(i)
+
+    def report_at_current_fix(self, kind, confidence=0.5, max_age=gps_fix.STALE_AFTER):
+        # Tags a detection with the current position; None if there is no fresh fix
+        fix = gps_fix.read_best(max_age)
+        if fix is None:
+            return None
+        return self.report(kind, fix["latitude"], fix["longitude"], confidence, fix["timestamp"])
+
+    # --- Queries ---
+    def near(self, lat, lon, radius_m, kind=None, limit=None):
+        # Hazards within radius_m of a point, nearest first
+        x, y = self.project(lat, lon)
+        with self._lock:
+            rows = self._candidates(float(x), float(y), radius_m)
+            if rows.size == 0:
+                return []
+            if kind is not None:
+                rows = rows[self.kind[rows] == KINDS.index(kind)]
+            d = np.hypot(self.x[rows] - x, self.y[rows] - y)
+            inside = d <= radius_m
+            rows, d = rows[inside], d[inside]
+            order = np.argsort(d)
+            if limit is not None:
+                order = order[:limit]
+            return [dict(self._record(int(rows[k])), distance_m=round(float(d[k]), 1)) for k in order]
+
+    def along_route(self, points, radius_m, kind=None):
+        # Hazards within radius_m of a polyline [(lat, lon), ...], in route order
+        if not points:
+            return []
+        lat = np.array([p[0] for p in points], dtype=np.float64)
+        lon = np.array([p[1] for p in points], dtype=np.float64)
+        px, py = self.project(lat, lon)
+        with self._lock:
+            # Candidate cells: walk each segment in cell-sized steps
+            seen = set()
+            for k in range(len(points)):
+                x0, y0 = px[k], py[k]
+                x1, y1 = (px[k + 1], py[k + 1]) if k + 1 < len(points) else (x0, y0)
+                steps = max(1, int(math.hypot(x1 - x0, y1 - y0) / self.cell_m))
+                for s in range(steps + 1):
+                    t = s / steps
+                    seen.update(self._candidates(x0 + (x1 - x0) * t, y0 + (y1 - y0) * t, radius_m).tolist())
+            if not seen:
+                return []
+            rows = np.fromiter(seen, dtype=np.intp, count=len(seen))
+            if kind is not None:
+                rows = rows[self.kind[rows] == KINDS.index(kind)]
+
+            # Exact point-to-segment distance, all hazards x all segments at once
+            hx, hy = self.x[rows][:, None], self.y[rows][:, None]
+            if len(points) == 1:
+                d = np.hypot(hx - px, hy - py)[:, 0]
+                along = np.zeros(len(rows))
+            else:
+                ax, ay, bx, by = px[:-1], py[:-1], px[1:], py[1:]
+                vx, vy = bx - ax, by - ay
+                seg_len2 = np.maximum(vx * vx + vy * vy, 1e-9)
+                t = np.clip(((hx - ax) * vx + (hy - ay) * vy) / seg_len2, 0.0, 1.0)
+                dist = np.hypot(hx - (ax + t * vx), hy - (ay + t * vy))
+                seg = np.argmin(dist, axis=1)
+                d = dist[np.arange(len(rows)), seg]
+                along = seg + t[np.arange(len(rows)), seg]
+            inside = d <= radius_m
+            order = np.argsort(along[inside], kind="stable")
+            rows, d = rows[inside][order], d[inside][order]
+            return [dict(self._record(int(r)), distance_m=round(float(dd), 1)) for r, dd in zip(rows, d)]
+
+    def _record(self, i):
+        lat, lon = self.unproject(self.x[i], self.y[i])
+        return {
+            "kind": KINDS[self.kind[i]],
+            "latitude": round(float(lat), 7),
+            "longitude": round(float(lon), 7),
+            "hits": int(self.hits[i]),
+            "confidence": round(float(self.confidence[i]), 3),
+            "first_seen": float(self.first_seen[i]),
+            "last_seen": float(self.last_seen[i]),
+        }
+
+    # --- Persistence (SQLite, shared by every module on the car) ---
+    # Every write stamps the row with the next version (MAX + 1) inside a
+    # BEGIN IMMEDIATE transaction, so versions follow commit order and
+    # "version > cursor" never misses a row committed late. A hazard merged
+    # into another one stays behind as a tombstone (merged_into) so every
+    # process drops its copy.
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS hazards (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                latitude REAL,
+                longitude REAL,
+                hits INTEGER,
+                confidence REAL,
+                first_seen REAL,
+                last_seen REAL,
+                updated_at REAL,
+                version INTEGER,
+                merged_into INTEGER
+            )""")
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(hazards)")}
+            with self._db:
+                for column in ("version", "merged_into"):
+                    if column not in columns:
+                        self._db.execute(f"ALTER TABLE hazards ADD COLUMN {column} INTEGER")
+                self._db.execute("UPDATE hazards SET version = id WHERE version IS NULL")
+            self._db.execute("CREATE INDEX IF NOT EXISTS hazards_version ON hazards (version)")
+            # The merge lookup in _flush_new: live rows of a kind inside a lat/lon box
+            self._db.execute("""CREATE INDEX IF NOT EXISTS hazards_cell ON hazards (kind, latitude, longitude)
+                                WHERE merged_into IS NULL""")
+        return self._db
+
+    def load(self):
+        self.sync()
+        return self
+
+    def sync(self):
+        # Flush our changes, then pick up (and merge) what other processes recorded
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("BEGIN IMMEDIATE")   # One writer at a time: versions in commit order
+                self._version = db.execute("SELECT COALESCE(MAX(version), 0) FROM hazards").fetchone()[0]
+                for i in sorted(self._dirty):
+                    if self.db_id[i]:
+                        self._write(db, i)
+                    else:
+                        self._flush_new(db, i)
+                self._dirty.clear()
+                self._pull(db)
+                self._cursor = self._version
+
+    def _write(self, db, i):
+        rec = self._record(i)
+        self._version += 1
+        values = (rec["kind"], rec["latitude"], rec["longitude"], rec["hits"], rec["confidence"],
+                  rec["first_seen"], rec["last_seen"], time.time(), self._version)
+        if self.db_id[i]:
+            db.execute("""UPDATE hazards SET kind=?, latitude=?, longitude=?, hits=?, confidence=?,
+                          first_seen=?, last_seen=?, updated_at=?, version=? WHERE id=?""",
+                       values + (int(self.db_id[i]),))
+        else:
+            cur = db.execute("""INSERT INTO hazards (kind, latitude, longitude, hits, confidence,
+                                first_seen, last_seen, updated_at, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                             values)
+            self.db_id[i] = cur.lastrowid
+            self.by_db_id[cur.lastrowid] = i
+
+    def _flush_new(self, db, i):
+        # A hazard another process recorded (and we haven't pulled yet) within
+        # the merge radius takes this one in instead of a duplicate row
+        lat, lon = self.unproject(self.x[i], self.y[i])
+        dlat = math.degrees(self.merge_radius_m / EARTH_RADIUS_M)
+        dlon = dlat / self.ref_cos
+        rows = db.execute("""SELECT id, latitude, longitude, hits, confidence, first_seen, last_seen FROM hazards
+                             WHERE kind = ? AND merged_into IS NULL AND latitude BETWEEN ? AND ?
+                             AND longitude BETWEEN ? AND ?""",
+                          (KINDS[self.kind[i]], lat - dlat, lat + dlat, lon - dlon, lon + dlon)).fetchall()
+        best, best_d2 = None, self.merge_radius_m ** 2
+        for row in rows:
+            x, y = self.project(row[1], row[2])
+            d2 = (float(x) - self.x[i]) ** 2 + (float(y) - self.y[i]) ** 2
+            if d2 <= best_d2:
+                best, best_d2 = row, d2
+        if best is None:
+            self._write(db, i)
+            return
+        db_id = best[0]
+        j = self.by_db_id.get(db_id)
+        if j is not None:
+            # Known here but drifted apart in memory: fold this one into it
+            self._fold(j, i)
+            self._remove(i)
+            self._write(db, j)
+        else:
+            # Take over their row: their evidence folded into ours
+            x, y = self.project(best[1], best[2])
+            theirs = self._insert(float(x), float(y), self.kind[i], *best[3:])
+            self._fold(i, theirs)
+            self._remove(theirs)
+            self.db_id[i] = db_id
+            self.by_db_id[db_id] = i
+            self._write(db, i)
+
+    def _pull(self, db):
+        rows = db.execute("""SELECT id, kind, latitude, longitude, hits, confidence, first_seen, last_seen, merged_into
+                             FROM hazards WHERE version > ? ORDER BY merged_into IS NULL, version""",
+                          (self._cursor,)).fetchall()
+        for db_id, kind, lat, lon, hits, conf, first, last, merged_into in rows:
+            i = self.by_db_id.get(db_id)
+            if merged_into is not None:
+                # Tombstones first (ORDER BY): the survivor's update is in this pull too
+                if i is not None:
+                    self._remove(i)
+                continue
+            if kind not in KINDS:
+                continue
+            x, y = self.project(lat, lon)
+            if i is not None:
+                self._move(i, float(x), float(y))
+                self.hits[i], self.confidence[i] = hits, conf
+                self.first_seen[i], self.last_seen[i] = first, last
+                continue
+            i = self._insert(float(x), float(y), KINDS.index(kind), hits, conf, first, last, db_id)
+            # Duplicates from before merging was done here (or from an old
+            # version) merge into the nearest known hazard; the pulled row
+            # becomes a tombstone
+            j = self._nearest(i)
+            if j is not None:
+                self._fold(j, i)
+                self._remove(i)
+                self._write(db, j)
+                self._version += 1
+                db.execute("UPDATE hazards SET merged_into = ?, version = ? WHERE id = ?",
+                           (int(self.db_id[j]), self._version, db_id))
+
+    def _nearest(self, i):
+        # Another hazard of the same kind within the merge radius of row i
+        rows = self._candidates(self.x[i], self.y[i], self.merge_radius_m)
+        rows = rows[(rows != i) & (self.kind[rows] == self.kind[i])]
+        if rows.size == 0:
+            return None
+        d2 = (self.x[rows] - self.x[i]) ** 2 + (self.y[rows] - self.y[i]) ** 2
+        j = int(np.argmin(d2))
+        return int(rows[j]) if d2[j] <= self.merge_radius_m ** 2 else None
+
+    def _fold(self, i, j):
+        # Merge row j's evidence into row i (as report() does for one hit)
+        w_i = float(self.confidence[i]) * self.hits[i]
+        w_j = float(self.confidence[j]) * self.hits[j]
+        if w_i + w_j > 0:
+            self._move(i, (self.x[i] * w_i + self.x[j] * w_j) / (w_i + w_j),
+                       (self.y[i] * w_i + self.y[j] * w_j) / (w_i + w_j))
+        self.hits[i] += self.hits[j]
+        self.confidence[i] = 1.0 - (1.0 - self.confidence[i]) * (1.0 - self.confidence[j])
+        self.first_seen[i] = min(self.first_seen[i], self.first_seen[j])
+        self.last_seen[i] = max(self.last_seen[i], self.last_seen[j])
+
+    def _remove(self, i):
+        # Drops row i from the index (its array slot is left unused)
+        self.grid[self._cell(self.x[i], self.y[i])].remove(i)
+        if self.by_db_id.get(int(self.db_id[i])) == i:
+            del self.by_db_id[int(self.db_id[i])]
+        self.hits[i] = 0
+        self._dirty.discard(i)
+
+    def start_sync(self, interval=SYNC_INTERVAL):
+        # Background flush so reporting never waits on the disk
+        if self._sync_thread is None:
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.sync()
+                    except sqlite3.Error as e:
+                        print(f"⚠️ Hazard store sync failed: {e}")
+            self._sync_thread = threading.Thread(target=run, name="hazard-sync", daemon=True)
+            self._sync_thread.start()
+        return self
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # Process-wide store, loaded from disk and synced in the background
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HazardStore().load().start_sync()
+    return _store
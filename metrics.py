@@ -0,0 +1,267 @@
+import os
+import sys
+import time
+import threading
+
+# --- Configuration ---
+# Counters, gauges and latency histograms for the hot paths, cheap enough to
+# leave on: recording is a few integer operations on the calling thread, no
+# locks, no allocation. Each metric is meant to have one writer (the loop
+# that owns it); readers (the exporter) only ever see a slightly stale value.
+#
+#   DRAIN = metrics.histogram("stage_seconds", stage="imu_drain")
+#   t0 = metrics.now()
+#   ...
+#   DRAIN.record_since(t0)
+#
+#   metrics.dropped("vibration.read_raw_data")     # where a sample is discarded
+#
+# Everything renders in the Prometheus text format: the Flask apps serve it
+# on /metrics, and the headless loops write it to METRICS_DIR every couple of
+# seconds for the sidecar (metrics_sidecar.py) to serve.
+METRICS_DIR = os.environ.get("ISARTHI_METRICS_DIR",
+                             os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else "/tmp", "isarthi_metrics"))
+EXPORT_INTERVAL = 2.0
+SUB_BUCKET_BITS = 5         # 32 buckets per power of two: values within ~3%
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+now = time.perf_counter_ns  # Monotonic, nanoseconds
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _label_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Counter:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def render(self, extra):
+        return [f"{self.name}{_label_text(self.labels, extra)} {self.value}"]
+
+
+class Gauge:
+    # Read when rendered: a function, or a value set by the owner
+    def __init__(self, name, labels, fn=None):
+        self.name = name
+        self.labels = labels
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, extra):
+        try:
+            value = self.fn() if self.fn is not None else self.value
+        except Exception:
+            return []
+        return [f"{self.name}{_label_text(self.labels, extra)} {value}"]
+
+
+class Histogram:
+    # HDR-style log-linear buckets over nanoseconds: exact below 64 ns, then
+    # 2**SUB_BUCKET_BITS buckets per power of two, up to ~18 minutes
+    SUB = 1 << SUB_BUCKET_BITS
+    MAX_SHIFT = 34
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.counts = [0] * ((self.MAX_SHIFT + 2) << SUB_BUCKET_BITS)
+        self.last = len(self.counts) - 1
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        # Bucket = (shift << bits) + top bits of the value
+        shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            index = ns if ns > 0 else 0
+        else:
+            index = (shift << SUB_BUCKET_BITS) + (ns >> shift)
+            if index > self.last:
+                index = self.last
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def record_since(self, t0):
+        self.record(now() - t0)
+
+    def time(self):
+        return _Timing(self)
+
+    def _upper(self, index):
+        # Largest value that lands in bucket `index`
+        if index < 2 * self.SUB:
+            return index
+        shift = index // self.SUB - 1
+        return ((index - (shift << SUB_BUCKET_BITS) + 1) << shift) - 1
+
+    def quantile(self, q):
+        total = self.count
+        if not total:
+            return 0
+        rank = q * total
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(self._upper(index), self.max)
+        return self.max
+
+    def render(self, extra):
+        # Seconds; quantile 1 is the maximum
+        lines = []
+        for q in QUANTILES + (1,):
+            value = self.max if q == 1 else self.quantile(q)
+            lines.append(f"{self.name}{_label_text(self.labels, tuple(extra) + (('quantile', q),))} {value / 1e9:.9f}")
+        label = _label_text(self.labels, extra)
+        lines.append(f"{self.name}_sum{label} {self.total / 1e9:.9f}")
+        lines.append(f"{self.name}_count{label} {self.count}")
+        return lines
+
+
+class _Timing:
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = now()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.record(now() - self.t0)
+
+
+# --- Registry ---
+_metrics = {}
+_lock = threading.Lock()    # Only taken when a metric is created
+TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "summary"}
+
+
+def _get(cls, name, labels, *args):
+    key = (name, _labels(labels))
+    metric = _metrics.get(key)
+    if metric is None:
+        with _lock:
+            metric = _metrics.get(key)
+            if metric is None:
+                metric = _metrics[key] = cls(name, key[1], *args)
+    return metric
+
+
+def counter(name, **labels):
+    return _get(Counter, name, labels)
+
+
+def gauge(name, fn=None, **labels):
+    metric = _get(Gauge, name, labels)
+    if fn is not None:
+        metric.fn = fn
+    return metric
+
+
+def histogram(name, **labels):
+    return _get(Histogram, name, labels)
+
+
+def dropped(site, n=1):
+    # A sample / reading thrown away by an error handler
+    counter("dropped_samples_total", site=site).inc(n)
+
+
+def render(**extra):
+    # Prometheus text format; `extra` labels go on every line (e.g. module=...)
+    extra = _labels(extra)
+    lines = []
+    typed = set()
+    for (name, _), metric in sorted(_metrics.items(), key=lambda item: item[0]):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {TYPES[type(metric)]}")
+        lines.extend(metric.render(extra))
+    return "\n".join(lines) + "\n"
+
+
+# --- Export for the sidecar ---
+_exporter = None
+
+
+def module_name():
+    return os.environ.get("ISARTHI_MODULE") or os.path.splitext(os.path.basename(sys.argv[0] or ""))[0] or "python"
+
+
+def export_once(name=None):
+    name = name or module_name()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{name}.prom")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render(module=name))
+    os.replace(tmp, path)
+
+
+def start_exporter(name=None):
+    # Writes this process's metrics for the sidecar every EXPORT_INTERVAL
+    global _exporter
+    if _exporter is not None:
+        return _exporter
+
+    def run():
+        while True:
+            time.sleep(EXPORT_INTERVAL)
+            try:
+                export_once(name)
+            except OSError:
+                pass    # /dev/shm full or gone; try again next time
+
+    with _lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=run, name="metrics-export", daemon=True)
+            _exporter.start()
+    return _exporter
+
+
+def bench(n=200000):
+    # Cost of the recording calls on this machine
+    c = counter("bench_total")
+    h = histogram("bench_seconds")
+    t = time.perf_counter()
+    for _ in range(n):
+        c.inc()
+    inc_ns = (time.perf_counter() - t) / n * 1e9
+    t = time.perf_counter()
+    for _ in range(n):
+        t0 = now()
+        h.record_since(t0)
+    timer_ns = (time.perf_counter() - t) / n * 1e9
+    t = time.perf_counter()
+    for _ in range(n):
+        with h.time():
+            pass
+    with_ns = (time.perf_counter() - t) / n * 1e9
+    print(f"counter.inc {inc_ns:.0f} ns | now() + record_since {timer_ns:.0f} ns | with h.time() {with_ns:.0f} ns")
+
+
+if __name__ == "__main__":
+    bench()
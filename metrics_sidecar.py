@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+import service_loop
+
+# --- Configuration ---
+# /metrics for the headless sensor loops: every process writes its metrics
+# into metrics.METRICS_DIR (see metrics.start_exporter) and this serves them
+# all on one port, each line labelled with its module. The Flask apps serve
+# their own /metrics on 5001 / 5002 as well.
+PORT = int(os.environ.get("ISARTHI_METRICS_PORT", "9100"))
+STALE_AFTER = 10.0          # Files not rewritten for this long belong to stopped processes
+
+
+def collect():
+    # Files merged per metric family (Prometheus wants a family's lines together)
+    families = {}
+    now = time.time()
+    try:
+        names = sorted(os.listdir(metrics.METRICS_DIR))
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if not name.endswith(".prom"):
+            continue
+        path = os.path.join(metrics.METRICS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > STALE_AFTER:
+                continue
+            with open(path) as f:
+                text = f.read()
+        except OSError:
+            continue
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# TYPE "):
+                _, _, family, kind = line.split(" ", 3)
+                families.setdefault(family, (kind, []))
+            elif line and family is not None:
+                families[family][1].append(line)
+    out = []
+    for family, (kind, lines) in sorted(families.items()):
+        out.append(f"# TYPE {family} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = collect().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass    # One line per scrape is noise
+
+
+def serve_loop():
+    server = ThreadingHTTPServer(("0.0.0.0", PORT), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    print(f"📊 Metrics on http://0.0.0.0:{PORT}/metrics")
+    try:
+        while True:
+            yield 1.0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    service_loop.run_blocking(serve_loop())
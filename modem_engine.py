@@ -0,0 +1,321 @@
+import re
+import time
+import queue
+import itertools
+import threading
+
+import hal
+import metrics
+
+# --- Configuration ---
+# One long-lived owner of the GSM modem's UART. Commands go through a
+# priority queue and are written one at a time; a reader thread matches the
+# modem's replies (final result codes, the '>' SMS prompt) to the command in
+# flight, so nothing waits on fixed sleeps. Unsolicited result codes
+# (+CMTI, +CREG, RING, ...) are parsed and handed to registered callbacks.
+GSM_PORT = "/dev/serial0"
+BAUD_RATE = 115200
+COMMAND_TIMEOUT = 5.0
+PROMPT_TIMEOUT = 10.0
+SMS_TIMEOUT = 60.0          # The network can take a while to accept an SMS
+QUEUE_TIMEOUT = 120.0       # Longest a caller waits for its turn (an SMS or two ahead of it)
+
+# Priorities (lower runs first)
+PRIORITY_URGENT = 0         # SOS / alerts
+PRIORITY_NORMAL = 5
+PRIORITY_BACKGROUND = 9     # Status polling
+
+FINAL_OK = ("OK",)
+FINAL_ERROR = ("ERROR", "+CME ERROR", "+CMS ERROR", "NO CARRIER", "BUSY", "NO ANSWER", "NO DIALTONE")
+URC_PREFIXES = ("+CMTI", "+CREG", "+CGREG", "+CEREG", "RING", "+CLIP", "+CMT:", "+CDS",
+                "SMS Ready", "Call Ready", "+CPIN", "*ATREADY", "PB DONE", "+CUSD")
+
+# Queue wait + round trip of every command, by outcome
+COMMAND_TIME = {True: metrics.histogram("modem_command_seconds", result="ok"),
+                False: metrics.histogram("modem_command_seconds", result="error")}
+
+INIT_COMMANDS = (
+    "ATE0",                 # No echo
+    "AT+CMEE=2",            # Verbose errors
+    "AT+CMGF=1",            # SMS text mode
+    'AT+CSCS="GSM"',
+    "AT+CNMI=2,1,0,0,0",    # New SMS -> +CMTI URC
+    "AT+CREG=1",            # Registration changes -> +CREG URC
+)
+
+
+class ModemError(Exception):
+    pass
+
+
+class Command:
+    def __init__(self, at, data=None, timeout=COMMAND_TIMEOUT, priority=PRIORITY_NORMAL):
+        self.at = at
+        self.data = data            # Sent after the '>' prompt (SMS body)
+        self.timeout = timeout
+        self.priority = priority
+        # Lines starting with this (e.g. '+CSQ') belong to the response, not URCs
+        self.prefix = at[2:].split("=")[0].rstrip("?") if at.upper().startswith("AT+") else None
+        self.lines = []
+        self.ok = None
+        self.error = None
+        self.done = threading.Event()
+        self.prompt = threading.Event()
+        self.queued_at = time.monotonic()
+        self.finished_at = None
+        self.abandoned = False
+
+    def result(self, timeout=None):
+        # Blocks until the modem answered; returns the response lines or raises ModemError.
+        # By default: the queue wait plus the command's own timeouts.
+        if timeout is None:
+            timeout = QUEUE_TIMEOUT + self.timeout + (PROMPT_TIMEOUT if self.data is not None else 0.0)
+        if not self.done.wait(timeout):
+            self.abandoned = True   # The writer skips it if it's still queued
+            raise ModemError(f"{self.at}: no result")
+        if not self.ok:
+            raise ModemError(f"{self.at}: {self.error}")
+        return self.lines
+
+
+class ModemEngine:
+    def __init__(self, port=GSM_PORT, baud=BAUD_RATE):
+        self.port = port
+        self.baud = baud
+        self.ser = None
+        self.queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._active = None
+        self._lock = threading.Lock()
+        self._handlers = []
+        self._running = False
+        self._threads = []
+
+        # Modem state, kept current from responses and URCs
+        self.status = {
+            'connected': False,
+            'registered': None,     # +CREG stat: 1 home, 5 roaming
+            'signal': None,         # +CSQ rssi 0-31 (99 unknown)
+            'sms_sent': 0,
+            'sms_failed': 0,
+            'last_ok': None,
+        }
+
+    # --- Lifecycle ---
+    def start(self):
+        self.ser = hal.open_serial(self.port, self.baud, timeout=0.1)
+        self._running = True
+        for target, name in ((self._reader, "modem-reader"), (self._writer, "modem-writer")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+        self.on_urc("+CREG", self._on_creg)
+        # Wake-up: the first AT after power-on is often swallowed by autobaud
+        for _ in range(3):
+            try:
+                self.command("AT", timeout=1.0)
+                break
+            except ModemError:
+                continue
+        else:
+            raise ModemError("modem not responding")
+        for at in INIT_COMMANDS:
+            self.command(at)
+        self.status['connected'] = True
+        return self
+
+    def close(self):
+        self._running = False
+        self.queue.put((-1, next(self._seq), None))
+        for t in self._threads:
+            t.join(timeout=1.0)
+        self._fail_pending("modem closed")
+        if self.ser is not None:
+            self.ser.close()
+        self.status['connected'] = False
+
+    def _fail_pending(self, reason):
+        # Nobody will write these any more: fail them instead of leaving callers waiting
+        with self._lock:
+            active = self._active
+        if active is not None:
+            self._finish(active, False, reason)
+        while True:
+            try:
+                _, _, cmd = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if cmd is not None:
+                self._finish(cmd, False, reason)
+
+    # --- Public API ---
+    def submit(self, at, data=None, timeout=COMMAND_TIMEOUT, priority=PRIORITY_NORMAL):
+        cmd = Command(at, data, timeout, priority)
+        if not self._running:
+            self._finish(cmd, False, "modem not running")
+            return cmd
+        self.queue.put((priority, next(self._seq), cmd))
+        return cmd
+
+    def command(self, at, timeout=COMMAND_TIMEOUT, priority=PRIORITY_NORMAL):
+        cmd = self.submit(at, timeout=timeout, priority=priority)
+        # Queue wait is not part of the modem's timeout (result() allows for both)
+        return cmd.result()
+
+    def send_sms(self, number, text, priority=PRIORITY_NORMAL, timeout=SMS_TIMEOUT):
+        # Returns the message reference from +CMGS
+        body = text.replace("\x1a", "").replace("\x1b", "")
+        cmd = self.submit(f'AT+CMGS="{number}"', data=body.encode("ascii", errors="replace") + b"\x1a",
+                          timeout=timeout, priority=priority)
+        try:
+            lines = cmd.result()
+        except ModemError:
+            self.status['sms_failed'] += 1
+            raise
+        self.status['sms_sent'] += 1
+        for line in lines:
+            if line.startswith("+CMGS:"):
+                return int(line.split(":")[1].strip() or 0)
+        return None
+
+    def on_urc(self, prefix, callback):
+        # callback(line) runs on the reader thread: keep it short, and never
+        # call command() from it (use submit())
+        self._handlers.append((prefix, callback))
+
+    def signal_quality(self, priority=PRIORITY_BACKGROUND):
+        for line in self.command("AT+CSQ", priority=priority):
+            m = re.match(r"\+CSQ:\s*(\d+)", line)
+            if m:
+                self.status['signal'] = int(m.group(1))
+        return self.status['signal']
+
+    def registration(self, priority=PRIORITY_BACKGROUND):
+        for line in self.command("AT+CREG?", priority=priority):
+            m = re.match(r"\+CREG:\s*\d+,\s*(\d+)", line)
+            if m:
+                self.status['registered'] = int(m.group(1))
+        return self.status['registered']
+
+    # --- Writer: one command in flight at a time ---
+    def _writer(self):
+        try:
+            while self._running:
+                _, _, cmd = self.queue.get()
+                if cmd is None:
+                    break
+                if cmd.abandoned:
+                    self._finish(cmd, False, "abandoned by caller")
+                    continue
+                with self._lock:
+                    self._active = cmd
+                try:
+                    self._execute(cmd)
+                except OSError as e:     # serial.SerialException is an OSError
+                    self._finish(cmd, False, f"serial error: {e}")
+                except Exception as e:
+                    print(f"⚠️ Modem writer error ({cmd.at}): {e}")
+                    self._finish(cmd, False, f"writer error: {e}")
+                finally:
+                    with self._lock:
+                        self._active = None
+        finally:
+            self._running = False
+            self._fail_pending("modem writer stopped")
+
+    def _execute(self, cmd):
+        self.ser.write(cmd.at.encode() + b"\r")
+        if cmd.data is not None:
+            deadline = time.monotonic() + PROMPT_TIMEOUT
+            while not cmd.prompt.wait(0.02):
+                if cmd.done.is_set():
+                    return  # ERROR instead of a prompt
+                if time.monotonic() > deadline:
+                    self.ser.write(b"\x1b")     # Abort the pending prompt
+                    self._finish(cmd, False, "no '>' prompt")
+                    return
+            self.ser.write(cmd.data)
+        if not cmd.done.wait(cmd.timeout):
+            self._finish(cmd, False, "timeout")
+
+    def _finish(self, cmd, ok, error=None):
+        if cmd.done.is_set():
+            return
+        cmd.ok = ok
+        cmd.error = error
+        cmd.finished_at = time.monotonic()
+        COMMAND_TIME[bool(ok)].record(int((cmd.finished_at - cmd.queued_at) * 1e9))
+        if ok:
+            self.status['last_ok'] = time.time()
+        cmd.done.set()
+
+    # --- Reader: split the byte stream into lines and route them ---
+    def _reader(self):
+        buf = bytearray()
+        while self._running:
+            try:
+                chunk = self.ser.read(max(1, self.ser.in_waiting))
+            except OSError as e:
+                print(f"❌ Modem read error: {e}")
+                self.status['connected'] = False
+                time.sleep(1.0)
+                continue
+            if not chunk:
+                continue
+            buf += chunk
+            while True:
+                # The SMS prompt is '> ' with no line ending
+                if buf.lstrip(b"\r\n").startswith(b">"):
+                    with self._lock:
+                        active = self._active
+                    if active is not None and active.data is not None and not active.prompt.is_set():
+                        active.prompt.set()
+                        del buf[:buf.index(b">") + 1]
+                        continue
+                end = buf.find(b"\n")
+                if end < 0:
+                    break
+                line = buf[:end].strip().decode("ascii", errors="replace")
+                del buf[:end + 1]
+                if line:
+                    self._route(line)
+
+    def _route(self, line):
+        with self._lock:
+            active = self._active
+        if active is not None:
+            if line == active.at:
+                return  # Echo (before ATE0 takes effect)
+            if line in FINAL_OK:
+                self._finish(active, True)
+                return
+            if line.startswith(FINAL_ERROR):
+                self._finish(active, False, line)
+                return
+            if active.prefix and line.startswith("+" + active.prefix.lstrip("+") + ":"):
+                active.lines.append(line)
+                return
+        if line.startswith(URC_PREFIXES):
+            self._dispatch(line)
+        elif active is not None:
+            active.lines.append(line)   # Response body (e.g. SMS text after +CMGR)
+
+    def _dispatch(self, line):
+        for prefix, callback in self._handlers:
+            if line.startswith(prefix):
+                try:
+                    callback(line)
+                except Exception as e:
+                    print(f"⚠️ URC handler error ({prefix}): {e}")
+
+    def _on_creg(self, line):
+        # URC form: +CREG: <stat>[,<lac>,<ci>]
+        m = re.match(r"\+CREG:\s*(\d+)", line)
+        if m:
+            self.status['registered'] = int(m.group(1))
+
+
+def parse_cmti(line):
+    # '+CMTI: "SM",3' -> ('SM', 3)
+    m = re.match(r'\+CMTI:\s*"(\w+)",\s*(\d+)', line)
+    return (m.group(1), int(m.group(2))) if m else None
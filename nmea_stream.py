@@ -0,0 +1,214 @@
+import math
+import struct
+
+import metrics
+
+# --- Incremental NMEA reader ---
+# Works on raw byte chunks straight from the UART: no per-line decode, no
+# readline() timeouts. Sentences with a bad checksum are counted and
+# dropped. Any talker is accepted ($GP, $GN, $GL, $GA, $BD, ...), so
+# multi-constellation receivers work too.
+MAX_SENTENCE = 96           # NMEA 0183 allows 82; anything longer is line noise
+KNOTS_TO_KMH = 1.852
+
+
+class NmeaReader:
+    def __init__(self):
+        self.buf = bytearray()
+        self.sentences = 0
+        self.bad_checksum = 0
+        self.garbage = 0
+
+    def feed(self, chunk):
+        # Returns a list of (sentence type, fields) for every complete, valid sentence
+        buf = self.buf
+        buf += chunk
+        out = []
+        pos = 0
+        while True:
+            start = buf.find(b"$", pos)
+            if start < 0:
+                self.garbage += len(buf) - pos
+                pos = len(buf)
+                break
+            self.garbage += start - pos
+            end = buf.find(b"\n", start)
+            if end < 0:
+                if len(buf) - start > MAX_SENTENCE:
+                    self.garbage += len(buf) - start
+                    pos = len(buf)
+                else:
+                    pos = start
+                break
+            # A '$' inside the line means we joined mid-sentence; restart there
+            restart = buf.find(b"$", start + 1, end)
+            if restart >= 0:
+                self.garbage += restart - start
+                pos = restart
+                continue
+            sentence = self._parse(buf, start, end)
+            if sentence is not None:
+                out.append(sentence)
+            pos = end + 1
+        del buf[:pos]
+        return out
+
+    def _parse(self, buf, start, end):
+        star = buf.rfind(b"*", start, end)
+        if star < 0 or end - start > MAX_SENTENCE:
+            self.bad_checksum += 1
+            metrics.dropped("gps.nmea_checksum")
+            return None
+        body = bytes(buf[start + 1:star])
+        try:
+            expected = int(buf[star + 1:star + 3], 16)
+        except ValueError:
+            self.bad_checksum += 1
+            metrics.dropped("gps.nmea_checksum")
+            return None
+        checksum = 0
+        for b in body:
+            checksum ^= b
+        if checksum != expected:
+            self.bad_checksum += 1
+            metrics.dropped("gps.nmea_checksum")
+            return None
+        fields = body.decode("ascii", errors="replace").split(",")
+        self.sentences += 1
+        # 'GNRMC' -> 'RMC' (proprietary '$PUBX' etc. keep their full name)
+        name = fields[0]
+        kind = name[2:] if len(name) == 5 and not name.startswith("P") else name
+        return kind, fields
+
+
+# --- Field helpers ---
+
+def _float(s, default=None):
+    try:
+        return float(s) if s else default
+    except ValueError:
+        return default
+
+
+def _coord(value, hemisphere):
+    # ddmm.mmmm / dddmm.mmmm -> signed decimal degrees
+    v = _float(value)
+    if v is None:
+        return None
+    degrees = int(v // 100)
+    result = degrees + (v - degrees * 100) / 60.0
+    return -result if hemisphere in ("S", "W") else result
+
+
+# --- Fusion of one epoch's sentences into a single fix ---
+# A receiver emits RMC, VTG, GGA, ... once per navigation epoch. RMC and GGA
+# both carry the UTC time of the epoch; VTG and the rest belong to the epoch
+# in progress. A fix is emitted as soon as both RMC and GGA of an epoch are
+# in (lowest latency), or when the next epoch starts with only one of them.
+
+class FixFuser:
+    def __init__(self):
+        self.epoch = None
+        self.fix = {}
+        self.have = set()
+        self.fixes = 0
+
+    def push(self, kind, fields):
+        # Returns a completed fix dict or None
+        if kind not in ("RMC", "GGA", "VTG"):
+            return None
+        emitted = None
+        if kind in ("RMC", "GGA"):
+            utc = fields[1] if len(fields) > 1 else ""
+            if utc != self.epoch:
+                emitted = self._flush()
+                self.epoch = utc
+        try:
+            getattr(self, "_" + kind.lower())(fields)
+        except (IndexError, ValueError):
+            return emitted  # Truncated or corrupt sentence
+        self.have.add(kind)
+        if emitted is None and {"RMC", "GGA"} <= self.have:
+            emitted = self._flush()
+        return emitted
+
+    def _flush(self):
+        fix, self.fix, self.have = self.fix, {}, set()
+        if not fix.get("valid") or fix.get("latitude") is None or fix.get("longitude") is None:
+            return None
+        fix.setdefault("speed", 0.0)
+        fix.setdefault("heading", math.nan)
+        fix.setdefault("hdop", math.nan)
+        fix.setdefault("satellites", -1)
+        fix["utc"] = self.epoch
+        self.fixes += 1
+        return fix
+
+    def _rmc(self, f):
+        # $xxRMC,time,status,lat,N,lon,E,sog(kn),cog,date,...
+        self.fix["valid"] = f[2] == "A"
+        self.fix["latitude"] = _coord(f[3], f[4])
+        self.fix["longitude"] = _coord(f[5], f[6])
+        speed = _float(f[7])
+        if speed is not None:
+            self.fix["speed"] = speed * KNOTS_TO_KMH
+        heading = _float(f[8])
+        if heading is not None:
+            self.fix["heading"] = heading
+        self.fix["date"] = f[9]
+
+    def _gga(self, f):
+        # $xxGGA,time,lat,N,lon,E,quality,sats,hdop,alt,M,...
+        quality = int(f[6] or 0)
+        self.fix["quality"] = quality
+        if "valid" not in self.fix:
+            self.fix["valid"] = quality > 0
+        if self.fix.get("latitude") is None:
+            self.fix["latitude"] = _coord(f[2], f[3])
+            self.fix["longitude"] = _coord(f[4], f[5])
+        self.fix["satellites"] = int(f[7] or -1)
+        self.fix["hdop"] = _float(f[8], math.nan)
+        self.fix["altitude"] = _float(f[9])
+
+    def _vtg(self, f):
+        # $xxVTG,cog(true),T,cog(mag),M,sog(kn),N,sog(km/h),K,mode
+        heading = _float(f[1])
+        if heading is not None:
+            self.fix["heading"] = heading
+        speed = _float(f[7])
+        if speed is not None:
+            self.fix["speed"] = speed
+
+
+# --- u-blox (UBX) receiver configuration ---
+# The NEO-7M defaults to 1 Hz at 9600 baud. 10 Hz of full NMEA output is
+# ~5 KB/s, well over what 9600 baud carries, so the port is switched to a
+# higher baud first and the sentences nobody reads (GSV, GSA, GLL) are
+# turned off.
+UBX_SYNC = b"\xb5\x62"
+NMEA_MSG_IDS = {"GGA": 0x00, "GLL": 0x01, "GSA": 0x02, "GSV": 0x03, "RMC": 0x04, "VTG": 0x05}
+
+
+def ubx_packet(msg_class, msg_id, payload=b""):
+    body = struct.pack("<BBH", msg_class, msg_id, len(payload)) + payload
+    ck_a = ck_b = 0
+    for b in body:
+        ck_a = (ck_a + b) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return UBX_SYNC + body + bytes((ck_a, ck_b))
+
+
+def ubx_set_rate(hz):
+    # CFG-RATE: measurement period (ms), 1 measurement per solution, GPS time
+    return ubx_packet(0x06, 0x08, struct.pack("<HHH", int(round(1000.0 / hz)), 1, 1))
+
+
+def ubx_set_uart_baud(baud):
+    # CFG-PRT for UART1: 8N1, UBX+NMEA in, UBX+NMEA out
+    payload = struct.pack("<BBHIIHHHH", 1, 0, 0, 0x000008D0, baud, 0x0003, 0x0003, 0, 0)
+    return ubx_packet(0x06, 0x00, payload)
+
+
+def ubx_set_nmea_output(sentence, enabled):
+    # CFG-MSG: output rate of one NMEA sentence on the current port
+    return ubx_packet(0x06, 0x01, struct.pack("<BBB", 0xF0, NMEA_MSG_IDS[sentence], 1 if enabled else 0))
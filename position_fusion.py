@@ -0,0 +1,213 @@
+import math
+import time
+import numpy as np
+
+import gps_fix
+
+# --- Configuration ---
+# GPS + accelerometer position estimate. A 4-state Kalman filter
+# (east/north position and velocity, metres) is propagated with the
+# vibration sensors' horizontal acceleration every poll (50 Hz) and
+# corrected whenever gps_tracker publishes a new fix. Output goes to the
+# fused gps_fix slot, so hazard tagging gets a position between fixes.
+#
+# The accelerometers are mounted with FORWARD_AXIS pointing along the car
+# and LEFT_AXIS across it. Gravity leaking into those axes from mounting
+# tilt is learned as a bias whenever GPS says the car is standing still.
+FORWARD_AXIS = 0            # 0=X, 1=Y, 2=Z
+FORWARD_SIGN = 1
+LEFT_AXIS = 1
+LEFT_SIGN = 1
+G = 9.80665
+
+ACCEL_NOISE = 0.8           # m/s² process noise (unmodelled accel, vibration)
+UERE = 4.0                  # m, position sigma = HDOP * UERE (NEO-7M class receiver)
+MIN_POS_SIGMA = 2.5
+VEL_SIGMA = 0.5             # m/s for GPS speed/course
+MIN_HEADING_SPEED = 1.5     # m/s; below this GPS course and velocity direction are noise
+STATIONARY_SPEED = 0.3      # m/s; below this the car is treated as parked (learn bias, no integration)
+BIAS_ALPHA = 0.005          # Per poll: ~4 s time constant at 50 Hz
+BIAS_MAX_STEP = 0.5         # m/s²; larger readings while "parked" mean the car just started moving
+GATE_CHI2 = {2: 9.21, 4: 13.28}  # p=0.01: reject fixes that jump implausibly...
+MAX_REJECTS = 3             # ...unless they keep disagreeing, then trust GPS again
+DEAD_RECKON_LIMIT = 10.0    # Seconds without a fix before the estimate stops being published
+EARTH_RADIUS_M = 6371000.0
+
+
+class PositionFilter:
+    def __init__(self):
+        self.x = np.zeros(4)                # east, north, v_east, v_north
+        self.P = np.eye(4) * 1e6
+        self.bias = np.zeros(2)             # forward, left (m/s²)
+        self.origin = None                  # (lat0, lon0, cos(lat0))
+        self.heading = math.nan
+        self.stationary = True
+        self.last_t = None
+        self.last_fix_t = None
+        self.rejects = 0
+        self.fix_info = {}
+        self._I = np.eye(4)
+
+    def _to_local(self, lat, lon):
+        lat0, lon0, c = self.origin
+        return (math.radians(lon - lon0) * EARTH_RADIUS_M * c,
+                math.radians(lat - lat0) * EARTH_RADIUS_M)
+
+    def _to_global(self, e, n):
+        lat0, lon0, c = self.origin
+        return (lat0 + math.degrees(n / EARTH_RADIUS_M),
+                lon0 + math.degrees(e / (EARTH_RADIUS_M * c)))
+
+    def predict(self, t, accel_forward_left):
+        # accel_forward_left: mean body-frame horizontal acceleration (m/s²) since the last call
+        if self.last_t is None or self.origin is None:
+            self.last_t = t
+            return
+        dt = min(max(t - self.last_t, 0.0), 0.2)
+        self.last_t = t
+        if dt == 0.0:
+            return
+
+        a = np.asarray(accel_forward_left, dtype=np.float64)
+        if self.stationary:
+            # Parked: whatever the accelerometers see is tilt/offset
+            step = a - self.bias
+            if abs(step[0]) < BIAS_MAX_STEP and abs(step[1]) < BIAS_MAX_STEP:
+                self.bias += BIAS_ALPHA * step
+            ax = ay = 0.0
+        else:
+            a_f, a_l = a - self.bias
+            vx, vy = self.x[2], self.x[3]
+            if math.hypot(vx, vy) >= MIN_HEADING_SPEED:
+                h = math.atan2(vx, vy)
+            elif self.heading == self.heading:
+                h = math.radians(self.heading)
+            else:
+                h = None
+            if h is None:
+                ax = ay = 0.0
+            else:
+                s, c = math.sin(h), math.cos(h)
+                # Heading is clockwise from north: forward = (sin, cos), left = (-cos, sin)
+                ax = a_f * s - a_l * c
+                ay = a_f * c + a_l * s
+
+        half = 0.5 * dt * dt
+        x = self.x
+        x[0] += x[2] * dt + half * ax
+        x[1] += x[3] * dt + half * ay
+        x[2] += ax * dt
+        x[3] += ay * dt
+
+        F = np.array([[1.0, 0.0, dt, 0.0],
+                      [0.0, 1.0, 0.0, dt],
+                      [0.0, 0.0, 1.0, 0.0],
+                      [0.0, 0.0, 0.0, 1.0]])
+        q = ACCEL_NOISE * ACCEL_NOISE
+        q11, q12, q22 = q * half * half, q * half * dt, q * dt * dt
+        Q = np.array([[q11, 0.0, q12, 0.0],
+                      [0.0, q11, 0.0, q12],
+                      [q12, 0.0, q22, 0.0],
+                      [0.0, q12, 0.0, q22]])
+        self.P = F @ self.P @ F.T + Q
+
+    def update(self, fix, t):
+        # fix: dict from gps_fix.read_fix()
+        if self.origin is None:
+            self.origin = (fix["latitude"], fix["longitude"], math.cos(math.radians(fix["latitude"])))
+
+        speed = fix["speed"] / 3.6
+        heading = fix["heading"]
+        self.stationary = speed < STATIONARY_SPEED
+        if speed >= MIN_HEADING_SPEED and heading == heading:
+            self.heading = heading
+
+        e, n = self._to_local(fix["latitude"], fix["longitude"])
+        hdop = fix["hdop"] if fix["hdop"] == fix["hdop"] else 2.0
+        pos_sigma = max(MIN_POS_SIGMA, hdop * UERE)
+
+        if self.stationary:
+            z = np.array([e, n, 0.0, 0.0])
+            vel_ok = True
+        elif self.heading == self.heading:
+            h = math.radians(self.heading)
+            z = np.array([e, n, speed * math.sin(h), speed * math.cos(h)])
+            vel_ok = True
+        else:
+            z = np.array([e, n])
+            vel_ok = False
+
+        if self.last_fix_t is None:
+            self.x[:] = (z[0], z[1], z[2] if vel_ok else 0.0, z[3] if vel_ok else 0.0)
+            self.P = np.diag([pos_sigma ** 2, pos_sigma ** 2, 4.0, 4.0])
+            self.last_fix_t = t
+            self.last_t = t
+            self.fix_info = fix
+            return True
+
+        H = self._I if vel_ok else self._I[:2]
+        R = np.diag([pos_sigma ** 2, pos_sigma ** 2, VEL_SIGMA ** 2, VEL_SIGMA ** 2][:len(z)])
+        y = z - H @ self.x
+        S = H @ self.P @ H.T + R
+        S_inv = np.linalg.inv(S)
+        if float(y @ S_inv @ y) > GATE_CHI2[len(z)] and self.rejects < MAX_REJECTS:
+            self.rejects += 1
+            return False
+        self.rejects = 0
+        K = self.P @ H.T @ S_inv
+        self.x += K @ y
+        self.P = (self._I - K @ H) @ self.P
+        self.last_fix_t = t
+        self.fix_info = fix
+        return True
+
+    def estimate(self, t):
+        # (lat, lon, speed km/h, heading deg, position sigma m) or None
+        if self.last_fix_t is None or t - self.last_fix_t > DEAD_RECKON_LIMIT:
+            return None
+        lat, lon = self._to_global(self.x[0], self.x[1])
+        vx, vy = self.x[2], self.x[3]
+        speed = math.hypot(vx, vy)
+        heading = (math.degrees(math.atan2(vx, vy)) % 360.0) if speed >= MIN_HEADING_SPEED else self.heading
+        sigma = math.sqrt(max(self.P[0, 0], self.P[1, 1]))
+        return lat, lon, speed * 3.6, heading, sigma
+
+
+class FusionStage:
+    # Glue for vibration_monitor: raw FIFO samples in, fused slot out
+    def __init__(self, lsb_per_g):
+        self.filter = PositionFilter()
+        self.scale = G / float(lsb_per_g)
+        self.slot = None
+        self.last_fix_ts = None
+        self.published = 0
+
+    def step(self, blocks, now=None):
+        # blocks: iterable of (n, 3) int16 sample arrays from one poll (any sensors)
+        now = time.time() if now is None else now
+        total = 0
+        acc = np.zeros(3)
+        for block in blocks:
+            if len(block):
+                acc += block.sum(axis=0, dtype=np.int64)
+                total += len(block)
+        if total:
+            acc *= self.scale / total
+            self.filter.predict(now, (FORWARD_SIGN * acc[FORWARD_AXIS], LEFT_SIGN * acc[LEFT_AXIS]))
+
+        fix = gps_fix.read_fix()
+        if fix is not None and fix["timestamp"] != self.last_fix_ts:
+            self.last_fix_ts = fix["timestamp"]
+            self.filter.update(fix, now)
+
+        est = self.filter.estimate(now)
+        if est is None:
+            return None
+        lat, lon, speed, heading, sigma = est
+        if self.slot is None:
+            self.slot = gps_fix.FixSlot(gps_fix.FUSED_PATH)
+        info = self.filter.fix_info
+        self.slot.write(lat, lon, speed=speed, heading=heading, hdop=info.get("hdop", math.nan),
+                        satellites=info.get("satellites", -1), timestamp=now)
+        self.published += 1
+        return est
@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+from collections import deque
+
+# --- Configuration ---
+# Road-surface analysis on a bird's-eye view of the lane in front of the car.
+# Frames are downsampled, the road trapezoid is perspective-warped into a
+# small fixed-size patch, and potholes are found as compact regions that are
+# clearly darker than the surrounding asphalt *and* have sharp edges
+# (shadows are dark but soft-edged). A detection must persist over several
+# frames before it is reported.
+DOWNSCALE = 0.5
+# Road trapezoid in normalized image coordinates: bottom-left, top-left, top-right, bottom-right
+ROAD_QUAD = ((0.15, 1.0), (0.39, 0.5), (0.61, 0.5), (0.85, 1.0))
+WARP_SIZE = (160, 200)          # Bird's-eye patch (width, height)
+BACKGROUND_KERNEL = 41          # Local asphalt brightness estimate (box blur, px in the patch)
+DARK_DELTA = 30                 # Gray levels darker than local asphalt to count as a hole
+EDGE_LOW, EDGE_HIGH = 50, 150   # Canny thresholds
+MIN_EDGE_DENSITY = 0.08         # Fraction of the region's rim that must be edges
+MIN_AREA_FRAC = 0.003           # Candidate size, as a fraction of the patch
+MAX_AREA_FRAC = 0.25
+CONFIRM_WINDOW = 5              # Temporal confirmation: CONFIRM_HITS of the last
+CONFIRM_HITS = 3                # CONFIRM_WINDOW frames must have a candidate
+
+
+class PotholeAnalyzer:
+    def __init__(self, road_quad=ROAD_QUAD, warp_size=WARP_SIZE, downscale=DOWNSCALE,
+                 confirm_window=CONFIRM_WINDOW, confirm_hits=CONFIRM_HITS):
+        self.road_quad = np.float32(road_quad)
+        self.warp_size = warp_size
+        self.downscale = downscale
+        self.confirm_hits = confirm_hits
+        self.history = deque(maxlen=confirm_window)
+
+        self._frame_shape = None
+        self._warp = None           # small frame -> patch
+        self._unwarp = None         # patch -> full frame
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        patch_area = warp_size[0] * warp_size[1]
+        self._min_area = MIN_AREA_FRAC * patch_area
+        self._max_area = MAX_AREA_FRAC * patch_area
+
+    def _prepare(self, shape):
+        h, w = shape[:2]
+        sh, sw = int(h * self.downscale), int(w * self.downscale)
+        src = self.road_quad * np.float32([sw, sh])
+        pw, ph = self.warp_size
+        dst = np.float32([[0, ph], [0, 0], [pw, 0], [pw, ph]])
+        self._warp = cv2.getPerspectiveTransform(src, dst)
+        self._unwarp = cv2.getPerspectiveTransform(dst, self.road_quad * np.float32([w, h]))
+        self._frame_shape = shape
+
+    def analyze(self, frame):
+        # Returns {'detected', 'candidate', 'confidence', 'regions': [4-point polygons in frame px]}
+        regions, best = self.candidates(frame)
+        return self.confirm(regions, best)
+
+    def candidates(self, frame):
+        # Single-frame part (no history): ([4-point polygons in frame px], strength 0-1)
+        if self._frame_shape != frame.shape:
+            self._prepare(frame.shape)
+
+        small = cv2.resize(frame, None, fx=self.downscale, fy=self.downscale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        patch = cv2.warpPerspective(gray, self._warp, self.warp_size, flags=cv2.INTER_LINEAR)
+
+        # Dark relative to local asphalt (handles lighting gradients across the lane)
+        background = cv2.blur(patch, (BACKGROUND_KERNEL, BACKGROUND_KERNEL))
+        dark = cv2.subtract(background, patch) > DARK_DELTA
+        mask = cv2.morphologyEx(dark.view(np.uint8), cv2.MORPH_OPEN, self._kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self._kernel)
+
+        edges = cv2.Canny(patch, EDGE_LOW, EDGE_HIGH)
+        rim = cv2.morphologyEx(mask, cv2.MORPH_GRADIENT, self._kernel)
+
+        count, labels, comp_stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        regions = []
+        best = 0.0
+        if count > 1:
+            areas = comp_stats[1:, cv2.CC_STAT_AREA]
+            keep = np.flatnonzero((areas >= self._min_area) & (areas <= self._max_area)) + 1
+            if keep.size:
+                # Edge density along each candidate's rim, all candidates at once
+                rim_labels = labels[rim > 0]
+                edge_labels = labels[(rim > 0) & (edges > 0)]
+                rim_px = np.bincount(rim_labels, minlength=count)
+                edge_px = np.bincount(edge_labels, minlength=count)
+                density = edge_px[keep] / np.maximum(rim_px[keep], 1)
+                passed = keep[density >= MIN_EDGE_DENSITY]
+
+                for lab in passed:
+                    x, y, w, h = comp_stats[lab, :4]
+                    corners = np.float32([[[x, y]], [[x + w, y]], [[x + w, y + h]], [[x, y + h]]])
+                    regions.append(cv2.perspectiveTransform(corners, self._unwarp).reshape(-1, 2))
+                if passed.size:
+                    frac = comp_stats[passed, cv2.CC_STAT_AREA] / float(self._max_area)
+                    best = float(min(1.0, frac.max() * 4.0))
+        return regions, best
+
+    def confirm(self, regions, best):
+        # Temporal part: frames must arrive here in capture order
+        candidate = bool(regions)
+        self.history.append(candidate)
+        hits = sum(self.history)
+        detected = hits >= self.confirm_hits
+        confidence = (hits / float(self.history.maxlen)) * (0.5 + 0.5 * best) if candidate or detected else 0.0
+        return {
+            "detected": detected,
+            "candidate": candidate,
+            "confidence": round(confidence, 3),
+            "regions": regions,
+        }
+
+    def road_outline(self, shape):
+        # Road trapezoid in frame pixels (for the overlay)
+        h, w = shape[:2]
+        return (self.road_quad * np.float32([w, h])).astype(np.int32)
@@ -1,84 +1,182 @@
+import os
 import cv2
 import time
 import json
+import threading
 import numpy as np
 from flask import Flask, Response
+from vision_pipeline import FrameGrabber, FrameBroadcaster, StageStats
+from vision_governor import VisionGovernor
+from frame_sources import open_source
+import hal
+from pothole_analysis import PotholeAnalyzer
+import hazard_store
+import metrics
+import video_ring
+import service_loop
 
 app = Flask(__name__)
 
 # Config
-CAMERA_INDEX = 1 
-# Global State
+CAMERA_INDEX = 1
+# Optional recorded video file / image folder to replay instead of the camera
+CAMERA_SOURCE = os.environ.get("POTHOLE_SOURCE")
+SIMULATION_FPS = 30
+# Per-frame processing budget held by the governor (vision_governor.py)
+LATENCY_BUDGET_MS = 40
+# Keep the last seconds of video and save a clip around every detection (video_ring.py)
+CLIP_RECORDING = True
+
+# Global State (written only by the analysis worker)
 pothole_detected = False
+hazard = None
+# Pre-serialized /status body, swapped in one assignment by the worker so the
+# endpoint never computes anything
+status_body = json.dumps({'detected': False}).encode()
+
+# Pipeline: capture thread -> analysis worker -> broadcaster (viewers only)
+grabber = None
+governor = None
+broadcaster = FrameBroadcaster("pothole")
+clips = video_ring.attach(broadcaster) if CLIP_RECORDING else None
+stats = {"analyze": StageStats("analyze"), "overlay": StageStats("overlay")}
+_worker = None
+_worker_lock = threading.Lock()
+# Liveness for start_car.py: a beat per analyzed frame (or while the camera is away)
+heartbeat = service_loop.Heartbeat()
+
+
+class SimulatedRoad:
+    # Stand-in camera when none is connected: a road with a pothole that
+    # appears every 5 seconds. It goes through the real analysis below.
+    def isOpened(self):
+        return True
+
+    def read(self):
+        time.sleep(1 / SIMULATION_FPS)
+        return True, render_simulation()
 
-def generate_frames():
-    global pothole_detected
+    def release(self):
+        pass
+
+
+def render_simulation():
+    # Simulation Mode (Black background with moving "road")
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    # Draw Road
+    cv2.fillPoly(frame, [np.array([[100, 480], [250, 240], [390, 240], [540, 480]])], (90, 90, 90))
+    # Draw Lane Lines
+    cv2.line(frame, (320, 240), (320, 480), (255, 255, 255), 2)
+
+    # Simulate Pothole
+    if int(time.time() * 2) % 10 < 2: # Show pothole every 5 seconds
+        cv2.circle(frame, (280, 400), 30, (10, 10, 10), -1) # Hole
+    return frame
+
+def open_camera():
+    if CAMERA_SOURCE:
+        return open_source(CAMERA_SOURCE, realtime=True, loop=True)
+    if hal.BACKEND == "sim":
+        return SimulatedRoad()
     # Try opening camera
-    camera = cv2.VideoCapture(CAMERA_INDEX, cv2.CAP_DSHOW)
+    camera = hal.open_camera(CAMERA_INDEX)
+    if not camera.isOpened():
+        camera = hal.open_camera(0) # Fallback to 0
     if not camera.isOpened():
-        camera = cv2.VideoCapture(0, cv2.CAP_DSHOW) # Fallback to 0
-    
-    using_simulation = not camera.isOpened()
-    print(f"Pothole Detector: Camera Open? {not using_simulation}")
+        print("Pothole Detector: No camera, using simulation")
+        return SimulatedRoad()
+    return camera
 
-    while True:
-        if not using_simulation:
-            success, frame = camera.read()
-            if not success:
-                frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                cv2.putText(frame, "Camera Error", (50, 240), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-        else:
-            # Simulation Mode (Black background with moving "road")
-            frame = np.zeros((480, 640, 3), dtype=np.uint8)
-            # Draw Road
-            cv2.fillPoly(frame, [np.array([[100, 480], [250, 240], [390, 240], [540, 480]])], (50, 50, 50))
-            # Draw Lane Lines
-            cv2.line(frame, (320, 240), (320, 480), (255, 255, 255), 2)
-            
-            # Simulate Pothole
-            if int(time.time() * 2) % 10 < 2: # Show pothole every 5 seconds
-                cv2.circle(frame, (320, 400), 40, (0, 0, 0), -1) # Hole
-                cv2.circle(frame, (320, 400), 45, (0, 0, 255), 2) # Red Ring
-                cv2.putText(frame, "POTHOLE DETECTED", (200, 350), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-
-        # Basic Processing (Edge Detection to simulate "Analysis")
-        # edges = cv2.Canny(frame, 100, 200)
-        # overlay = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-        # frame = cv2.addWeighted(frame, 0.8, overlay, 0.2, 0)
-
-        # Overlay Info
-        cv2.putText(frame, "Road Surface Monitor", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-        cv2.putText(frame, "Status: Scanning...", (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 1)
-
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame_bytes = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-
-        if not using_simulation:
-            # ... (existing real camera logic stub)
-            pass
+def draw_overlay(frame, analyzer, result):
+    cv2.polylines(frame, [analyzer.road_outline(frame.shape)], True, (0, 255, 255), 1)
+    for region in result["regions"]:
+        cv2.polylines(frame, [region.astype(np.int32)], True, (0, 0, 255), 2)
+    if result["detected"]:
+        cv2.putText(frame, "POTHOLE DETECTED", (200, 350), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+    # Overlay Info
+    cv2.putText(frame, "Road Surface Monitor", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    cv2.putText(frame, "Status: Scanning...", (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 1)
+
+def update_state(result, captured_at):
+    # Hazard report, clip and /status body for one analyzed frame (in capture order)
+    global pothole_detected, status_body, hazard
+    if result["detected"] != pothole_detected:
+        if result["detected"]:
+            # One report per pass, tagged with the GPS fix and merged with earlier hits
+            hazard = hazard_store.get_store().report_at_current_fix("pothole", result["confidence"])
+            where = f" @ {hazard['latitude']:.6f},{hazard['longitude']:.6f} (hit {hazard['hits']})" if hazard else ""
+            print(f"🕳️ Pothole detected{where}")
+            if clips is not None:
+                clips.trigger("pothole", captured_at)
         else:
-            # Simulation Logic
-            # Store detection state in global variable
-            global pothole_detected
-            current_time = int(time.time() * 2)
-            if current_time % 10 < 2: 
-                pothole_detected = True
-            else:
-                pothole_detected = False
+            print("✅ Road clear")
+    pothole_detected = result["detected"]
+    status = {
+        'detected': pothole_detected,
+        'confidence': result["confidence"],
+        'timestamp': captured_at,
+    }
+    if pothole_detected and hazard is not None:
+        status['latitude'] = hazard['latitude']
+        status['longitude'] = hazard['longitude']
+        status['hits'] = hazard['hits']
+    status_body = json.dumps(status).encode()
+
+def analysis_loop():
+    analyzer = PotholeAnalyzer()
 
-            # ... (drawing logic)
+    seq = 0
+    while True:
+        item = grabber.next_frame(seq, timeout=1.0)
+        if item is None:
+            if not grabber.connected:
+                heartbeat.beat()
+            continue
+        seq, captured_at, frame = item
+        heartbeat.beat()
+        if not governor.take(captured_at):
+            continue
+
+        # The analyzer re-fits its warp when the frame size changes
+        started = t0 = time.perf_counter()
+        frame = governor.fit(frame)
+        result = analyzer.analyze(frame)
+        stats["analyze"].record(t0)
+        update_state(result, captured_at)
+
+        if broadcaster.wants_frames(captured_at):
+            t0 = time.perf_counter()
+            draw_overlay(frame, analyzer, result)
+            stats["overlay"].record(t0)
+            broadcaster.publish(frame, captured_at)
+        governor.observe(started)
+
+def start_worker():
+    # Analysis runs continuously, whether or not anyone is streaming
+    global grabber, governor, _worker
+    with _worker_lock:
+        if _worker is None:
+            grabber = FrameGrabber(open_camera, name="pothole").start()
+            governor = VisionGovernor("pothole", LATENCY_BUDGET_MS, grabber=grabber, broadcaster=broadcaster)
+            _worker = threading.Thread(target=analysis_loop, name="pothole-analyze", daemon=True)
+            _worker.start()
 
 @app.route('/status')
 def get_status():
-    global pothole_detected
-    return Response(json.dumps({'detected': pothole_detected}), mimetype='application/json')
+    return Response(status_body, mimetype='application/json')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(module="pothole_detector"), mimetype=metrics.CONTENT_TYPE)
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    start_worker()
+    return Response(broadcaster.stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 if __name__ == '__main__':
     print("Starting Pothole Detector on Port 5002...")
+    start_worker()
+    heartbeat.ready()
     app.run(host='0.0.0.0', port=5002, threaded=True)
@@ -0,0 +1,249 @@
+import json
+import math
+import numpy as np
+
+# --- Configuration ---
+# Polar occupancy grid over the radar's field of view, updated once per
+# sweep (radar_sweep.SweepFrame). Each angle bin keeps a smoothed distance
+# and a closing speed; bins are grouped into sectors for alerts, and runs of
+# close bins are clustered into obstacles. Only what changed since the last
+# emit is sent upstream (plus a full keyframe now and then).
+GRID_URL = "http://localhost:5000/api/radar/grid"
+MIN_ANGLE = 0
+MAX_ANGLE = 180
+BIN_DEG = 9                 # Matches radar_sweep.STEP_DEG
+FREE_MM = 2000              # "No target" readings count as free space out to here
+SMOOTHING = 0.4             # EMA weight of a new reading
+JUMP_MM = 250               # Bigger changes replace the bin value instead of being smoothed
+OUTLIER_MM = 400            # A lone reading this far from its bin and both neighbours is dropped
+SPEED_SMOOTHING = 0.5
+SECTORS = (("left", 0, 36), ("front_left", 36, 72), ("front", 72, 108),
+           ("front_right", 108, 144), ("right", 144, 181))
+OBSTACLE_MM = 1500          # Bins closer than this can form obstacles
+CLUSTER_GAP_MM = 200        # Adjacent bins further apart than this are separate obstacles
+DANGER_MM, WARN_MM = 300, 700
+DANGER_TTC, WARN_TTC = 1.0, 2.5     # Seconds to contact at the current closing speed
+SECTOR_DELTA_MM = 50        # Sector changes smaller than this are not re-sent
+OBSTACLE_MATCH_DEG = 20
+KEYFRAME_INTERVAL = 10.0
+# Messages go through the telemetry spool, one 512-byte slot each (header
+# and URL envelope included); bigger deltas are split across messages
+MAX_MESSAGE_BYTES = 384
+# On the wire sectors and obstacles are arrays of these fields
+SECTOR_FIELDS = ('distance', 'angle', 'closing', 'ttc', 'level')
+OBSTACLE_FIELDS = ('id', 'from', 'to', 'angle', 'distance', 'closing')
+
+LEVELS = ("clear", "warn", "danger")
+
+
+class PolarGrid:
+    def __init__(self, min_angle=MIN_ANGLE, max_angle=MAX_ANGLE, bin_deg=BIN_DEG):
+        self.min_angle = min_angle
+        self.bin_deg = bin_deg
+        n = int(round((max_angle - min_angle) / bin_deg)) + 1
+        self.centers = min_angle + np.arange(n) * bin_deg
+        self.distance = np.full(n, np.nan)      # Smoothed mm
+        self.latest = np.full(n, np.nan)        # Last accepted reading (alerts don't wait for the EMA)
+        self.updated = np.zeros(n)              # Unix time of the last accepted reading
+        self.speed = np.zeros(n)                # Closing speed mm/s (positive = approaching)
+        self.pending = np.full(n, np.nan)       # Rejected reading, accepted if seen again
+        self.sector_bins = [(name, (self.centers >= lo) & (self.centers < hi)) for name, lo, hi in SECTORS]
+
+        self.sectors = {}
+        self.obstacles = {}
+        self._next_obstacle_id = 1
+        self._sent_sectors = {}
+        self._sent_obstacles = {}
+        self._last_keyframe = 0.0
+        self.rejected = 0
+
+    # --- Update from one sweep ---
+    def update(self, frame):
+        n = frame.n
+        if n == 0:
+            return
+        angles = frame.angles[:n].astype(np.float64)
+        readings = frame.distances[:n].astype(np.float64)
+        times = frame.times[:n]
+        readings[readings == 0] = FREE_MM
+        readings = np.minimum(readings, FREE_MM)
+
+        bins = np.clip(np.round((angles - self.min_angle) / self.bin_deg).astype(int), 0, len(self.centers) - 1)
+        # Several readings in one bin: keep the latest
+        order = np.argsort(times, kind="stable")
+        last = {}
+        for i in order:
+            last[bins[i]] = i
+        idx = np.fromiter(last.values(), dtype=int)
+        b = np.fromiter(last.keys(), dtype=int)
+        sort = np.argsort(b)
+        b, idx = b[sort], idx[sort]
+        d, t = readings[idx], times[idx]
+
+        old = self.distance[b]
+        known = ~np.isnan(old)
+        diff = np.where(known, np.abs(d - old), 0.0)
+
+        # Spatial outlier test: far from the bin's history and from both
+        # neighbours in this sweep. Real obstacles span several bins (the
+        # sensor cone is ~25°), so they are accepted on the first sweep.
+        left = np.concatenate(([np.inf], np.abs(d[1:] - d[:-1])))
+        right = np.concatenate((np.abs(d[:-1] - d[1:]), [np.inf]))
+        lone = (diff > OUTLIER_MM) & (left > OUTLIER_MM) & (right > OUTLIER_MM)
+        # ...unless the same bin saw the same thing last sweep
+        confirmed = np.abs(self.pending[b] - d) <= OUTLIER_MM
+        reject = lone & ~confirmed
+        self.pending[b] = np.where(reject, d, np.nan)
+        self.rejected += int(reject.sum())
+
+        accept = ~reject
+        b, d, t, old, known, diff = b[accept], d[accept], t[accept], old[accept], known[accept], diff[accept]
+
+        jump = ~known | (diff > JUMP_MM)
+        new = np.where(jump, d, old + SMOOTHING * (d - old))
+
+        # Closing speed from smoothed distance over time (not across jumps)
+        dt = t - self.updated[b]
+        valid = known & ~jump & (dt > 0) & (dt < 2.0)
+        inst = np.where(valid, (old - new) / np.where(dt > 0, dt, 1.0), 0.0)
+        self.speed[b] = np.where(valid, self.speed[b] + SPEED_SMOOTHING * (inst - self.speed[b]),
+                                 np.where(jump, 0.0, self.speed[b]))
+
+        self.distance[b] = new
+        self.latest[b] = d
+        self.updated[b] = t
+        self._summarize()
+
+    def _summarize(self):
+        dist = np.fmin(self.distance, self.latest)
+        sectors = {}
+        for name, mask in self.sector_bins:
+            values = dist[mask]
+            if np.all(np.isnan(values)):
+                continue
+            i = int(np.nanargmin(values))
+            nearest = float(values[i])
+            closing = float(self.speed[mask][i])
+            ttc = nearest / closing if closing > 1.0 else math.inf
+            if nearest < DANGER_MM or ttc < DANGER_TTC:
+                level = 2
+            elif nearest < WARN_MM or ttc < WARN_TTC:
+                level = 1
+            else:
+                level = 0
+            sectors[name] = {
+                'distance': int(nearest),
+                'angle': int(self.centers[mask][i]),
+                'closing': int(round(closing)),
+                'ttc': round(ttc, 2) if ttc != math.inf else None,
+                'level': LEVELS[level],
+            }
+        self.sectors = sectors
+        self.obstacles = self._match(self._cluster())
+
+    def _cluster(self):
+        # Runs of adjacent close bins with similar distance
+        dist = self.distance
+        close = ~np.isnan(dist) & (dist < OBSTACLE_MM)
+        clusters = []
+        start = None
+        for i in range(len(dist) + 1):
+            inside = i < len(dist) and close[i]
+            if inside and start is not None and abs(dist[i] - dist[i - 1]) > CLUSTER_GAP_MM:
+                clusters.append((start, i - 1))
+                start = i
+            elif inside and start is None:
+                start = i
+            elif not inside and start is not None:
+                clusters.append((start, i - 1))
+                start = None
+        result = []
+        for lo, hi in clusters:
+            seg = dist[lo:hi + 1]
+            k = lo + int(np.argmin(seg))
+            result.append({
+                'from': int(self.centers[lo]),
+                'to': int(self.centers[hi]),
+                'angle': float(self.centers[lo:hi + 1].mean()),
+                'distance': int(dist[k]),
+                'closing': int(round(self.speed[k])),
+            })
+        return result
+
+    def _match(self, clusters):
+        # Keep obstacle ids stable across sweeps (nearest centre angle)
+        obstacles = {}
+        free = dict(self.obstacles)
+        for c in clusters:
+            best, best_d = None, OBSTACLE_MATCH_DEG
+            for oid, o in free.items():
+                d = abs(o['angle'] - c['angle'])
+                if d <= best_d:
+                    best, best_d = oid, d
+            if best is None:
+                best = self._next_obstacle_id
+                self._next_obstacle_id += 1
+            else:
+                del free[best]
+            c['angle'] = round(c['angle'], 1)
+            obstacles[best] = c
+        return obstacles
+
+    # --- Change output ---
+    def changes(self, now):
+        # Messages carrying what changed since the last message passed to
+        # sent(); empty if nothing worth sending changed. Post them in order
+        # and stop at the first one that can't be posted: the rest is sent
+        # again (recomputed) next time.
+        keyframe = now - self._last_keyframe >= KEYFRAME_INTERVAL
+        sectors = {}
+        for name, s in self.sectors.items():
+            sent = self._sent_sectors.get(name)
+            if (keyframe or sent is None or sent['level'] != s['level']
+                    or abs(sent['distance'] - s['distance']) >= SECTOR_DELTA_MM):
+                sectors[name] = [s[f] for f in SECTOR_FIELDS[:-1]] + [LEVELS.index(s['level'])]
+
+        added, moved = [], []
+        for oid, o in self.obstacles.items():
+            sent = self._sent_obstacles.get(oid)
+            packed = [oid] + [o[f] for f in OBSTACLE_FIELDS[1:]]
+            if sent is None:
+                added.append(packed)
+            elif (keyframe or abs(sent['distance'] - o['distance']) >= SECTOR_DELTA_MM
+                  or sent['from'] != o['from'] or sent['to'] != o['to']):
+                moved.append(packed)
+        removed = [oid for oid in self._sent_obstacles if oid not in self.obstacles]
+
+        if not (sectors or added or moved or removed):
+            return []
+        # Only the first message of a keyframe resets the server's picture
+        t = round(now, 3)
+        messages = [{'t': t, 'keyframe': keyframe, 'sectors': sectors}]
+        for key, items in (('removed', removed), ('added', added), ('moved', moved)):
+            for item in items:
+                message = messages[-1]
+                message.setdefault(key, []).append(item)
+                if len(json.dumps(message, separators=(",", ":"))) > MAX_MESSAGE_BYTES:
+                    message[key].pop()
+                    if not message[key]:
+                        del message[key]
+                    messages.append({'t': t, 'keyframe': False, 'sectors': {}, key: [item]})
+        return messages
+
+    def sent(self, message):
+        # The server has (or will have) this message: later deltas build on it
+        for name, values in message['sectors'].items():
+            sector = dict(zip(SECTOR_FIELDS, values))
+            sector['level'] = LEVELS[sector['level']]
+            self._sent_sectors[name] = sector
+        for values in message.get('added', []) + message.get('moved', []):
+            self._sent_obstacles[values[0]] = dict(zip(OBSTACLE_FIELDS, values))
+        for oid in message.get('removed', []):
+            self._sent_obstacles.pop(oid, None)
+        if message['keyframe']:
+            self._last_keyframe = message['t']
+
+    def alert_level(self):
+        # Worst sector level right now: 'clear' / 'warn' / 'danger'
+        worst = max((LEVELS.index(s['level']) for s in self.sectors.values()), default=0)
+        return LEVELS[worst]
@@ -0,0 +1,227 @@
+import time
+import numpy as np
+
+import telemetry
+import sample_bus
+import metrics
+import hal
+
+# --- Configuration ---
+# Sweep engine for the servo-mounted VL53L0X. The sensor ranges back-to-back
+# in continuous mode; every time a measurement completes, the servo is sent
+# to the next angle, so the move overlaps the next measurement instead of
+# being waited out. Each reading is tagged with where a servo model says the
+# sensor was pointing at the middle of its measurement window. A whole sweep
+# is published as one frame.
+SWEEP_URL = "http://localhost:5000/api/radar/sweep"
+TIMING_BUDGET_US = 20000    # Per measurement: 20 ms (fast, ~1.2 m reliable) .. 200 ms (accurate, ~2 m)
+MIN_ANGLE = 0
+MAX_ANGLE = 180
+# The VL53L0X cone is ~25° wide, so steps much finer than ~10° re-measure the
+# same spot. 9° at 20 ms gives 21 points per sweep, ~2.4 sweeps/s.
+STEP_DEG = 9
+MAX_RANGE_MM = 2000         # Readings beyond this (8190 = no target) are reported as 0
+
+# Servo model (SG90-class at 5 V), see calibrate_lag() to fit DEAD_TIME from data
+SLEW_DEG_PER_S = 500.0      # Speed once moving (datasheet 0.1 s / 60° minus load)
+DEAD_TIME = 0.008           # Command -> motion start (PWM period + controller)
+
+
+class ServoModel:
+    # Where the horn actually is, given the commands sent so far
+    def __init__(self, slew=SLEW_DEG_PER_S, dead_time=DEAD_TIME, angle=0.0, t=0.0):
+        self.slew = slew
+        self.dead_time = dead_time
+        self.start_angle = angle        # Position when the last command took effect
+        self.target = angle
+        self.move_start = t
+
+    def command(self, angle, t):
+        pos = self.position(t)
+        # Dead time only applies from rest; a horn that is still moving just
+        # heads for the new target
+        moving = t > self.move_start and pos != self.target
+        self.start_angle = pos
+        self.target = float(angle)
+        self.move_start = t if moving else t + self.dead_time
+
+    def position(self, t):
+        if t <= self.move_start:
+            return self.start_angle
+        travel = self.slew * (t - self.move_start)
+        delta = self.target - self.start_angle
+        if travel >= abs(delta):
+            return self.target
+        return self.start_angle + (travel if delta > 0 else -travel)
+
+    def settle_time(self, angle, t):
+        # Seconds until the horn reaches `angle` if commanded at t
+        return self.dead_time + abs(angle - self.position(t)) / self.slew
+
+
+class SweepFrame:
+    # One sweep: preallocated columns, filled in place
+    def __init__(self, size):
+        self.angles = np.zeros(size, dtype=np.float32)      # Modeled angle at mid-measurement
+        self.distances = np.zeros(size, dtype=np.uint16)    # mm, 0 = no target
+        self.times = np.zeros(size, dtype=np.float64)       # Unix time of each reading
+        self.n = 0
+        self.direction = 1
+
+    def add(self, angle, distance_mm, t):
+        i = self.n
+        self.angles[i] = angle
+        self.distances[i] = distance_mm
+        self.times[i] = t
+        self.n += 1
+
+    def to_payload(self):
+        # Compact arrays: angles in 0.1°, time offsets in ms from t0
+        n = self.n
+        t0 = float(self.times[0])
+        return {
+            't0': round(t0, 3),
+            'direction': self.direction,
+            'angles': np.round(self.angles[:n] * 10).astype(int).tolist(),
+            'distances': self.distances[:n].astype(int).tolist(),
+            'dt': np.round((self.times[:n] - t0) * 1000).astype(int).tolist(),
+        }
+
+    def to_record(self):
+        # Fields of a sample_bus "radar_sweep" record
+        n = min(self.n, sample_bus.SWEEP_POINTS)
+        t0 = float(self.times[0]) if n else time.time()
+        return {
+            't': t0,
+            'direction': self.direction,
+            'n': n,
+            'angle': self.angles[:n],
+            'distance_mm': self.distances[:n],
+            'dt_ms': np.round((self.times[:n] - t0) * 1000).astype(np.uint16),
+        }
+
+
+def frame_from_record(rec):
+    n = int(rec["n"])
+    frame = SweepFrame(n)
+    frame.n = n
+    frame.direction = int(rec["direction"])
+    frame.angles[:] = rec["angle"][:n]
+    frame.distances[:] = rec["distance_mm"][:n]
+    frame.times[:] = float(rec["t"]) + rec["dt_ms"][:n] / 1000.0
+    return frame
+
+
+class SweepEngine:
+    def __init__(self, sensor, servo, timing_budget_us=TIMING_BUDGET_US, min_angle=MIN_ANGLE,
+                 max_angle=MAX_ANGLE, step=STEP_DEG, model=None):
+        self.sensor = sensor
+        self.servo = servo
+        self.budget = timing_budget_us / 1e6
+        self.forward = np.arange(min_angle, max_angle + 1, step, dtype=np.float64)
+        if self.forward[-1] != max_angle:
+            self.forward = np.append(self.forward, max_angle)
+        self.model = model or ServoModel(angle=min_angle, t=hal.monotonic())
+        self.sweeps = 0
+        self.errors = 0
+        self._last_ready = 0.0
+
+    def sweep_rate(self):
+        # Average angular speed while sweeping (deg/s)
+        step = (self.forward[-1] - self.forward[0]) / max(len(self.forward) - 1, 1)
+        return step / self.budget
+
+    def start(self):
+        self.sensor.measurement_timing_budget = int(self.budget * 1e6)
+        # Park at the start and wait (model-predicted) before the first sweep
+        self._command(self.forward[0])
+        hal.sleep(self.model.settle_time(self.forward[0], hal.monotonic()) + 0.3)
+        self.sensor.start_continuous()
+        self._last_ready = hal.monotonic()
+
+    def stop(self):
+        try:
+            self.sensor.stop_continuous()
+        except Exception:
+            pass
+
+    def _command(self, angle):
+        if self.servo is not None:
+            self.servo.angle = float(angle)
+        self.model.command(angle, hal.monotonic())
+
+    def sweep(self, direction=1):
+        # One pass over the angle range; returns a filled SweepFrame
+        angles = self.forward if direction > 0 else self.forward[::-1]
+        frame = SweepFrame(len(angles))
+        frame.direction = direction
+        # Offset between the monotonic clock (servo model) and unix time (frames)
+        wall_offset = time.time() - hal.monotonic()
+
+        if abs(self.model.target - angles[0]) > 0.5:
+            # Not already there (e.g. after start()): move, and drop the
+            # measurement that was in flight during the move
+            self._command(angles[0])
+            self._read()
+        for k in range(len(angles)):
+            # Ranging for angles[k] is in flight now; queue the move to k+1 as
+            # soon as it completes so the servo travels during the next one
+            distance = self._read()
+            t_end = hal.monotonic()
+            if k + 1 < len(angles):
+                self._command(angles[k + 1])
+            if distance is None:
+                continue
+            mid = t_end - self.budget / 2
+            frame.add(self.model.position(mid), distance, mid + wall_offset)
+        self.sweeps += 1
+        return frame
+
+    def _read(self):
+        # Sleep through most of the measurement instead of polling the
+        # sensor's status register over I2C the whole time
+        wait = self._last_ready + self.budget * 0.9 - hal.monotonic()
+        hal.sleep(wait)
+        try:
+            mm = self.sensor.range
+        except Exception:
+            self.errors += 1
+            metrics.dropped("radar.range_read")
+            return None
+        finally:
+            self._last_ready = hal.monotonic()
+        return mm if 0 < mm <= MAX_RANGE_MM else 0
+
+
+def calibrate_lag(frames_fwd, frames_bwd, sweep_rate=STEP_DEG / (TIMING_BUDGET_US / 1e6), max_shift_deg=20.0):
+    # Fits the servo model's timing from real sweeps: an edge appears at a
+    # later angle going forward than going backward when the model is too
+    # optimistic. Returns the extra lag (s) to add to DEAD_TIME; resolution is
+    # roughly +/-10 ms at the default step and timing budget.
+    grid = np.arange(MIN_ANGLE, MAX_ANGLE + 0.5, 0.5)
+
+    def profile(frames):
+        rows = []
+        for f in frames:
+            order = np.argsort(f.angles[:f.n])
+            rows.append(np.interp(grid, f.angles[:f.n][order], f.distances[:f.n][order].astype(np.float64)))
+        return np.median(rows, axis=0)
+
+    fwd, bwd = profile(frames_fwd), profile(frames_bwd)
+    fwd, bwd = fwd - fwd.mean(), bwd - bwd.mean()
+    best_shift, best_score = 0, -np.inf
+    max_k = int(max_shift_deg / 0.5)
+    for k in range(-max_k, max_k + 1):
+        a = fwd[max(0, k):len(fwd) + min(0, k)]
+        b = bwd[max(0, -k):len(bwd) + min(0, -k)]
+        score = float(np.dot(a, b)) / max(len(a), 1)
+        if score > best_score:
+            best_shift, best_score = k, score
+    # Forward profile shifted by +2*lag*rate relative to backward
+    lag_deg = best_shift * 0.5 / 2.0
+    return lag_deg / sweep_rate
+
+
+def publish(frame, url=SWEEP_URL):
+    if frame.n:
+        telemetry.post(url, frame.to_payload())
@@ -1,29 +1,44 @@
+import sys
 import time
-import requests
-import board
-import busio
-import adafruit_vl53l0x
-from gpiozero import AngularServo
-from RPi import GPIO
+import telemetry
+import radar_sweep
+import radar_grid
+import sample_bus
+import metrics
+import service_loop
+import hal
 
 # --- Configuration ---
 SERVER_URL = "http://localhost:5000/api/radar"
 SERVO_PIN = 6       # GPIO 6 (Pin 31)
+# Sweep mode: continuous ranging with overlapped servo moves, one frame per
+# sweep to /api/radar/sweep (see radar_sweep.py). False = old step-and-post loop.
+SWEEP_MODE = True
+# Sweeps feed a polar occupancy grid (radar_grid.py) that sends only changed
+# sectors / obstacles to /api/radar/grid. Raw sweep frames are optional.
+PUBLISH_RAW_SWEEPS = False
 
-# Setup I2C for VL53L0X
-i2c = busio.I2C(board.SCL, board.SDA)
-sensor = adafruit_vl53l0x.VL53L0X(i2c)
+# Devices, opened by open_devices() when a loop starts (see hal.py)
+sensor = None
+servo = None
 
-# Setup Servo
-# Note: gpiozero uses BCM numbering by default
-try:
-    servo = AngularServo(SERVO_PIN, min_angle=0, max_angle=180, min_pulse_width=0.0005, max_pulse_width=0.0025)
-    print("✅ Servo Connected on GPIO 6")
-except Exception as e:
-    print(f"❌ Servo Error: {e}")
-    servo = None
+def open_devices():
+    global sensor, servo
+    if sensor is not None:
+        return
+    # VL53L0X on the default I2C pins
+    sensor = hal.range_sensor()
 
-print(f"✅ VL53L0X LiDAR Radar Started")
+    # Setup Servo
+    # Note: gpiozero uses BCM numbering by default
+    try:
+        servo = hal.servo(SERVO_PIN, min_angle=0, max_angle=180, min_pulse_width=0.0005, max_pulse_width=0.0025)
+        print("✅ Servo Connected on GPIO 6")
+    except Exception as e:
+        print(f"❌ Servo Error: {e}")
+        servo = None
+
+    print(f"✅ VL53L0X LiDAR Radar Started")
 
 def get_distance():
     try:
@@ -31,22 +46,85 @@ def get_distance():
         distance_mm = sensor.range
         return distance_mm / 10.0 # Convert to cm
     except Exception as e:
+        metrics.dropped("radar.get_distance")
         print(f"LiDAR Read Error: {e}")
         return 0
 
-def scan():
-    print("Starting Radar Scan...")
+def sweep_loop():
+    open_devices()
+    print("Starting Radar Sweep Engine...")
+    engine = radar_sweep.SweepEngine(sensor, servo)
+    grid = radar_grid.PolarGrid()
+    engine.start()
+    direction = 1
+    level = "clear"
+    sweep_time = metrics.histogram("stage_seconds", stage="radar_sweep")
+    grid_time = metrics.histogram("stage_seconds", stage="radar_grid")
+    last_stats = time.monotonic()
     try:
         while True:
-            # Sweep 0 to 180 (LiDAR is fast, can step 1 or 2 degrees)
-            for angle in range(0, 181, 2): 
-                process_step(angle)
-            
-            # Sweep 180 to 0
-            for angle in range(180, -1, -2):
-                process_step(angle)
-    except KeyboardInterrupt:
-        print("Stopping...")
+            t0 = metrics.now()
+            frame = engine.sweep(direction)
+            sweep_time.record_since(t0)
+            direction = -direction
+            # Local subscribers get every sweep; bus_uploader.py posts them
+            # when PUBLISH_RAW_SWEEPS is set
+            sample_bus.publish("radar_sweep", **frame.to_record())
+
+            t0 = metrics.now()
+            grid.update(frame)
+            messages = grid.changes(time.time())
+            grid_time.record_since(t0)
+            for message in messages:
+                # Not spooled: the next sweep's delta includes it again
+                if not telemetry.post(radar_grid.GRID_URL, message):
+                    break
+                grid.sent(message)
+            if grid.alert_level() != level:
+                level = grid.alert_level()
+                if level == "danger":
+                    print(f"🚧 Obstacle close: {[n for n, s in grid.sectors.items() if s['level'] == 'danger']}")
+
+            now = time.monotonic()
+            if now - last_stats >= 10.0:
+                print(f"📡 {engine.sweeps / (now - last_stats):.1f} sweeps/s | {frame.n} points | {engine.errors} read errors")
+                engine.sweeps = 0
+                last_stats = now
+            # The sweep paces itself on the sensor's timing budget
+            yield 0
+    finally:
+        engine.stop()
+
+def calibrate(sweeps=10):
+    # Point the radar at a scene with some edges (doorway, furniture) and
+    # keep it still; prints the servo dead time to put in radar_sweep.py
+    open_devices()
+    engine = radar_sweep.SweepEngine(sensor, servo)
+    engine.start()
+    forward, backward = [], []
+    try:
+        for _ in range(sweeps):
+            forward.append(engine.sweep(1))
+            backward.append(engine.sweep(-1))
+    finally:
+        engine.stop()
+    lag = radar_sweep.calibrate_lag(forward, backward, sweep_rate=engine.sweep_rate())
+    print(f"🔧 Servo lag vs. model: {lag * 1000:+.0f} ms -> DEAD_TIME = {max(0.0, radar_sweep.DEAD_TIME + lag):.3f}")
+
+def scan_loop():
+    if SWEEP_MODE:
+        yield from sweep_loop()
+        return
+    open_devices()
+    print("Starting Radar Scan...")
+    while True:
+        # Sweep 0 to 180 (LiDAR is fast, can step 1 or 2 degrees)
+        for angle in range(0, 181, 2): 
+            yield from process_step(angle)
+        
+        # Sweep 180 to 0
+        for angle in range(180, -1, -2):
+            yield from process_step(angle)
 
 def process_step(angle):
     # 1. Move Servo
@@ -54,17 +132,17 @@ def process_step(angle):
         servo.angle = angle
     
     # Wait for servo to settle (LiDAR is fast so we can reduce wait)
-    time.sleep(0.02) 
+    yield 0.02
     
     # 2. Read Distance
     dist = get_distance()
 
-    # 3. Send to Server
-    try:
-        data = {'angle': angle, 'distance': int(dist)}
-        requests.post(SERVER_URL, json=data, timeout=0.05)
-    except:
-        pass
+    # 3. Send to Server (batched by the telemetry sender thread)
+    data = {'angle': angle, 'distance': int(dist)}
+    telemetry.post(SERVER_URL, data)
 
 if __name__ == "__main__":
-    scan()
+    if "--calibrate" in sys.argv:
+        calibrate()
+    else:
+        service_loop.run_blocking(scan_loop())
@@ -0,0 +1,434 @@
+import os
+import sys
+import glob
+import mmap
+import time
+import fcntl
+import select
+import socket
+import struct
+import argparse
+import itertools
+import threading
+import numpy as np
+
+import metrics
+
+# --- Configuration ---
+# On-car message bus between the Python modules. Each topic is a ring of
+# fixed-size typed records in shared memory (/dev/shm/isarthi_bus_<topic>):
+# one publisher writes, any number of local subscribers read at their own
+# pace, with no JSON, TCP or server in between. A subscriber that falls a
+# whole ring behind skips ahead and counts what it lost; the publisher never
+# waits for anyone.
+#
+#   pub = sample_bus.publisher("gps_fix")
+#   pub.publish(t=time.time(), lat=lat, lon=lon, speed=speed, ...)
+#
+#   sub = sample_bus.subscribe("gps_fix")
+#   for rec in sub.wait(1.0):
+#       print(rec["lat"], rec["lon"])
+#
+# Subscribers are woken by a 1-byte datagram on their own Unix socket next to
+# the ring, so wait() returns tens of microseconds after publish() instead of
+# on the next poll. `python3 sample_bus.py` tails the topics.
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+BUS_DIR = os.environ.get("ISARTHI_BUS_DIR", SHM_DIR)
+RING_PREFIX = "isarthi_bus_"
+MAGIC = 0x49534231          # "ISB1"
+RESCAN_INTERVAL = 1.0       # Publishers look for new subscriber sockets this often
+
+IMU_BATCH = 64              # Samples per IMU record (a 20 ms drain at 1 kHz is ~20)
+SWEEP_POINTS = 64           # Readings per radar sweep record (0-180° in 9° steps is 21)
+
+# topic: (record layout, ring capacity in records)
+TOPICS = {
+    # Raw accelerometer samples of one MPU6050 FIFO drain (LSB; divide by lsb_per_g)
+    "imu": (np.dtype([
+        ("t", "<f8"),               # Unix time of the last sample
+        ("sensor", "u1"),           # 0 = left, 1 = right
+        ("n", "<u2"),
+        ("rate_hz", "<f4"),
+        ("lsb_per_g", "<f4"),
+        ("accel", "<i2", (IMU_BATCH, 3)),
+    ]), 512),
+    # One servo sweep (radar_sweep.SweepFrame)
+    "radar_sweep": (np.dtype([
+        ("t", "<f8"),               # Unix time of the first reading
+        ("direction", "i1"),
+        ("n", "<u2"),
+        ("angle", "<f4", (SWEEP_POINTS,)),
+        ("distance_mm", "<u2", (SWEEP_POINTS,)),
+        ("dt_ms", "<u2", (SWEEP_POINTS,)),
+    ]), 128),
+    # Every valid GPS fix (gps_tracker)
+    "gps_fix": (np.dtype([
+        ("t", "<f8"),
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+        ("speed", "<f4"),           # km/h
+        ("heading", "<f4"),         # degrees, NaN when unknown
+        ("hdop", "<f4"),
+        ("satellites", "<i2"),
+    ]), 256),
+    # Driver state after every processed camera frame (drowsiness_detector)
+    "drowsiness": (np.dtype([
+        ("t", "<f8"),               # Capture time of the frame
+        ("drowsy", "u1"),
+        ("events", "<u4"),
+        ("faces", "u1"),
+        ("eyes", "u1"),
+        ("closed_s", "<f4"),        # How long the eyes have been closed
+    ]), 256),
+    # Every alcohol report (alcohol_monitor): state changes, heartbeats, windows
+    "alcohol": (np.dtype([
+        ("t", "<f8"),
+        ("state", "u1"),            # 0 = warming_up, 1 = clear, 2 = detected
+        ("value", "<f4"),           # %
+    ]), 64),
+    # Detected events other modules act on (vibration_monitor: pothole / crash)
+    "events": (np.dtype([
+        ("t", "<f8"),
+        ("kind", "S16"),
+        ("peak_g", "<f4"),
+    ]), 64),
+}
+# Manual black-box freezes (`blackbox.py freeze`). A topic of its own:
+# vibration_monitor is the one writer of "events", and a ring has one writer.
+TOPICS["freeze"] = (TOPICS["events"][0], 16)
+ALCOHOL_STATES = ("warming_up", "clear", "detected")
+
+# magic, record size, capacity, head (records ever published)
+HEADER = struct.Struct("<IIIxxxxQ")
+HEADER_SIZE = 64
+SEQ = struct.Struct("<Q")
+
+
+def ring_path(topic):
+    return os.path.join(BUS_DIR, RING_PREFIX + topic)
+
+
+class Ring:
+    # Shared-memory layout: 64-byte header, then `capacity` slots of
+    # [seq u64][record]. Record number k lives in slot k % capacity; its seq
+    # is 2k+1 while being written and 2k+2 once complete, so readers detect
+    # torn or overwritten slots the same way gps_fix.FixSlot does.
+    def __init__(self, topic):
+        self.topic = topic
+        self.dtype, self.capacity = TOPICS[topic]
+        self.record_size = self.dtype.itemsize
+        self.slot_size = SEQ.size + self.record_size
+        self.path = ring_path(topic)
+        size = HEADER_SIZE + self.capacity * self.slot_size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            head = os.read(fd, HEADER.size)
+            if len(head) < HEADER.size or HEADER.unpack(head)[:3] != (MAGIC, self.record_size, self.capacity):
+                # New ring, or one left by a different layout: start it over
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, HEADER.pack(MAGIC, self.record_size, self.capacity, 0), 0)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def head(self):
+        return struct.unpack_from("<Q", self.mm, 16)[0]
+
+    def offset(self, k):
+        return HEADER_SIZE + (k % self.capacity) * self.slot_size
+
+
+class Publisher:
+    def __init__(self, topic):
+        self.ring = Ring(topic)
+        self.record = np.zeros(1, dtype=self.ring.dtype)
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.subscribers = []
+        self.next_scan = 0.0
+        self.published = 0
+
+    def _scan(self):
+        self.subscribers = glob.glob(f"{self.ring.path}.*.sock")
+        self.next_scan = time.monotonic() + RESCAN_INTERVAL
+
+    def publish(self, **fields):
+        # Fields not given are zero; array fields may be shorter than their slot
+        with self.lock:
+            record = self.record
+            record.fill(0)
+            for name, value in fields.items():
+                if isinstance(value, np.ndarray) and value.shape != record.dtype[name].shape:
+                    record[name][0, :len(value)] = value
+                else:
+                    record[name][0] = value
+            self.write(record.tobytes())
+
+    def write(self, data):
+        # A record already in the topic's layout (bytes)
+        ring = self.ring
+        k = ring.head()
+        off = ring.offset(k)
+        SEQ.pack_into(ring.mm, off, 2 * k + 1)
+        ring.mm[off + SEQ.size:off + ring.slot_size] = data
+        SEQ.pack_into(ring.mm, off, 2 * k + 2)
+        struct.pack_into("<Q", ring.mm, 16, k + 1)
+        self.published += 1
+        self._notify()
+
+    def _notify(self):
+        if time.monotonic() >= self.next_scan:
+            self._scan()
+        for path in list(self.subscribers):
+            try:
+                self.sock.sendto(b"\0", path)
+            except BlockingIOError:
+                pass    # Its wakeup queue is full: it has plenty to read already
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Subscriber gone without cleaning up
+                self.subscribers.remove(path)
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+_subscriber_ids = itertools.count()
+
+
+class Subscriber:
+    # Reads records published after it was created (or the whole ring with
+    # from_start=True). Records come back as numpy structured records
+    # (rec["lat"], rec["accel"][:rec["n"]]), copied out of the ring.
+    def __init__(self, topic, from_start=False):
+        self.ring = Ring(topic)
+        self.dtype = self.ring.dtype
+        head = self.ring.head()
+        self.cursor = max(0, head - self.ring.capacity) if from_start else head
+        self.lost = 0
+        self.path = f"{self.ring.path}.{os.getpid()}-{next(_subscriber_ids)}.sock"
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def poll(self, limit=None):
+        # Everything published since the last call, oldest first
+        ring = self.ring
+        lost = self.lost
+        head = ring.head()
+        if head - self.cursor > ring.capacity:
+            self.lost += head - ring.capacity - self.cursor
+            self.cursor = head - ring.capacity
+        if limit is not None:
+            head = min(head, self.cursor + limit)
+        out = []
+        while self.cursor < head:
+            k = self.cursor
+            off = ring.offset(k)
+            seq = SEQ.unpack_from(ring.mm, off)[0]
+            data = ring.mm[off + SEQ.size:off + ring.slot_size]
+            if seq != 2 * k + 2 or SEQ.unpack_from(ring.mm, off)[0] != seq:
+                # Overwritten while we were behind: jump to what is still there
+                self.lost += 1
+                self.cursor += 1
+                continue
+            out.append(np.frombuffer(data, dtype=self.dtype)[0])
+            self.cursor += 1
+        if self.lost != lost:
+            metrics.dropped(f"bus.{ring.topic}", self.lost - lost)
+        return out
+
+    def _drain_wakeups(self):
+        try:
+            while self.sock.recv(64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout):
+        # Blocks until something is published (or the timeout), then poll()
+        records = self.poll()
+        if records:
+            return records
+        select.select([self.sock], [], [], timeout)
+        self._drain_wakeups()
+        return self.poll()
+
+    def latest(self):
+        # The newest record in the ring (or None), without moving the cursor
+        head = self.ring.head()
+        if head == 0:
+            return None
+        off = self.ring.offset(head - 1)
+        data = self.ring.mm[off + SEQ.size:off + self.ring.slot_size]
+        if SEQ.unpack_from(self.ring.mm, off)[0] != 2 * head:
+            return None
+        return np.frombuffer(data, dtype=self.dtype)[0]
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def wait_any(subscribers, timeout):
+    # For consumers of several topics: {topic: [records]} of those with news
+    if not any(sub.ring.head() > sub.cursor for sub in subscribers):
+        select.select(subscribers, [], [], timeout)
+    out = {}
+    for sub in subscribers:
+        sub._drain_wakeups()
+        records = sub.poll()
+        if records:
+            out[sub.ring.topic] = records
+    return out
+
+
+# --- One publisher per topic per process ---
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def publisher(topic):
+    pub = _publishers.get(topic)
+    if pub is None:
+        with _publishers_lock:
+            pub = _publishers.get(topic)
+            if pub is None:
+                pub = _publishers[topic] = Publisher(topic)
+    return pub
+
+
+def publish(topic, **fields):
+    # Never raises: a module keeps running if /dev/shm is unavailable
+    try:
+        publisher(topic).publish(**fields)
+        return True
+    except OSError:
+        metrics.dropped(f"bus.publish.{topic}")
+        return False
+
+
+def subscribe(topic, from_start=False):
+    return Subscriber(topic, from_start)
+
+
+def as_dict(rec):
+    # Plain Python values (arrays cut to the record's n when it has one)
+    n = int(rec["n"]) if "n" in rec.dtype.names else None
+    out = {}
+    for name in rec.dtype.names:
+        value = rec[name]
+        if isinstance(value, np.ndarray):
+            out[name] = value[:n].tolist() if n is not None else value.tolist()
+        else:
+            out[name] = value.item()
+    return out
+
+
+# --- Command line: tail topics / measure latency ---
+def tail(topics):
+    subs = [subscribe(t) for t in topics]
+    counts = {t: 0 for t in topics}
+    last = time.monotonic()
+    print(f"👂 Listening on {', '.join(topics)} (Ctrl+C to stop)")
+    try:
+        while True:
+            for topic, records in wait_any(subs, 1.0).items():
+                counts[topic] += len(records)
+                age_ms = (time.time() - float(records[-1]["t"])) * 1000
+                if topic in ("gps_fix", "drowsiness"):
+                    print(f"{topic}: {as_dict(records[-1])} ({age_ms:.1f} ms old)")
+            now = time.monotonic()
+            if now - last >= 5.0:
+                print("📊 " + " | ".join(f"{t}: {counts[t] / (now - last):.1f}/s lost {s.lost}"
+                                         for t, s in zip(topics, subs)))
+                counts = {t: 0 for t in topics}
+                last = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for s in subs:
+            s.close()
+
+
+def bench(n):
+    # Publish -> wake -> read round trips through a real ring and socket, in
+    # a private bus directory: the car's gps_fix ring is never touched
+    global BUS_DIR
+    import shutil
+    import tempfile
+    BUS_DIR = tempfile.mkdtemp(prefix="isarthi_bus_bench_", dir=SHM_DIR)
+    os.environ["ISARTHI_BUS_DIR"] = BUS_DIR
+    try:
+        _bench(n)
+    finally:
+        _publishers.clear()
+        shutil.rmtree(BUS_DIR, ignore_errors=True)
+
+
+def _bench_consume(n, ready, result):
+    # Module level so it also pickles under spawn / forkserver; the child
+    # finds the private bus through ISARTHI_BUS_DIR
+    sub = subscribe("gps_fix")
+    ready.set()
+    lat = []
+    while len(lat) < n:
+        for rec in sub.wait(1.0):
+            lat.append(time.perf_counter() - float(rec["t"]))
+    sub.close()
+    result.put(lat)
+
+
+def _bench(n):
+    import multiprocessing
+    ready = multiprocessing.Event()
+    result = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_bench_consume, args=(n, ready, result))
+    proc.start()
+    ready.wait()
+    time.sleep(1.2)             # Let the publisher find the subscriber socket
+    pub = publisher("gps_fix")
+    spent = 0.0
+    for _ in range(n):
+        t0 = time.perf_counter()
+        pub.publish(t=t0)      # perf_counter is system-wide on Linux
+        spent += time.perf_counter() - t0
+        time.sleep(0.001)
+    publish_us = spent / n * 1e6
+    lat = sorted(result.get())
+    proc.join()
+    print(f"⏱️ {n} records: publish ~{publish_us:.1f} µs, "
+          f"delivery p50 {lat[len(lat) // 2] * 1e6:.0f} µs, p99 {lat[int(len(lat) * 0.99)] * 1e6:.0f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tail the on-car sample bus")
+    parser.add_argument("topics", nargs="*", help=f"Topics to tail (default: all of {', '.join(sorted(TOPICS))})")
+    parser.add_argument("--bench", type=int, metavar="N", help="Measure publish -> subscriber latency")
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.bench)
+        return 0
+    unknown = [t for t in args.topics if t not in TOPICS]
+    if unknown:
+        parser.error(f"unknown topic(s): {', '.join(unknown)}")
+    tail(args.topics or sorted(TOPICS))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
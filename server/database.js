@@ -91,6 +91,23 @@ let db = new sqlite3.Database(DBSOURCE, (err) => {
         )`, (err) => {
             if (!err) console.log('Sensor Logs table created.');
         });
+
+        // GPS Tracks Table (compressed trace segments from trajectory.py, one row per segment)
+        db.run(`CREATE TABLE gps_tracks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_ts REAL, -- Unix seconds of the first / last point
+            end_ts REAL,
+            points INTEGER,
+            raw_points INTEGER, -- Fixes the segment replaces
+            encoding TEXT,
+            data BLOB,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )`, (err) => {
+            if (!err) {
+                console.log('GPS Tracks table created.');
+                db.run(`CREATE INDEX gps_tracks_start ON gps_tracks (start_ts)`);
+            }
+        });
     }
 });
 
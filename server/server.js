@@ -139,6 +139,25 @@ app.get('/api/road-data', (req, res) => {
     });
 });
 
+// --- Reading Times ---
+// Handlers take the reading's own time (ms): records replayed from a car's
+// spool through /api/ingest carry when they were measured, not when they
+// arrived. Log rows are stamped with it, and the latest-state objects below
+// never go back to a reading older than the one they hold.
+function readingTime(ts) {
+    const t = parseFloat(ts);
+    return Number.isFinite(t) && t > 0 ? t * 1000 : Date.now();
+}
+
+// SQLite CURRENT_TIMESTAMP format (UTC)
+function sqlTime(ms) {
+    return new Date(ms).toISOString().slice(0, 19).replace('T', ' ');
+}
+
+function isNewer(ms, latest) {
+    return !latest || !(latest.timestamp > ms);
+}
+
 // --- Drowsiness Detection API ---
 let latestDrowsinessStatus = {
     isDrowsy: false,
@@ -146,16 +165,18 @@ let latestDrowsinessStatus = {
     timestamp: Date.now()
 };
 
-app.post('/api/drowsiness', (req, res) => {
-    const { isDrowsy, events } = req.body;
-    latestDrowsinessStatus = {
-        isDrowsy,
-        events,
-        timestamp: Date.now()
-    };
+function handleDrowsiness(body, now = Date.now()) {
+    const { isDrowsy, events } = body;
+    if (isNewer(now, latestDrowsinessStatus)) {
+        latestDrowsinessStatus = {
+            isDrowsy,
+            events,
+            timestamp: now
+        };
+    }
 
     // Log to Database
-    db.run(`INSERT INTO drowsiness_logs (is_drowsy, events_count) VALUES (?, ?)`, [isDrowsy, events], (err) => {
+    db.run(`INSERT INTO drowsiness_logs (is_drowsy, events_count, timestamp) VALUES (?, ?, ?)`, [isDrowsy, events, sqlTime(now)], (err) => {
         if (err) console.error("Drowsiness Log Error:", err.message);
     });
 
@@ -163,6 +184,10 @@ app.post('/api/drowsiness', (req, res) => {
     if (isDrowsy) {
         console.log("⚠️ DROWSINESS ALERT RECEIVED!");
     }
+}
+
+app.post('/api/drowsiness', (req, res) => {
+    handleDrowsiness(req.body);
     res.json({ success: true });
 });
 
@@ -185,23 +210,28 @@ let radarData = {
     timestamp: Date.now()
 };
 
-app.post('/api/radar', (req, res) => {
-    const { angle, distance } = req.body;
-    radarData = {
+function handleRadar(body, now = Date.now()) {
+    const { angle, distance } = body;
+    const reading = {
         angle: parseInt(angle) || 0,
         distance: parseInt(distance) || 0,
-        timestamp: Date.now()
+        timestamp: now
     };
+    if (isNewer(now, radarData)) radarData = reading;
 
     // Log to Sensor Logs (Throttle? logging every ping might be too much, but user asked for "every data")
     // We will log it.
-    db.run(`INSERT INTO sensor_logs (sensor_type, value_1, value_2) VALUES (?, ?, ?)`,
-        ['Radar', radarData.angle, radarData.distance],
+    db.run(`INSERT INTO sensor_logs (sensor_type, value_1, value_2, timestamp) VALUES (?, ?, ?, ?)`,
+        ['Radar', reading.angle, reading.distance, sqlTime(now)],
         (err) => { if (err) console.error("Radar Log Error:", err.message); }
     );
 
     // Optional: Log only significant obstacles?
-    if (radarData.timestamp % 100 < 10) console.log(`📡 Radar Data: Angle ${angle}°, Dist ${distance}cm`);
+    if (reading.timestamp % 100 < 10) console.log(`📡 Radar Data: Angle ${angle}°, Dist ${distance}cm`);
+}
+
+app.post('/api/radar', (req, res) => {
+    handleRadar(req.body);
     res.json({ success: true });
 });
 
@@ -209,6 +239,108 @@ app.get('/api/radar', (req, res) => {
     res.json(radarData);
 });
 
+// Whole sweeps from radar_sweep.py:
+// { t0, direction, angles: [0.1°], distances: [mm, 0 = no target], dt: [ms from t0] }
+let radarSweep = { t0: 0, direction: 1, angles: [], distances: [], dt: [] };
+
+function handleRadarSweep(body, now = Date.now()) {
+    const { t0, direction, angles, distances, dt } = body;
+    if (!Array.isArray(angles) || !Array.isArray(distances) || angles.length !== distances.length || angles.length === 0) {
+        throw new Error('Malformed radar sweep');
+    }
+    const last = angles.length - 1;
+    if (isNewer(now, radarData)) {
+        radarSweep = { t0, direction, angles, distances, dt: Array.isArray(dt) ? dt : [], received: Date.now() };
+
+        // Keep the single-reading view (dashboard) pointing at the latest reading
+        radarData = {
+            angle: Math.round(angles[last] / 10),
+            distance: Math.round(distances[last] / 10),
+            timestamp: now
+        };
+    }
+
+    // One log row per sweep: point count, nearest obstacle (cm) and its angle
+    let nearest = -1;
+    distances.forEach((d, i) => {
+        if (d > 0 && (nearest < 0 || d < distances[nearest])) nearest = i;
+    });
+    db.run(`INSERT INTO sensor_logs (sensor_type, value_1, value_2, value_3, timestamp) VALUES (?, ?, ?, ?, ?)`,
+        ['RadarSweep', angles.length, nearest >= 0 ? distances[nearest] / 10 : 0, nearest >= 0 ? angles[nearest] / 10 : 0, sqlTime(now)],
+        (err) => { if (err) console.error("Radar Sweep Log Error:", err.message); }
+    );
+}
+
+app.post('/api/radar/sweep', (req, res) => {
+    try {
+        handleRadarSweep(req.body);
+        res.json({ success: true });
+    } catch (e) {
+        res.status(400).json({ error: e.message });
+    }
+});
+
+app.get('/api/radar/sweep', (req, res) => {
+    res.json(radarSweep);
+});
+
+// Occupancy grid deltas from radar_grid.py: only sectors / obstacles that
+// changed since the last message; keyframes carry the full state (a big one
+// continues in non-keyframe messages). On the wire, to fit the car's spool
+// slots, a sector is [distance, angle, closing, ttc, level index] and an
+// obstacle [id, from, to, angle, distance, closing].
+let radarGrid = { t: 0, sectors: {}, obstacles: {} };
+const GRID_LEVELS = ['clear', 'warn', 'danger'];
+
+function unpackSector(s) {
+    if (!Array.isArray(s)) return s;
+    const [distance, angle, closing, ttc, level] = s;
+    return { distance, angle, closing, ttc, level: GRID_LEVELS[level] || 'clear' };
+}
+
+function unpackObstacle(o) {
+    if (!Array.isArray(o)) return o;
+    const [id, from, to, angle, distance, closing] = o;
+    return { id, from, to, angle, distance, closing };
+}
+
+function handleRadarGrid(body, now = Date.now()) {
+    const { t, keyframe, sectors, added, moved, removed } = body;
+    if (keyframe) {
+        radarGrid = { t, sectors: {}, obstacles: {} };
+    }
+    radarGrid.t = t;
+    Object.entries(sectors || {}).forEach(([name, packed]) => {
+        const sector = unpackSector(packed);
+        const before = radarGrid.sectors[name];
+        radarGrid.sectors[name] = sector;
+        if (sector.level === 'danger' && (!before || before.level !== 'danger')) {
+            console.log(`🚧 Obstacle ${sector.distance}mm at ${sector.angle}° (${name})`);
+            db.run(`INSERT INTO sensor_logs (sensor_type, value_1, value_2, value_3, timestamp) VALUES (?, ?, ?, ?, ?)`,
+                ['RadarAlert', sector.distance / 10, sector.angle, sector.closing, sqlTime(now)],
+                (err) => { if (err) console.error("Radar Alert Log Error:", err.message); }
+            );
+        }
+    });
+    (added || []).concat(moved || []).map(unpackObstacle).forEach(o => { radarGrid.obstacles[o.id] = o; });
+    (removed || []).forEach(id => { delete radarGrid.obstacles[id]; });
+
+    // Single-reading view (dashboard): the nearest obstacle
+    const nearest = Object.values(radarGrid.obstacles).reduce((a, o) => (!a || o.distance < a.distance ? o : a), null);
+    if (nearest && isNewer(now, radarData)) {
+        radarData = { angle: Math.round(nearest.angle), distance: Math.round(nearest.distance / 10), timestamp: now };
+    }
+}
+
+app.post('/api/radar/grid', (req, res) => {
+    handleRadarGrid(req.body);
+    res.json({ success: true });
+});
+
+app.get('/api/radar/grid', (req, res) => {
+    res.json(radarGrid);
+});
+
 // --- Vibration Monitor API (Dual MPU) ---
 let vibrationData = {
     left: 0,
@@ -216,26 +348,54 @@ let vibrationData = {
     timestamp: Date.now()
 };
 
-app.post('/api/vibration', (req, res) => {
-    const { left, right } = req.body;
-    vibrationData = {
+function handleVibration(body, now = Date.now()) {
+    const { left, right } = body;
+    const reading = {
         left: parseFloat(left) || 0,
         right: parseFloat(right) || 0,
-        timestamp: Date.now()
+        timestamp: now
     };
+    if (isNewer(now, vibrationData)) vibrationData = reading;
 
     // Log to Sensor Logs
     // Only log if vibration is significant to save space? User said "every data". 
     // But continuous vibration checking is 100Hz. That will kill the DB.
     // I will log if values are non-zero/significant or throttle. 
     // Let's log if left > 0.1 or right > 0.1 to avoid noise.
-    if (vibrationData.left > 0.1 || vibrationData.right > 0.1) {
-        db.run(`INSERT INTO sensor_logs (sensor_type, value_1, value_2) VALUES (?, ?, ?)`,
-            ['Vibration', vibrationData.left, vibrationData.right],
+    if (reading.left > 0.1 || reading.right > 0.1) {
+        db.run(`INSERT INTO sensor_logs (sensor_type, value_1, value_2, timestamp) VALUES (?, ?, ?, ?)`,
+            ['Vibration', reading.left, reading.right, sqlTime(now)],
             (err) => { if (err) console.error("Vibration Log Error:", err.message); }
         );
     }
 
+    // Windowed features from the high-rate monitor (vibration_features.py)
+    const { event, rms, peak } = body;
+    if (event) {
+        reading.event = event;
+        reading.rms = rms;
+        reading.peak = peak;
+    }
+    // Events tagged by the car's hazard store carry their own fix and a hit
+    // count; repeat passes over a known hazard (hits > 1) are not new events.
+    const { latitude, longitude, hits, confidence } = body;
+    if ((event === 'pothole' || event === 'crash') && !(hits > 1)) {
+        const peakG = Array.isArray(peak) ? Math.max(...peak) : 0;
+        const tagged = latitude !== undefined && longitude !== undefined;
+        db.run(`INSERT INTO road_events (type, confidence, vibration, latitude, longitude, created_at) VALUES (?, ?, ?, ?, ?, ?)`,
+            [event === 'crash' ? 'Crash' : 'Pothole',
+             confidence !== undefined ? Math.round(confidence * 100) : 80,
+             peakG,
+             tagged ? latitude : locationData.latitude,
+             tagged ? longitude : locationData.longitude,
+             sqlTime(now)],
+            (err) => { if (err) console.error("Vibration Event Log Error:", err.message); }
+        );
+    }
+}
+
+app.post('/api/vibration', (req, res) => {
+    handleVibration(req.body);
     res.json({ success: true });
 });
 
@@ -250,25 +410,36 @@ let alcoholData = {
     timestamp: Date.now()
 };
 
-app.post('/api/alcohol', (req, res) => {
-    const { value } = req.body;
+function handleAlcohol(body, now = Date.now()) {
+    // The monitor only reports state changes (plus analog level moves), and a
+    // heartbeat every minute that refreshes the dashboard without a log row
+    const { value, state, heartbeat, window } = body;
     const val = parseFloat(value) || 0;
 
     let level = 'Normal';
     if (val > 30) level = 'Moderate';
     if (val > 70) level = 'High';
 
-    alcoholData = {
-        value: val,
-        level,
-        timestamp: Date.now()
-    };
+    if (isNewer(now, alcoholData)) {
+        alcoholData = {
+            value: val,
+            level,
+            state: state || null,
+            window: window || null,
+            timestamp: now
+        };
+    }
+
+    if (heartbeat) return;
 
     // Log to Sensor Logs
-    db.run(`INSERT INTO sensor_logs (sensor_type, value_1) VALUES (?, ?)`, ['Alcohol', val], (err) => {
+    db.run(`INSERT INTO sensor_logs (sensor_type, value_1, timestamp) VALUES (?, ?, ?)`, ['Alcohol', val, sqlTime(now)], (err) => {
         if (err) console.error("Alcohol Log Error:", err.message);
     });
+}
 
+app.post('/api/alcohol', (req, res) => {
+    handleAlcohol(req.body);
     res.json({ success: true });
 });
 
@@ -280,23 +451,33 @@ let locationData = {
     timestamp: Date.now()
 };
 
-app.post('/api/location', (req, res) => {
-    const { latitude, longitude, speed } = req.body;
-    locationData = {
+function handleLocation(body, now = Date.now()) {
+    const { latitude, longitude, speed, heading, hdop, satellites } = body;
+    const reading = {
         latitude: parseFloat(latitude) || 0.0,
         longitude: parseFloat(longitude) || 0.0,
         speed: parseFloat(speed) || 0.0,
-        timestamp: Date.now()
+        heading: heading !== undefined ? heading : null,
+        hdop: hdop !== undefined ? hdop : null,
+        satellites: satellites !== undefined ? satellites : null,
+        timestamp: now
     };
+    if (isNewer(now, locationData)) locationData = reading;
 
-    // Log GPS to Sensor Logs
-    db.run(`INSERT INTO sensor_logs (sensor_type, value_1, value_2, value_3) VALUES (?, ?, ?, ?)`,
-        ['GPS', locationData.latitude, locationData.longitude, locationData.speed],
-        (err) => { if (err) console.error("GPS Log Error:", err.message); }
-    );
+    // Log GPS to Sensor Logs (trackers that upload compressed tracks send log: false)
+    if (body.log !== false) {
+        db.run(`INSERT INTO sensor_logs (sensor_type, value_1, value_2, value_3, timestamp) VALUES (?, ?, ?, ?, ?)`,
+            ['GPS', reading.latitude, reading.longitude, reading.speed, sqlTime(now)],
+            (err) => { if (err) console.error("GPS Log Error:", err.message); }
+        );
+    }
 
     // Log occasionally
     if (Date.now() % 5000 < 100) console.log(`📍 GPS: ${locationData.latitude}, ${locationData.longitude}`);
+}
+
+app.post('/api/location', (req, res) => {
+    handleLocation(req.body);
     res.json({ success: true });
 });
 
@@ -304,6 +485,123 @@ app.get('/api/location', (req, res) => {
     res.json(locationData);
 });
 
+// --- Compressed GPS Tracks (trajectory.py) ---
+// Segment encoding 'tdv1': varint count, then the first point as
+// varint(t ms), zigzag(lat µdeg), zigzag(lon µdeg), varint(speed 0.1 km/h)
+// and every following point as deltas of the same fields (dt as varint,
+// the rest zigzag). Arithmetic instead of bitwise ops: timestamps in ms do
+// not fit in 32 bits.
+function decodeTrackSegment(buf) {
+    let pos = 0;
+    const readVarint = () => {
+        let result = 0;
+        let mul = 1;
+        while (true) {
+            if (pos >= buf.length) throw new Error('Truncated track segment');
+            const b = buf[pos++];
+            result += (b & 0x7f) * mul;
+            if (b < 0x80) return result;
+            mul *= 128;
+        }
+    };
+    const unzigzag = (v) => (v % 2 === 0 ? v / 2 : -(v + 1) / 2);
+
+    const count = readVarint();
+    const points = [];
+    let t = 0, lat = 0, lon = 0, speed = 0;
+    for (let i = 0; i < count; i++) {
+        const a = readVarint(), b = readVarint(), c = readVarint(), d = readVarint();
+        if (i === 0) {
+            t = a; lat = unzigzag(b); lon = unzigzag(c); speed = d;
+        } else {
+            t += a; lat += unzigzag(b); lon += unzigzag(c); speed += unzigzag(d);
+        }
+        points.push({ timestamp: t / 1000, latitude: lat / 1e6, longitude: lon / 1e6, speed: speed / 10 });
+    }
+    return points;
+}
+
+function handleTrack(body) {
+    if (body.encoding !== 'tdv1' || typeof body.data !== 'string') throw new Error('Unknown track encoding');
+    const data = Buffer.from(body.data, 'base64');
+    const points = decodeTrackSegment(data); // Validate before storing
+    if (points.length === 0) return;
+    db.run(`INSERT INTO gps_tracks (start_ts, end_ts, points, raw_points, encoding, data) VALUES (?, ?, ?, ?, ?, ?)`,
+        [points[0].timestamp, points[points.length - 1].timestamp, points.length, body.raw_points || points.length, body.encoding, data],
+        (err) => { if (err) console.error("GPS Track Log Error:", err.message); }
+    );
+}
+
+app.post('/api/location/track', (req, res) => {
+    try {
+        handleTrack(req.body);
+        res.json({ success: true });
+    } catch (e) {
+        res.status(400).json({ error: e.message });
+    }
+});
+
+// Decoded trace between two unix timestamps (default: the last hour)
+app.get('/api/location/track', (req, res) => {
+    const to = parseFloat(req.query.to) || Date.now() / 1000;
+    const from = parseFloat(req.query.from) || to - 3600;
+    db.all(`SELECT data FROM gps_tracks WHERE end_ts >= ? AND start_ts <= ? ORDER BY start_ts`, [from, to], (err, rows) => {
+        if (err) return res.status(500).json({ error: err.message });
+        const points = [];
+        rows.forEach(row => {
+            decodeTrackSegment(row.data).forEach(p => {
+                if (p.timestamp >= from && p.timestamp <= to) points.push(p);
+            });
+        });
+        res.json({ from, to, points });
+    });
+});
+
+// --- Bulk Telemetry Ingest API ---
+// Sensor modules (telemetry.py) batch many readings into one request:
+// { records: [{ path: '/api/radar', ts: <unix seconds>, data: {...} }, ...] }
+// Each record goes through the same handler as its single-reading endpoint,
+// at its own ts, and all resulting inserts share one SQLite transaction.
+const ingestHandlers = {
+    '/api/drowsiness': handleDrowsiness,
+    '/api/radar': handleRadar,
+    '/api/radar/sweep': handleRadarSweep,
+    '/api/radar/grid': handleRadarGrid,
+    '/api/vibration': handleVibration,
+    '/api/alcohol': handleAlcohol,
+    '/api/alerts': handleAlert,
+    '/api/location': handleLocation,
+    '/api/location/track': handleTrack
+};
+
+app.post('/api/ingest', (req, res) => {
+    const records = Array.isArray(req.body.records) ? req.body.records : [];
+    let accepted = 0;
+    let rejected = 0;
+
+    db.serialize(() => {
+        db.run('BEGIN TRANSACTION');
+        records.forEach((rec) => {
+            const handler = rec && ingestHandlers[rec.path];
+            if (!handler || !rec.data) {
+                rejected++;
+                return;
+            }
+            try {
+                handler(rec.data, readingTime(rec.ts));
+                accepted++;
+            } catch (e) {
+                console.error("Ingest Error:", e.message);
+                rejected++;
+            }
+        });
+        db.run('COMMIT', (err) => {
+            if (err) return res.status(500).json({ error: err.message });
+            res.json({ success: true, accepted, rejected });
+        });
+    });
+});
+
 // --- Sensor Logs History API ---
 app.get('/api/sensor-logs', (req, res) => {
     const sql = `SELECT * FROM sensor_logs ORDER BY id DESC LIMIT 50`;
@@ -372,6 +670,23 @@ app.post('/api/sos', (req, res) => {
 });
 
 
+// --- Alert Log API ---
+// alert_dispatcher.py sends the SMS itself (via gsm_service) and reports each
+// one here: { types: ['crash', ...], count, message, latitude, longitude }
+function handleAlert(body, now = Date.now()) {
+    const types = Array.isArray(body.types) ? body.types : [];
+    const sql = `INSERT INTO road_events (type, confidence, vibration, latitude, longitude, sos_alert, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)`;
+    db.run(sql, ['SOS', 100, types.includes('crash') ? 1 : 0, body.latitude || 0, body.longitude || 0, 1, sqlTime(now)], (err) => {
+        if (err) console.error("Alert Log Error:", err.message);
+    });
+    console.log(`🚨 Alert SMS sent (${types.join(', ')}): ${body.message}`);
+}
+
+app.post('/api/alerts', (req, res) => {
+    handleAlert(req.body);
+    res.json({ success: true });
+});
+
 // --- GSM Status API ---
 app.get('/api/gsm-status', (req, res) => {
     // 1. Get Count of SOS Alerts
@@ -0,0 +1,89 @@
+import os
+import time
+import signal
+import socket
+
+import hal
+import metrics
+
+# --- Configuration ---
+# Sensor loops are written as generators that yield how long to sleep
+# before their next step, instead of calling time.sleep() themselves:
+#
+#   def monitor_loop():
+#       setup()
+#       while True:
+#           read_and_post()
+#           yield 1.0
+#
+# Run standalone, run_blocking() sleeps between steps and reports to the
+# start_car.py supervisor (ready after the first step, then a heartbeat).
+# car_runtime.py runs the same generators as asyncio tasks in one process.
+# Either way each step's duration goes into loop_step_seconds, and the
+# process's metrics are exported for metrics_sidecar.py.
+SUPERVISOR_SOCKET = os.environ.get("ISARTHI_SUPERVISOR_SOCKET")
+MODULE_NAME = os.environ.get("ISARTHI_MODULE", "")
+BEAT_INTERVAL = 1.0         # At most one heartbeat datagram per second
+
+
+class Heartbeat:
+    # Datagrams to the supervisor: b"ready <name>" once, then b"beat <name>".
+    # A no-op when not started by the supervisor.
+    def __init__(self, name=MODULE_NAME, path=SUPERVISOR_SOCKET):
+        self.name = name
+        self.path = path
+        self.sock = None
+        self.last = 0.0
+        if path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    def _send(self, kind):
+        if self.sock is None:
+            return
+        try:
+            self.sock.sendto(f"{kind} {self.name}".encode(), self.path)
+        except OSError:
+            pass    # Supervisor restarting; the next beat will get through
+
+    def ready(self):
+        self.last = time.monotonic()
+        self._send("ready")
+
+    def beat(self):
+        now = time.monotonic()
+        if now - self.last >= BEAT_INTERVAL:
+            self.last = now
+            self._send("beat")
+
+
+def _terminate(signum, frame):
+    # start_car.py stops modules with SIGTERM: unwind like Ctrl+C so the
+    # loop's finally (flushes, partial saves, socket unlinks) still runs.
+    # Once only; a cleanup that hangs is SIGKILLed by the supervisor.
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def run_blocking(loop, heartbeat=None):
+    heartbeat = heartbeat or Heartbeat()
+    signal.signal(signal.SIGTERM, _terminate)
+    name = MODULE_NAME or metrics.module_name()
+    step_time = metrics.histogram("loop_step_seconds", loop=name)
+    metrics.start_exporter(name)
+    try:
+        t0 = metrics.now()
+        for i, delay in enumerate(loop):
+            step_time.record_since(t0)
+            if i == 0:
+                heartbeat.ready()
+            else:
+                heartbeat.beat()
+            if delay:
+                hal.sleep(delay)    # Skipped when replaying a capture
+            t0 = metrics.now()
+    except (KeyboardInterrupt, hal.ReplayFinished):
+        pass
+    finally:
+        loop.close()
+        hal.close()
@@ -0,0 +1,218 @@
+import os
+import mmap
+import glob
+import struct
+import zlib
+import threading
+
+# --- Configuration ---
+# Append-only on-disk spool. Readings are written here first (a memcpy into a
+# memory-mapped segment) and drained to the server when it is reachable, so
+# nothing is lost while the vehicle is out of coverage.
+SPOOL_ROOT = os.environ.get(
+    "ISARTHI_SPOOL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"),
+)
+RECORD_SIZE = 512              # Fixed slot size (header + payload)
+RECORDS_PER_SEGMENT = 8192     # 4 MiB per segment file
+MAX_SEGMENTS = 64              # 256 MiB cap; oldest unsent data is dropped beyond this
+
+# Record header: magic, payload length, crc32(payload), unix timestamp
+HEADER = struct.Struct("<HHId")
+MAGIC = 0x5352
+# Cursor file: segment number + record index of the next unread record
+CURSOR = struct.Struct("<QQ")
+
+
+class Spool:
+    def __init__(self, path, record_size=RECORD_SIZE, records_per_segment=RECORDS_PER_SEGMENT,
+                 max_segments=MAX_SEGMENTS):
+        self.path = path
+        self.record_size = record_size
+        self.records_per_segment = records_per_segment
+        self.segment_bytes = record_size * records_per_segment
+        self.max_segments = max(2, max_segments)
+        self.max_payload = record_size - HEADER.size
+
+        # Stats
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        # Read cursor (persisted so a restart resumes where the last ack left off)
+        cursor_path = os.path.join(path, "cursor")
+        self._cursor_fd = os.open(cursor_path, os.O_RDWR | os.O_CREAT, 0o644)
+        raw = os.pread(self._cursor_fd, CURSOR.size, 0)
+        segments = self._list_segments()
+
+        if len(raw) == CURSOR.size:
+            self.read_seg, self.read_idx = CURSOR.unpack(raw)
+        else:
+            self.read_seg, self.read_idx = (segments[0] if segments else 1), 0
+
+        # Writer always appends to the newest segment
+        self.write_seg = segments[-1] if segments else max(1, self.read_seg)
+        self._write_map = self._map_segment(self.write_seg, create=True)
+        self.write_idx = self._find_end(self._write_map)
+
+        if self.read_seg < (segments[0] if segments else self.write_seg):
+            self.read_seg, self.read_idx = (segments[0] if segments else self.write_seg), 0
+        if self.read_seg > self.write_seg or (self.read_seg == self.write_seg and self.read_idx > self.write_idx):
+            self.read_seg, self.read_idx = self.write_seg, self.write_idx
+        self._save_cursor()
+
+        # Read-side mapping cache (segment number, mmap)
+        self._read_map = (None, None)
+
+    # --- Segment files ---
+    def _segment_file(self, seg):
+        return os.path.join(self.path, f"seg-{seg:010d}.spool")
+
+    def _list_segments(self):
+        names = glob.glob(os.path.join(self.path, "seg-*.spool"))
+        return sorted(int(os.path.basename(n)[4:-6]) for n in names)
+
+    def _map_segment(self, seg, create=False):
+        flags = os.O_RDWR | (os.O_CREAT if create else 0)
+        fd = os.open(self._segment_file(seg), flags, 0o644)
+        try:
+            if os.fstat(fd).st_size < self.segment_bytes:
+                # Preallocate the full segment so appends never extend the file
+                os.ftruncate(fd, self.segment_bytes)
+            return mmap.mmap(fd, self.segment_bytes)
+        finally:
+            os.close(fd)
+
+    def _find_end(self, mm):
+        # Records are written contiguously, so the first empty slot can be
+        # found by binary search on the magic field.
+        lo, hi = 0, self.records_per_segment
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (magic,) = struct.unpack_from("<H", mm, mid * self.record_size)
+            if magic == MAGIC:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _rotate(self):
+        self._write_map.flush()
+        self._write_map.close()
+        self.write_seg += 1
+        self._write_map = self._map_segment(self.write_seg, create=True)
+        self.write_idx = 0
+
+        # Enforce the size bound by discarding the oldest segments
+        segments = self._list_segments()
+        while len(segments) > self.max_segments:
+            oldest = segments.pop(0)
+            if self.read_seg <= oldest:
+                unread = self.records_per_segment - (self.read_idx if self.read_seg == oldest else 0)
+                self.dropped += unread
+                self.read_seg, self.read_idx = oldest + 1, 0
+            self._remove_segment(oldest)
+        self._save_cursor()
+
+    def _remove_segment(self, seg):
+        if self._read_map[0] == seg:
+            self._read_map[1].close()
+            self._read_map = (None, None)
+        try:
+            os.remove(self._segment_file(seg))
+        except FileNotFoundError:
+            pass
+
+    def _save_cursor(self):
+        os.pwrite(self._cursor_fd, CURSOR.pack(self.read_seg, self.read_idx), 0)
+
+    # --- Writer ---
+    def append(self, payload, ts):
+        # payload: bytes (at most RECORD_SIZE - header). Returns False if too large.
+        n = len(payload)
+        if n > self.max_payload:
+            self.dropped += 1
+            return False
+        header = HEADER.pack(MAGIC, n, zlib.crc32(payload), ts)
+        with self._lock:
+            if self.write_idx >= self.records_per_segment:
+                self._rotate()
+            off = self.write_idx * self.record_size
+            # Payload first, header last: a torn write leaves an empty slot
+            self._write_map[off + HEADER.size:off + HEADER.size + n] = payload
+            self._write_map[off:off + HEADER.size] = header
+            self.write_idx += 1
+        return True
+
+    def sync(self):
+        with self._lock:
+            self._write_map.flush()
+
+    # --- Reader ---
+    def pending(self):
+        return (self.write_seg - self.read_seg) * self.records_per_segment + self.write_idx - self.read_idx
+
+    def read_batch(self, max_records):
+        # Returns ([(ts, payload_bytes), ...], token). Pass token to commit()
+        # once the batch has been delivered; until then it will be re-read.
+        out = []
+        with self._lock:
+            seg, idx = self.read_seg, self.read_idx
+            while len(out) < max_records:
+                if seg == self.write_seg:
+                    if idx >= self.write_idx:
+                        break
+                    mm = self._write_map
+                elif idx >= self.records_per_segment:
+                    seg, idx = seg + 1, 0
+                    continue
+                else:
+                    mm = self._reader_map(seg)
+                    if mm is None:
+                        # Segment vanished (size bound); skip ahead
+                        seg, idx = seg + 1, 0
+                        continue
+
+                end = self.write_idx if seg == self.write_seg else self.records_per_segment
+                take = min(end - idx, max_records - len(out))
+                for i in range(idx, idx + take):
+                    off = i * self.record_size
+                    magic, n, crc, ts = HEADER.unpack_from(mm, off)
+                    body = mm[off + HEADER.size:off + HEADER.size + n]
+                    if magic != MAGIC or zlib.crc32(body) != crc:
+                        self.dropped += 1  # Torn/corrupt record
+                        continue
+                    out.append((ts, body))
+                idx += take
+        return out, (seg, idx)
+
+    def _reader_map(self, seg):
+        if self._read_map[0] == seg:
+            return self._read_map[1]
+        if self._read_map[1] is not None:
+            self._read_map[1].close()
+        try:
+            mm = self._map_segment(seg)
+        except FileNotFoundError:
+            mm = None
+        self._read_map = (seg, mm)
+        return mm
+
+    def commit(self, token):
+        seg, idx = token
+        with self._lock:
+            old_seg = self.read_seg
+            self.read_seg, self.read_idx = seg, idx
+            self._save_cursor()
+            # Fully delivered segments are no longer needed
+            for done in range(old_seg, seg):
+                self._remove_segment(done)
+
+    def close(self):
+        with self._lock:
+            self._write_map.flush()
+            self._write_map.close()
+            if self._read_map[1] is not None:
+                self._read_map[1].close()
+            os.close(self._cursor_fd)
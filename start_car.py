@@ -1,69 +1,321 @@
-import subprocess
-import time
+import os
 import sys
+import json
+import time
 import signal
+import socket
+import subprocess
 
 # --- Configuration ---
+# Each module runs as its own process under this supervisor:
+#   - all modules start at once; "after" holds a module back until the
+#     listed modules report ready
+#   - readiness and liveness come from heartbeats (service_loop.py) on a
+#     local datagram socket; a module that misses its liveness deadline is
+#     killed and restarted
+#   - restarts back off exponentially (reset once a module has run stably)
+#   - each module is pinned to its CPUs with its own nice level, so the
+#     sensor loops keep cores 0-1 and vision gets 2-3
+# `python3 start_car.py --single` runs the sensor loops in one process
+# instead (car_runtime.py).
 MODULES = [
     # 1. Sensors (I2C / GPIO / UART)
-    {"name": "Vibration Monitor (Dual MPU6050)", "cmd": ["python3", "vibration_monitor.py"]},
-    {"name": "Radar System (LiDAR + Servo)", "cmd": ["python3", "radar_system.py"]},
-    {"name": "GPS Tracker (NEO-7M)", "cmd": ["python3", "gps_tracker.py"]},
-    {"name": "Alcohol Monitor (MQ-3)", "cmd": ["python3", "alcohol_monitor.py"]},
-    {"name": "GSM Service (A7670C)", "cmd": ["python3", "gsm_service.py"]},
-    
-    # 2. Camera Analytics (DISABLED: Run on PC)
-    # {"name": "Drowsiness Detector (Cam 0)", "cmd": ["python3", "drowsiness_detector.py"]}, 
-    # {"name": "Pothole Detector (Cam 1)", "cmd": ["python3", "pothole_detector.py"]}
+    {"key": "vibration", "name": "Vibration Monitor (Dual MPU6050)", "cmd": ["python3", "vibration_monitor.py"],
+     "cpus": {1}, "nice": -10, "rt": 10, "liveness": 5.0},
+    {"key": "radar", "name": "Radar System (LiDAR + Servo)", "cmd": ["python3", "radar_system.py"],
+     "cpus": {1}, "nice": -5, "liveness": 5.0},
+    {"key": "gps", "name": "GPS Tracker (NEO-7M)", "cmd": ["python3", "gps_tracker.py"],
+     "cpus": {0}, "nice": -5, "liveness": 10.0},
+    {"key": "alcohol", "name": "Alcohol Monitor (MQ-3)", "cmd": ["python3", "alcohol_monitor.py"],
+     "cpus": {0}, "nice": 0, "liveness": 10.0},
+    {"key": "gsm", "name": "GSM Service (A7670C)", "cmd": ["python3", "gsm_service.py"],
+     "cpus": {0}, "nice": 0, "liveness": 120.0},
+    # Server upload of the sensor topics on the sample bus (sample_bus.py)
+    {"key": "uploader", "name": "Bus Uploader", "cmd": ["python3", "bus_uploader.py"],
+     "cpus": {0}, "nice": 5, "liveness": 10.0},
+    # Local ring of every sensor stream, frozen around crashes (blackbox.py)
+    {"key": "blackbox", "name": "Black Box Recorder", "cmd": ["python3", "blackbox.py"],
+     "cpus": {0}, "nice": 0, "liveness": 10.0},
+    {"key": "metrics", "name": "Metrics Sidecar (:9100)", "cmd": ["python3", "metrics_sidecar.py"],
+     "cpus": {0}, "nice": 10, "liveness": 10.0},
+
+    # 2. Camera Analytics (DISABLED: Run on PC). They beat per processed frame.
+    # {"key": "drowsiness", "name": "Drowsiness Detector (Cam 0)", "cmd": ["python3", "drowsiness_detector.py"],
+    #  "cpus": {2, 3}, "nice": 10, "after": ["vibration", "radar"], "liveness": 15.0},
+    # {"key": "pothole", "name": "Pothole Detector (Cam 1)", "cmd": ["python3", "pothole_detector.py"],
+    #  "cpus": {2, 3}, "nice": 10, "after": ["vibration", "radar"], "liveness": 15.0},
+    # Or both cameras in one service, one detector process per core in "cpus" (vision_service.py)
+    # {"key": "vision", "name": "Vision Service (:5001, :5002)", "cmd": ["python3", "vision_service.py"],
+    #  "cpus": {2, 3}, "nice": 10, "after": ["vibration", "radar"], "liveness": 15.0},
 ]
 
-processes = []
+SUPERVISOR_SOCKET = os.environ.get("ISARTHI_SUPERVISOR_SOCKET", "/tmp/isarthi_supervisor.sock")
+READY_TIMEOUT = 30.0        # From launch to the first "ready"
+DEFAULT_LIVENESS = 10.0     # Seconds without a heartbeat before a restart
+BACKOFF_MIN = 1.0
+BACKOFF_MAX = 60.0
+STABLE_AFTER = 60.0         # Ready this long -> the next crash restarts after BACKOFF_MIN again
+STOP_TIMEOUT = 2.0
+STATS_INTERVAL = 30.0
+TICK = 0.2
 
-def signal_handler(sig, frame):
-    print("\n🛑 Stopping All Road Monitor Modules...")
-    for p in processes:
-        p.terminate()
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def proc_stats(pid):
+    # CPU seconds (user + system), RSS and PSS in KB from /proc; None if gone
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        rss = pss = 0
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1])
+                    break
+        try:
+            # Proportional share: libraries mapped by several modules count once overall
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        pss = int(line.split()[1])
+                        break
+        except OSError:
+            pss = rss
+        return {"cpu": cpu, "rss_kb": rss, "pss_kb": pss}
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Child:
+    def __init__(self, spec):
+        self.spec = spec
+        self.key = spec["key"]
+        self.name = spec["name"]
+        self.proc = None
+        self.state = "waiting"      # waiting -> starting -> ready; backoff after a failure
+        self.started_at = 0.0
+        self.ready_at = None
+        self.last_beat = 0.0
+        self.restarts = 0
+        self.backoff = BACKOFF_MIN
+        self.next_start = 0.0
+        self.cpu_prev = None        # (cpu seconds, monotonic) at the last stats print
+
+    def launch(self, now):
+        env = dict(os.environ, ISARTHI_SUPERVISOR_SOCKET=SUPERVISOR_SOCKET, ISARTHI_MODULE=self.key)
+        print(f"🔹 Launching {self.name}...")
+        try:
+            self.proc = subprocess.Popen(self.spec["cmd"], env=env)
+        except OSError as e:
+            print(f"❌ Failed to launch {self.name}: {e}")
+            self.fail(now, "launch failed")
+            return
+        self.state = "starting"
+        self.started_at = now
+        self.ready_at = None
+        self.cpu_prev = None
+        self.apply_scheduling()
+
+    def apply_scheduling(self):
+        pid = self.proc.pid
+        try:
+            if "cpus" in self.spec:
+                os.sched_setaffinity(pid, self.spec["cpus"])
+            if self.spec.get("rt") and os.geteuid() == 0:
+                os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(self.spec["rt"]))
+            elif self.spec.get("nice"):
+                os.setpriority(os.PRIO_PROCESS, pid, self.spec["nice"])
+        except PermissionError:
+            print(f"⚠️ {self.name}: no permission for priority {self.spec.get('nice')} (run as root or grant CAP_SYS_NICE)")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ {self.name}: could not set CPU affinity / priority: {e}")
+
+    def on_message(self, kind, now):
+        self.last_beat = now
+        if kind == "ready" and self.state == "starting":
+            self.state = "ready"
+            self.ready_at = now
+            print(f"✅ {self.name} ready ({now - self.started_at:.1f}s)")
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+
+    def kill(self, reason):
+        print(f"⚠️ {self.name}: {reason}, restarting")
+        self.stop()
         try:
-            p.wait(timeout=2)
+            self.proc.wait(timeout=STOP_TIMEOUT)
         except subprocess.TimeoutExpired:
-            p.kill()
-    print("✅ System Shutdown Complete.")
-    sys.exit(0)
+            self.proc.kill()
+            self.proc.wait()
 
-def main():
-    print("🚀 Starting I-SARTHI Road Monitor System...")
-    print("---------------------------------------------")
+    def fail(self, now, reason):
+        if self.ready_at is not None and now - self.ready_at >= STABLE_AFTER:
+            self.backoff = BACKOFF_MIN
+        self.state = "backoff"
+        self.proc = None
+        self.next_start = now + self.backoff
+        self.restarts += 1
+        print(f"♻️ Restarting {self.name} in {self.backoff:.0f}s ({reason}, restart #{self.restarts})")
+        self.backoff = min(self.backoff * 2, BACKOFF_MAX)
+
+    def check(self, now, ready_keys):
+        if self.state in ("waiting", "backoff"):
+            if now >= self.next_start and all(k in ready_keys for k in self.spec.get("after", ())):
+                self.launch(now)
+            return
+        code = self.proc.poll()
+        if code is not None:
+            self.fail(now, f"exit code {code}")
+        elif self.state == "starting" and now - self.started_at > READY_TIMEOUT:
+            self.kill(f"not ready after {READY_TIMEOUT:.0f}s")
+            self.fail(now, "not ready")
+        elif self.state == "ready" and now - self.last_beat > self.spec.get("liveness", DEFAULT_LIVENESS):
+            self.kill(f"no heartbeat for {now - self.last_beat:.0f}s")
+            self.fail(now, "hung")
 
-    # Launch Each Module
-    for module in MODULES:
+    def stats(self, now):
+        if self.proc is None:
+            return None
+        s = proc_stats(self.proc.pid)
+        if s is None:
+            return None
+        if self.cpu_prev is not None and now > self.cpu_prev[1]:
+            s["cpu_pct"] = 100.0 * (s["cpu"] - self.cpu_prev[0]) / (now - self.cpu_prev[1])
+        else:
+            s["cpu_pct"] = 100.0 * s["cpu"] / max(now - self.started_at, 1e-3)
+        self.cpu_prev = (s["cpu"], now)
+        return s
+
+
+class Supervisor:
+    def __init__(self, modules=MODULES):
+        self.children = [Child(spec) for spec in modules]
+        self.by_key = {c.key: c for c in self.children}
+        self.stopping = False
+        self.sock = None
+
+    def open_socket(self):
+        if os.path.exists(SUPERVISOR_SOCKET):
+            os.unlink(SUPERVISOR_SOCKET)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(SUPERVISOR_SOCKET)
+        self.sock.settimeout(TICK)
+
+    def receive(self):
+        # Waits up to one tick for heartbeats, then drains the rest
+        try:
+            data = self.sock.recv(256)
+        except (socket.timeout, InterruptedError):
+            return
+        self.sock.setblocking(False)
         try:
-            print(f"🔹 Launching {module['name']}...")
-            # Use Popen to launch in background
-            proc = subprocess.Popen(module['cmd'])
-            processes.append(proc)
-            time.sleep(1) # Stagger start to prevent startup spike
-        except Exception as e:
-            print(f"❌ Failed to launch {module['name']}: {e}")
-
-    print("---------------------------------------------")
-    print("✅ All Modules Running!")
-    print("   - Press Ctrl+C to Stop All.")
-    print("   - View Logs in separate terminal or implement logging.")
-    
+            while True:
+                kind, _, key = data.decode(errors="replace").partition(" ")
+                child = self.by_key.get(key)
+                if child is not None and child.proc is not None:
+                    child.on_message(kind, time.monotonic())
+                data = self.sock.recv(256)
+        except BlockingIOError:
+            pass
+        finally:
+            self.sock.settimeout(TICK)
+
+    def totals(self, now):
+        rows = [(c, c.stats(now)) for c in self.children]
+        own = proc_stats(os.getpid())
+        total = {"rss_kb": own["rss_kb"], "pss_kb": own["pss_kb"]}
+        for _, s in rows:
+            if s is not None:
+                total["rss_kb"] += s["rss_kb"]
+                total["pss_kb"] += s["pss_kb"]
+        return rows, total
+
+    def print_stats(self, now):
+        rows, total = self.totals(now)
+        print("📊 Module              State     CPU%   RSS MB  Restarts  Beat")
+        for c, s in rows:
+            beat = f"{now - c.last_beat:.1f}s" if c.proc is not None and c.last_beat else "-"
+            if s is None:
+                print(f"   {c.key:<20}  {c.state:<8}  {'-':>5}  {'-':>7}  {c.restarts:>8}  {beat}")
+            else:
+                print(f"   {c.key:<20}  {c.state:<8}  {s['cpu_pct']:5.1f}  {s['rss_kb'] / 1024:7.1f}  {c.restarts:>8}  {beat}")
+        print(f"   Total RSS {total['rss_kb'] / 1024:.1f} MB | PSS {total['pss_kb'] / 1024:.1f} MB")
+
+    def run(self, exit_when_ready=False):
+        t0 = time.monotonic()
+        self.open_socket()
+        print("🚀 Starting I-SARTHI Road Monitor System...")
+        print("---------------------------------------------")
+        all_ready = False
+        last_stats = t0
+        try:
+            while not self.stopping:
+                self.receive()
+                now = time.monotonic()
+                ready_keys = {c.key for c in self.children if c.state == "ready"}
+                for c in self.children:
+                    c.check(now, ready_keys)
+
+                if not all_ready and all(c.state == "ready" for c in self.children):
+                    all_ready = True
+                    _, total = self.totals(now)
+                    print("---------------------------------------------")
+                    print(f"✅ All Modules Running! (ready in {now - t0:.1f}s, {total['pss_kb'] / 1024:.0f} MB PSS)")
+                    print("   - Press Ctrl+C to Stop All.")
+                    if exit_when_ready:
+                        print("READY " + json.dumps({"mode": "multi", "ready_s": round(now - t0, 3), **total}), flush=True)
+                        time.sleep(5.0)     # Let the modules settle before measuring steady state
+                        _, total = self.totals(time.monotonic())
+                        print("STEADY " + json.dumps({"mode": "multi", **total}), flush=True)
+                        break
+
+                if now - last_stats >= STATS_INTERVAL:
+                    last_stats = now
+                    self.print_stats(now)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        print("\n🛑 Stopping All Road Monitor Modules...")
+        running = [c for c in self.children if c.proc is not None]
+        for c in running:
+            c.stop()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for c in running:
+            try:
+                c.proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                c.proc.kill()
+        if self.sock is not None:
+            self.sock.close()
+            try:
+                os.unlink(SUPERVISOR_SOCKET)
+            except OSError:
+                pass
+        print("✅ System Shutdown Complete.")
+
+
+supervisor = None
+
+def signal_handler(sig, frame):
+    supervisor.stopping = True
+
+def main():
+    global supervisor
+    exit_when_ready = "--exit-when-ready" in sys.argv
+    if "--single" in sys.argv:
+        import car_runtime
+        return car_runtime.main(exit_when_ready=exit_when_ready)
+
+    supervisor = Supervisor()
+    # Before anything is launched, so Ctrl+C during startup still cleans up
     signal.signal(signal.SIGINT, signal_handler)
-    
-    # Keep master process alive
-    while True:
-        time.sleep(1)
-        # Check if any process died
-        for i, p in enumerate(processes):
-            if p.poll() is not None:
-                name = MODULES[i]['name']
-                print(f"⚠️ Warning: {name} has stopped (Exit Code: {p.returncode})")
-                # Optional: Restart Logic
-                # proc = subprocess.Popen(MODULES[i]['cmd'])
-                # processes[i] = proc
-                # print(f"♻️ Restarted {name}")
+    signal.signal(signal.SIGTERM, signal_handler)
+    supervisor.run(exit_when_ready=exit_when_ready)
 
 if __name__ == "__main__":
     main()
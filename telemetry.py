@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import spool
+import metrics
+
+# --- Configuration ---
+# All sensor modules share one keep-alive Session and one background sender.
+# Readings are queued (never blocking the sensor loop) and shipped in
+# micro-batches to the server's bulk ingest endpoint.
+INGEST_PATH = "/api/ingest"
+BATCH_MAX_RECORDS = 200     # Flush when this many readings are waiting...
+BATCH_MAX_DELAY = 0.25      # ...or when the oldest one is this old (seconds)
+QUEUE_MAX_RECORDS = 20000   # Backlog cap; beyond this new readings are dropped
+REQUEST_TIMEOUT = 2.0       # Sender thread timeout (sensor loops never wait on it)
+POOL_SIZE = 4
+
+# Store-and-forward: readings go to an on-disk spool first (see spool.py) and
+# are drained from it, so an unreachable server only delays them.
+SPOOL_ENABLED = os.environ.get("ISARTHI_SPOOL", "1") != "0"
+REPLAY_BATCH_RECORDS = 2000  # Bigger batches while catching up on a backlog
+RETRY_MIN_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+SPOOL_SYNC_INTERVAL = 1.0    # msync the active segment at most this often
+# Connection errors, timeouts and these statuses are retried; any other
+# 4xx is permanent (the server will never take that record), so the
+# records go to rejected.jsonl in the spool directory instead of blocking it
+RETRY_STATUSES = {408, 429}
+DEAD_LETTER_MAX_BYTES = 1 << 20
+
+
+class TelemetryClient:
+    def __init__(self, batch_max_records=BATCH_MAX_RECORDS, batch_max_delay=BATCH_MAX_DELAY,
+                 queue_max_records=QUEUE_MAX_RECORDS, timeout=REQUEST_TIMEOUT, spool_store=None):
+        self.spool = spool_store
+        self.batch_max_records = batch_max_records
+        self.batch_max_delay = batch_max_delay
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.queue = queue.Queue(maxsize=queue_max_records)
+        # Servers that predate /api/ingest get one POST per reading instead
+        self.legacy_servers = set()
+
+        # Stats
+        self.sent = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.rejected = 0
+        self.oversize = 0
+        self._oversize_paths = set()
+        self.request_time = metrics.histogram("http_request_seconds")
+        metrics.gauge("telemetry_sent_total", lambda: self.sent)
+        metrics.gauge("telemetry_failed_batches_total", lambda: self.failed_batches)
+        metrics.gauge("telemetry_rejected_total", lambda: self.rejected)
+        metrics.gauge("telemetry_oversize_total", lambda: self.oversize)
+        metrics.gauge("telemetry_pending", lambda: self.spool.pending() if self.spool is not None else self.queue.qsize())
+
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._backing_off = False
+
+    # --- Producer side (called from sensor loops) ---
+    def post(self, url, payload):
+        # Never blocks: queue the reading and return immediately
+        parts = urlsplit(url)
+        base = f"{parts.scheme}://{parts.netloc}"
+        self._ensure_started()
+        try:
+            # NaN / Infinity aren't JSON; the server's parser would reject the batch
+            record = json.dumps([base, parts.path, payload], separators=(",", ":"), allow_nan=False).encode()
+        except (TypeError, ValueError) as e:
+            self.dropped += 1
+            metrics.dropped("telemetry.invalid")
+            print(f"⚠️ Telemetry: unserializable reading for {parts.path} dropped ({e})")
+            return False
+        if self.spool is not None and len(record) > self.spool.max_payload:
+            # Doesn't fit a spool slot: sent from memory instead (not durable)
+            self.oversize += 1
+            if parts.path not in self._oversize_paths:
+                self._oversize_paths.add(parts.path)
+                print(f"⚠️ Telemetry: {parts.path} readings ({len(record)} bytes) exceed a spool slot "
+                      f"({self.spool.max_payload}), sending them unspooled")
+        elif self.spool is not None:
+            if not self.spool.append(record, time.time()):
+                self.dropped += 1
+                metrics.dropped("telemetry.spool_full")
+                return False
+            if not self._backing_off and self.spool.pending() >= self.batch_max_records:
+                self._wake.set()
+            return True
+        try:
+            self.queue.put_nowait((base, parts.path, time.time(), payload))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            metrics.dropped("telemetry.queue_full")
+            return False
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="telemetry-sender", daemon=True)
+                self._thread.start()
+
+    # --- Sender thread ---
+    def _run(self):
+        if self.spool is not None:
+            self._run_spool()
+        else:
+            self._run_queue()
+
+    def _run_spool(self):
+        retry_delay = 0.0
+        last_sync = time.monotonic()
+        while not self._stop.is_set():
+            # Sleep until a full batch is waiting, the batch delay expires, or
+            # (after a failure) the retry backoff expires.
+            self._wake.wait(retry_delay or self.batch_max_delay)
+            self._wake.clear()
+
+            now = time.monotonic()
+            if now - last_sync >= SPOOL_SYNC_INTERVAL:
+                self.spool.sync()
+                last_sync = now
+
+            # Drain everything that is pending, in large batches when behind
+            while not self._stop.is_set():
+                records, token = self.spool.read_batch(REPLAY_BATCH_RECORDS)
+                if not records:
+                    self.spool.commit(token)
+                    retry_delay = 0.0
+                    break
+
+                by_server = {}
+                for ts, raw in records:
+                    base, path, payload = json.loads(raw)
+                    by_server.setdefault(base, []).append({"path": path, "ts": ts, "data": payload})
+
+                # A batch is only acknowledged when every server took (or
+                # permanently rejected) its part; otherwise the whole batch is
+                # retried later.
+                ok = all(self.send_batch(base, recs) for base, recs in by_server.items())
+                if not ok:
+                    self.failed_batches += 1
+                    retry_delay = min(max(retry_delay * 2, RETRY_MIN_DELAY), RETRY_MAX_DELAY)
+                    break
+
+                self.spool.commit(token)
+                self.sent += len(records)
+                retry_delay = 0.0
+
+            self._backing_off = retry_delay > 0
+            self._send_unspooled()
+
+    def _send_unspooled(self):
+        # Oversize readings (see post()); one attempt each, like the in-memory mode
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._send_queued(batch)
+
+    def _run_queue(self):
+        while not self._stop.is_set():
+            try:
+                first = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.batch_max_delay
+            while len(batch) < self.batch_max_records:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._send_queued(batch)
+
+    def _send_queued(self, batch):
+        # One bulk request per destination server
+        by_server = {}
+        for base, path, ts, payload in batch:
+            by_server.setdefault(base, []).append({"path": path, "ts": ts, "data": payload})
+
+        for base, records in by_server.items():
+            if self.send_batch(base, records):
+                self.sent += len(records)
+            else:
+                self.failed_batches += 1
+                self.dropped += len(records)
+                metrics.dropped("telemetry.failed_batch", len(records))
+
+        for _ in batch:
+            self.queue.task_done()
+
+    def send_batch(self, base, records):
+        # Returns True once the server has accepted every record (or rejected
+        # it for good, see reject()); False when the batch should be retried
+        t0 = metrics.now()
+        try:
+            if base not in self.legacy_servers:
+                resp = self.session.post(base + INGEST_PATH, json={"records": records}, timeout=self.timeout)
+                if resp.status_code != 404:
+                    return self._settle(resp, base, records)
+                print(f"⚠️ Telemetry: {base} has no {INGEST_PATH}, falling back to per-reading POSTs")
+                self.legacy_servers.add(base)
+
+            for rec in records:
+                resp = self.session.post(base + rec["path"], json=rec["data"], timeout=self.timeout)
+                if not self._settle(resp, base, [rec]):
+                    return False
+            return True
+        except requests.RequestException:
+            return False
+        finally:
+            self.request_time.record_since(t0)
+
+    def _settle(self, resp, base, records):
+        if resp.ok:
+            return True
+        if resp.status_code >= 500 or resp.status_code in RETRY_STATUSES:
+            return False
+        self.reject(base, records, f"{resp.status_code} {resp.text[:200]}")
+        return True
+
+    def reject(self, base, records, reason):
+        # Permanent failure: keep the records for inspection (bounded) and move on
+        self.rejected += len(records)
+        metrics.dropped("telemetry.rejected", len(records))
+        print(f"⚠️ Telemetry: {base} rejected {len(records)} records ({reason})")
+        if self.spool is None:
+            return
+        path = os.path.join(self.spool.path, "rejected.jsonl")
+        try:
+            if os.path.exists(path) and os.path.getsize(path) >= DEAD_LETTER_MAX_BYTES:
+                return
+            with open(path, "a") as f:
+                for rec in records:
+                    f.write(json.dumps({"base": base, "reason": reason, **rec}) + "\n")
+        except OSError:
+            pass
+
+    # --- Lifecycle ---
+    def flush(self, timeout=5.0):
+        # Wait (bounded) until everything queued so far has been attempted
+        end = time.monotonic() + timeout
+        if self.spool is not None:
+            self._wake.set()
+            while (self.spool.pending() or self.queue.unfinished_tasks) and time.monotonic() < end:
+                time.sleep(0.01)
+            return self.spool.pending() == 0 and self.queue.unfinished_tasks == 0
+        while self.queue.unfinished_tasks and time.monotonic() < end:
+            time.sleep(0.01)
+        return self.queue.unfinished_tasks == 0
+
+    def close(self, timeout=5.0):
+        self.flush(timeout)
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        if self.spool is not None:
+            # Anything still unsent stays on disk for the next run
+            self.spool.close()
+        self.session.close()
+
+
+# --- Shared process-wide client ---
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TelemetryClient(spool_store=_open_spool())
+                # Give queued readings a moment to leave on normal exit
+                atexit.register(_client.close, 1.0)
+    return _client
+
+
+def _open_spool():
+    if not SPOOL_ENABLED:
+        return None
+    # One spool per module (e.g. spool/radar_system) so processes never share a segment
+    name = os.path.splitext(os.path.basename(sys.argv[0] or ""))[0] or "default"
+    try:
+        return spool.Spool(os.path.join(spool.SPOOL_ROOT, name))
+    except OSError as e:
+        print(f"⚠️ Telemetry: spool unavailable ({e}), using in-memory queue")
+        return None
+
+
+def post(url, payload):
+    return get_client().post(url, payload)
@@ -0,0 +1,220 @@
+import math
+import base64
+import numpy as np
+
+import telemetry
+
+# --- Configuration ---
+# On-device GPS trace compression. Fixes are simplified online (a point is
+# only kept when dropping it would move the trace, at the same timestamps,
+# by more than TOLERANCE_M or the speed by more than SPEED_TOLERANCE_KMH),
+# then the kept points are delta + varint encoded into small binary
+# segments and uploaded in one request each. server/server.js stores one
+# row per segment and decodes them on read.
+TRACK_URL = "http://10.137.73.214:5000/api/location/track"
+TOLERANCE_M = 5.0
+SPEED_TOLERANCE_KMH = 5.0
+MAX_POINT_GAP = 30.0        # Seconds; keep at least one point this often (also on straight roads)
+MAX_BUFFER = 1024           # Pending points checked against the current segment
+SEGMENT_MAX_BYTES = 240     # Encoded segment size (still fits one telemetry spool record after base64)
+SEGMENT_SECONDS = 60.0      # Upload at least this often while driving
+
+# Encoding "tdv1": varint(count), varint(t0 ms), zigzag(lat0 µdeg), zigzag(lon0 µdeg), varint(speed0 dkm/h),
+# then per point: varint(dt ms), zigzag(dlat), zigzag(dlon), zigzag(dspeed)
+ENCODING = "tdv1"
+COORD_SCALE = 1e6           # 1 µdeg ≈ 0.11 m
+SPEED_SCALE = 10.0          # 0.1 km/h
+METERS_PER_DEG = 111319.49
+
+
+# --- Online simplification ---
+
+class TrajectorySimplifier:
+    def __init__(self, tolerance_m=TOLERANCE_M, speed_tolerance=SPEED_TOLERANCE_KMH,
+                 max_gap=MAX_POINT_GAP, max_buffer=MAX_BUFFER):
+        self.tolerance2 = tolerance_m * tolerance_m
+        self.speed_tolerance = speed_tolerance
+        self.max_gap = max_gap
+        self.anchor = None
+        # Points since the anchor (t, lat, lon, speed), as columns
+        self.buf = np.zeros((max_buffer, 4))
+        self.n = 0
+        self.seen = 0
+        self.kept = 0
+
+    def add(self, t, lat, lon, speed):
+        # Returns the list of points that became final (usually empty)
+        self.seen += 1
+        point = (t, lat, lon, speed)
+        if self.anchor is None:
+            self.anchor = point
+            self.kept += 1
+            return [point]
+
+        if self.n and (t - self.anchor[0] > self.max_gap or self.n == len(self.buf)
+                       or not self._fits(point)):
+            # The previous point is the furthest the current segment can reach
+            keep = tuple(self.buf[self.n - 1])
+            self.anchor = keep
+            self.buf[0] = point
+            self.n = 1
+            self.kept += 1
+            return [keep]
+        self.buf[self.n] = point
+        self.n += 1
+        return []
+
+    def _fits(self, point):
+        # Synchronized distance: where each pending point would be, at its own
+        # time, on the straight line anchor -> point
+        t0, lat0, lon0, v0 = self.anchor
+        t1, lat1, lon1, v1 = point
+        span = t1 - t0
+        if span <= 0:
+            return False
+        pending = self.buf[:self.n]
+        f = (pending[:, 0] - t0) / span
+        kx = METERS_PER_DEG * math.cos(math.radians(lat0))
+        dx = (lon0 + f * (lon1 - lon0) - pending[:, 2]) * kx
+        dy = (lat0 + f * (lat1 - lat0) - pending[:, 1]) * METERS_PER_DEG
+        if np.any(dx * dx + dy * dy > self.tolerance2):
+            return False
+        dv = v0 + f * (v1 - v0) - pending[:, 3]
+        return not np.any(np.abs(dv) > self.speed_tolerance)
+
+    def flush(self):
+        # Finalizes the latest pending point (end of trip / shutdown)
+        if self.n == 0:
+            return []
+        keep = tuple(self.buf[self.n - 1])
+        self.anchor = keep
+        self.n = 0
+        self.kept += 1
+        return [keep]
+
+
+# --- Delta / varint encoding ---
+
+def _varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value):
+    return (value << 1) if value >= 0 else ((-value) << 1) - 1
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _unzigzag(value):
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+class SegmentEncoder:
+    # Builds one segment incrementally, so its size is known at every point
+    def __init__(self):
+        self.body = bytearray()
+        self.count = 0
+        self.prev = None
+        self.start = None
+
+    def add(self, t, lat, lon, speed):
+        q = (int(round(t * 1000)), int(round(lat * COORD_SCALE)),
+             int(round(lon * COORD_SCALE)), max(0, int(round(speed * SPEED_SCALE))))
+        if self.prev is None:
+            _varint(q[0], self.body)
+            _varint(_zigzag(q[1]), self.body)
+            _varint(_zigzag(q[2]), self.body)
+            _varint(q[3], self.body)
+            self.start = t
+        else:
+            _varint(max(0, q[0] - self.prev[0]), self.body)
+            _varint(_zigzag(q[1] - self.prev[1]), self.body)
+            _varint(_zigzag(q[2] - self.prev[2]), self.body)
+            _varint(_zigzag(q[3] - self.prev[3]), self.body)
+        self.prev = q
+        self.count += 1
+
+    def __len__(self):
+        return len(self.body) + 2
+
+    def to_bytes(self):
+        header = bytearray()
+        _varint(self.count, header)
+        return bytes(header + self.body)
+
+
+def encode_segment(points):
+    enc = SegmentEncoder()
+    for p in points:
+        enc.add(*p)
+    return enc.to_bytes()
+
+
+def decode_segment(data):
+    # -> list of (t seconds, lat, lon, speed km/h)
+    count, pos = _read_varint(data, 0)
+    points = []
+    t = lat = lon = speed = 0
+    for i in range(count):
+        a, pos = _read_varint(data, pos)
+        b, pos = _read_varint(data, pos)
+        c, pos = _read_varint(data, pos)
+        d, pos = _read_varint(data, pos)
+        if i == 0:
+            t, lat, lon, speed = a, _unzigzag(b), _unzigzag(c), d
+        else:
+            t, lat, lon, speed = t + a, lat + _unzigzag(b), lon + _unzigzag(c), speed + _unzigzag(d)
+        points.append((t / 1000.0, lat / COORD_SCALE, lon / COORD_SCALE, speed / SPEED_SCALE))
+    return points
+
+
+# --- Batched segment upload ---
+
+class TrackUploader:
+    def __init__(self, url=TRACK_URL, tolerance_m=TOLERANCE_M):
+        self.url = url
+        self.simplifier = TrajectorySimplifier(tolerance_m)
+        self.encoder = SegmentEncoder()
+        self.segment_raw = 0
+        self.segments = 0
+        self.bytes_sent = 0
+
+    def add(self, t, lat, lon, speed):
+        self.segment_raw += 1
+        for p in self.simplifier.add(t, lat, lon, speed):
+            self.encoder.add(*p)
+        if len(self.encoder) >= SEGMENT_MAX_BYTES or (
+                self.encoder.count and t - self.encoder.start >= SEGMENT_SECONDS):
+            self.upload()
+
+    def upload(self):
+        if self.encoder.count == 0:
+            return
+        data = self.encoder.to_bytes()
+        telemetry.post(self.url, {
+            'encoding': ENCODING,
+            'data': base64.b64encode(data).decode('ascii'),
+            'points': self.encoder.count,
+            'raw_points': self.segment_raw,
+        })
+        self.segments += 1
+        self.bytes_sent += len(data)
+        self.encoder = SegmentEncoder()
+        self.segment_raw = 0
+
+    def close(self):
+        for p in self.simplifier.flush():
+            self.encoder.add(*p)
+        self.upload()
@@ -0,0 +1,180 @@
+import numpy as np
+
+# --- Configuration ---
+# Sliding-window feature extraction over the MPU6050 accelerometer stream.
+# Samples from both sensors are pushed in FIFO-sized blocks into mirrored
+# ring buffers; every HOP samples one vectorized pass computes the features
+# for both sensors and classifies the window.
+WINDOW = 256                # Samples per window (256 ms at 1 kHz)
+HOP = 64                    # New samples between windows
+RING_CAPACITY = 2048        # Per sensor; must hold a window plus one FIFO drain
+# A sensor that has delivered nothing while the others delivered this many
+# samples (~1 s at 1 kHz) has dropped out: windows go on without it, and it
+# rejoins once it has delivered a full window of new samples
+STALE_SAMPLES = 1024
+
+# Frequency bands (Hz) for the FFT band energies:
+# body motion, suspension / road roughness, impacts, engine / noise
+BANDS_HZ = (0, 5, 20, 80)
+
+# Classifier thresholds (g, on the gravity-removed magnitude)
+CRASH_PEAK_G = 4.0
+CRASH_JERK_G_PER_S = 400.0  # A crash is a large *and* abrupt change
+POTHOLE_PEAK_G = 1.2
+POTHOLE_CREST = 3.5         # peak / rms: short, sharp spike vs. sustained shaking
+ROUGH_RMS_G = 0.25
+
+CLASSES = ("smooth", "rough", "pothole", "crash")
+
+
+class WindowEngine:
+    def __init__(self, sample_rate_hz, lsb_per_g, sensors=2, window=WINDOW, hop=HOP,
+                 capacity=RING_CAPACITY, bands_hz=BANDS_HZ, stale_samples=STALE_SAMPLES):
+        if capacity < window:
+            raise ValueError("ring capacity must be at least one window")
+        self.fs = float(sample_rate_hz)
+        self.scale = 1.0 / lsb_per_g
+        self.sensors = sensors
+        self.window = window
+        self.hop = hop
+        self.cap = capacity
+        self.stale_samples = stale_samples
+
+        # Mirrored rings: every sample is stored at i and i + cap, so any
+        # window is a contiguous slice and never needs to be stitched.
+        self.ring = np.zeros((sensors, 2 * capacity, 3), dtype=np.int16)
+        self.head = np.zeros(sensors, dtype=np.int64)
+        self.active = np.zeros(sensors, dtype=bool)
+        self.last_end = np.zeros(sensors, dtype=np.int64)
+        self.resumed = np.zeros(sensors, dtype=np.int64)    # head when the sensor (re)joined
+        self.idle = np.zeros(sensors, dtype=np.int64)       # Others' samples since its last push
+        self.dropouts = 0
+
+        # Work buffers reused for every window
+        self.work = np.zeros((sensors, window, 3), dtype=np.float32)
+        self.mag = np.zeros((sensors, window), dtype=np.float32)
+        self.taper = np.hanning(window).astype(np.float32)
+
+        freqs = np.fft.rfftfreq(window, d=1.0 / self.fs)
+        edges = [int(np.searchsorted(freqs, f)) for f in bands_hz]
+        self.band_edges = np.array(sorted(set(e for e in edges if e < len(freqs))), dtype=np.intp)
+        self.band_names = [f"{lo}-{hi}Hz" for lo, hi in zip(bands_hz, bands_hz[1:])] + [f"{bands_hz[-1]}Hz+"]
+        self.band_names = self.band_names[:len(self.band_edges)]
+
+        self.windows = 0
+
+    def push(self, sensor, samples, n):
+        # Copy samples[:n] (int16 counts, shape (>=n, 3)) into the sensor's ring
+        if n <= 0:
+            return
+        if not self.active[sensor]:
+            # (Re)joining: samples from before a dropout never share a window with new ones
+            self.active[sensor] = True
+            self.resumed[sensor] = self.head[sensor]
+        self.idle += n
+        self.idle[sensor] = 0
+        stale = self.active & (self.idle > self.stale_samples)
+        if stale.any():
+            self.active[stale] = False
+            self.dropouts += int(stale.sum())
+        block = samples[:n]
+        if n > self.cap:
+            block = block[n - self.cap:]
+            self.head[sensor] += n - self.cap
+            n = self.cap
+
+        ring = self.ring[sensor]
+        i = int(self.head[sensor] % self.cap)
+        first = min(n, self.cap - i)
+        ring[i:i + first] = block[:first]
+        ring[i + self.cap:i + self.cap + first] = block[:first]
+        if first < n:
+            rest = n - first
+            ring[:rest] = block[first:]
+            ring[self.cap:self.cap + rest] = block[first:]
+        self.head[sensor] += n
+
+    def live(self):
+        # Sensors with a full window since they (re)joined
+        return self.active & (self.head - self.resumed >= self.window)
+
+    def ready(self):
+        live = self.live()
+        if not live.any():
+            return False
+        return bool(np.all(self.head[live] - self.last_end[live] >= self.hop))
+
+    def process(self):
+        # Features for the latest window of every sensor, or None if fewer than
+        # HOP new samples have arrived. Intermediate hops are skipped when behind.
+        if not self.ready():
+            return None
+
+        live = self.live()
+        for s in range(self.sensors):
+            if live[s]:
+                start = int((self.head[s] - self.window) % self.cap)
+                np.multiply(self.ring[s, start:start + self.window], self.scale, out=self.work[s])
+                self.last_end[s] = self.head[s]
+            else:
+                self.work[s].fill(0.0)
+
+        # |a| per sample, gravity (window mean) removed
+        np.sqrt(np.einsum("swk,swk->sw", self.work, self.work), out=self.mag)
+        jerk = np.abs(np.diff(self.mag, axis=1)).max(axis=1) * self.fs
+        dyn = self.mag - self.mag.mean(axis=1, keepdims=True)
+
+        rms = np.sqrt(np.mean(dyn * dyn, axis=1))
+        peak = np.abs(dyn).max(axis=1)
+
+        spectrum = np.fft.rfft(dyn * self.taper, axis=1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2) / self.window
+        bands = np.add.reduceat(power, self.band_edges, axis=1)
+
+        rms[~live] = 0.0
+        peak[~live] = 0.0
+        jerk[~live] = 0.0
+        bands[~live] = 0.0
+
+        self.windows += 1
+        label, sensor = classify(rms, peak, jerk)
+        return {
+            "class": label,
+            "sensor": sensor,
+            "rms": rms,
+            "peak": peak,
+            "jerk": jerk,
+            "bands": bands,
+        }
+
+
+def classify(rms, peak, jerk):
+    # Returns (class name, index of the sensor that decided it or -1)
+    crash = (peak >= CRASH_PEAK_G) & (jerk >= CRASH_JERK_G_PER_S)
+    if crash.any():
+        return "crash", int(np.argmax(peak))
+
+    crest = np.divide(peak, rms, out=np.zeros_like(peak), where=rms > 1e-6)
+    pothole = (peak >= POTHOLE_PEAK_G) & (crest >= POTHOLE_CREST)
+    if pothole.any():
+        return "pothole", int(np.argmax(np.where(pothole, peak, 0.0)))
+
+    rough = rms >= ROUGH_RMS_G
+    if rough.any():
+        return "rough", int(np.argmax(rms))
+
+    return "smooth", -1
+
+
+def compact(features, band_names=None, digits=3):
+    # JSON-friendly summary (lists of per-sensor values, rounded)
+    out = {
+        "event": features["class"],
+        "rms": [round(float(v), digits) for v in features["rms"]],
+        "peak": [round(float(v), digits) for v in features["peak"]],
+        "jerk": [round(float(v), 1) for v in features["jerk"]],
+        "bands": [[round(float(v), digits) for v in row] for row in features["bands"]],
+    }
+    if band_names:
+        out["band_names"] = band_names
+    return out
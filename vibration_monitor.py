@@ -1,7 +1,15 @@
-import smbus
 import math
 import time
-import requests
+import numpy as np
+import telemetry
+import vibration_features
+import hazard_store
+import position_fusion
+import sample_bus
+import metrics
+import alert_dispatcher
+import service_loop
+import hal
 
 # --- Configuration ---
 SERVER_URL = "http://localhost:5000/api/vibration"
@@ -9,13 +17,19 @@ PWR_MGMT_1 = 0x6B
 SMPLRT_DIV = 0x19
 CONFIG = 0x1A
 GYRO_CONFIG = 0x1B
+ACCEL_CONFIG = 0x1C
+FIFO_EN = 0x23
 INT_ENABLE = 0x38
+INT_STATUS = 0x3A
 ACCEL_XOUT_H = 0x3B
 ACCEL_YOUT_H = 0x3D
 ACCEL_ZOUT_H = 0x3F
 GYRO_XOUT_H = 0x43
 GYRO_YOUT_H = 0x45
 GYRO_ZOUT_H = 0x47
+USER_CTRL = 0x6A
+FIFO_COUNTH = 0x72
+FIFO_R_W = 0x74
 
 # I2C Addresses
 # MPU1 (Left): 0x68 (AD0 -> GND or Open)
@@ -23,8 +37,43 @@ GYRO_ZOUT_H = 0x47
 Address_Left = 0x68
 Address_Right = 0x69
 
-# Initialize I2C (Bus 1)
-bus = smbus.SMBus(1)
+# High-Rate Mode: the MPU6050 samples into its own 1 KB FIFO and we drain it
+# with block reads, instead of polling single registers at ~10 Hz.
+# Needs the I2C bus at 400 kHz: add 'dtparam=i2c_arm_baudrate=400000' to config.txt
+HIGH_RATE_MODE = True
+SAMPLE_RATE_HZ = 1000       # 1000 / (1 + SMPLRT_DIV) with the DLPF enabled; 500-1000 Hz
+POLL_INTERVAL = 0.02        # FIFO holds ~170 samples (170 ms at 1 kHz); drain well before that
+ACCEL_FS_SEL = 2            # 0=±2g, 1=±4g, 2=±8g, 3=±16g (±2g clips on potholes)
+FIFO_SIZE = 1024
+SAMPLE_BYTES = 6            # Accel X/Y/Z, 16-bit big-endian each
+
+LSB_PER_G = 16384 >> ACCEL_FS_SEL
+
+# Legacy mode reports raw deltas above this (±2g counts)
+REPORT_THRESHOLD = 2000
+# High-rate mode reports windowed features (see vibration_features.py):
+# pothole / crash windows immediately, plus a road-quality summary every second
+EVENT_HOLDOFF = 0.5         # Seconds before the same event class is reported again
+SUMMARY_INTERVAL = 1.0
+# Feed the same samples into the GPS + IMU position estimate (position_fusion.py)
+POSITION_FUSION = True
+# Raw samples for other modules on the car (sample_bus.py "imu" topic)
+PUBLISH_SAMPLES = True
+
+# Stage timers and counters (metrics.py)
+DRAIN_TIME = metrics.histogram("stage_seconds", stage="imu_drain")
+FEATURES_TIME = metrics.histogram("stage_seconds", stage="imu_features")
+FUSION_TIME = metrics.histogram("stage_seconds", stage="position_fusion")
+FIFO_OVERFLOWS = metrics.counter("imu_fifo_overflows_total")
+
+# I2C bus 1, opened by open_bus() when a loop starts (see hal.py)
+bus = None
+
+def open_bus():
+    global bus
+    if bus is None:
+        bus = hal.i2c_bus(1)
+    return bus
 
 def MPU_Init(addr):
     try:
@@ -45,61 +94,264 @@ def read_raw_data(addr, reg):
         if(value > 32768): value = value - 65536
         return value
     except:
+        metrics.dropped("vibration.read_raw_data")
         return 0
 
-print("✅ Dual MPU6050 Monitor Started")
-left_connected = MPU_Init(Address_Left)
-right_connected = MPU_Init(Address_Right)
+def read_accel(addr):
+    # One 6-byte burst instead of six single-byte transactions
+    try:
+        block = bus.read_i2c_block_data(addr, ACCEL_XOUT_H, 6)
+    except:
+        metrics.dropped("vibration.read_accel")
+        return 0, 0, 0
+    x = (block[0] << 8) | block[1]
+    y = (block[2] << 8) | block[3]
+    z = (block[4] << 8) | block[5]
+    return (x - 65536 if x > 32767 else x,
+            y - 65536 if y > 32767 else y,
+            z - 65536 if z > 32767 else z)
+
 
-if left_connected: print(f"   Left Sensor Connected (0x{Address_Left:X})")
-else: print(f"   ❌ Left Sensor Not Found (0x{Address_Left:X})")
+class FifoStream:
+    # Streams accelerometer samples out of one MPU6050's FIFO.
+    # All buffers are allocated once; drain() fills self.samples[:n] in place.
+    def __init__(self, addr, sample_rate_hz=SAMPLE_RATE_HZ):
+        self.addr = addr
+        self.sample_rate_hz = sample_rate_hz
+        self.raw = bytearray(FIFO_SIZE)
+        self.samples = np.zeros((FIFO_SIZE // SAMPLE_BYTES, 3), dtype=np.int16)
+        self.overflows = 0
+        self.total_samples = 0
+        self.samples_total = metrics.counter("imu_samples_total", addr=f"0x{addr:X}")
 
-if right_connected: print(f"   Right Sensor Connected (0x{Address_Right:X})")
-else: print(f"   ❌ Right Sensor Not Found (0x{Address_Right:X})")
+    def start(self):
+        try:
+            div = max(0, min(255, round(1000 / self.sample_rate_hz) - 1))
+            bus.write_byte_data(self.addr, PWR_MGMT_1, 1)          # Wake, PLL with X gyro
+            bus.write_byte_data(self.addr, CONFIG, 1)              # DLPF 184 Hz -> 1 kHz base rate
+            bus.write_byte_data(self.addr, SMPLRT_DIV, div)
+            bus.write_byte_data(self.addr, GYRO_CONFIG, 24)
+            bus.write_byte_data(self.addr, ACCEL_CONFIG, ACCEL_FS_SEL << 3)
+            bus.write_byte_data(self.addr, INT_ENABLE, 0x10)       # Latch FIFO overflow in INT_STATUS
+            self.reset()
+            return True
+        except:
+            return False
 
-# State tracking
-last_x_L, last_y_L, last_z_L = 0, 0, 0
-last_x_R, last_y_R, last_z_R = 0, 0, 0
+    def reset(self):
+        bus.write_byte_data(self.addr, FIFO_EN, 0)
+        bus.write_byte_data(self.addr, USER_CTRL, 0x04)            # FIFO_RESET
+        bus.write_byte_data(self.addr, FIFO_EN, 0x08)              # ACCEL_FIFO_EN
+        bus.write_byte_data(self.addr, USER_CTRL, 0x40)            # FIFO_EN
 
-while True:
-    try:
-        # --- Read Left Sensor ---
-        acc_x_L = read_raw_data(Address_Left, ACCEL_XOUT_H)
-        acc_y_L = read_raw_data(Address_Left, ACCEL_YOUT_H)
-        acc_z_L = read_raw_data(Address_Left, ACCEL_ZOUT_H)
-        
-        delta_L = (abs(acc_x_L - last_x_L) + abs(acc_y_L - last_y_L) + abs(acc_z_L - last_z_L)) / 3.0
-        last_x_L, last_y_L, last_z_L = acc_x_L, acc_y_L, acc_z_L
-        
-        # --- Read Right Sensor ---
-        acc_x_R = read_raw_data(Address_Right, ACCEL_XOUT_H)
-        acc_y_R = read_raw_data(Address_Right, ACCEL_YOUT_H)
-        acc_z_R = read_raw_data(Address_Right, ACCEL_ZOUT_H)
-        
-        delta_R = (abs(acc_x_R - last_x_R) + abs(acc_y_R - last_y_R) + abs(acc_z_R - last_z_R)) / 3.0
-        last_x_R, last_y_R, last_z_R = acc_x_R, acc_y_R, acc_z_R
-
-        # --- Normalization ---
-        # Map 0-15000 to 0.0-1.0
-        left_norm = min(delta_L / 15000.0, 1.0)
-        right_norm = min(delta_R / 15000.0, 1.0)
-        
-        # --- Reporting ---
-        if delta_L > 2000 or delta_R > 2000:
-            data = {
-                'left': left_norm if left_connected else 0,
-                'right': right_norm if right_connected else 0,
-                'raw_left': delta_L,
-                'raw_right': delta_R
-            }
-            try:
-                requests.post(SERVER_URL, json=data, timeout=0.1)
-                # print(f"💥 Vib -> L: {left_norm:.2f} | R: {right_norm:.2f}")
-            except:
-                pass
-        
-        time.sleep(0.1)
-        
-    except Exception as e:
-        print(f"Error: {e}")
-        time.sleep(1)
+    def drain(self):
+        # Returns the number of new samples now in self.samples[:n]
+        hi, lo = bus.read_i2c_block_data(self.addr, FIFO_COUNTH, 2)
+        count = (hi << 8) | lo
+
+        if count >= FIFO_SIZE or bus.read_byte_data(self.addr, INT_STATUS) & 0x10:
+            # Overflowed: the byte stream is no longer sample-aligned, start over
+            self.overflows += 1
+            FIFO_OVERFLOWS.inc()
+            self.reset()
+            return 0
+
+        nbytes = count - (count % SAMPLE_BYTES)
+        if nbytes == 0:
+            return 0
+
+        # One combined transaction with smbus2, 30-byte block reads otherwise
+        self.raw[:nbytes] = bus.read_block(self.addr, FIFO_R_W, nbytes)
+
+        n = nbytes // SAMPLE_BYTES
+        # Big-endian view over the raw bytes, converted into the native array (no new allocation)
+        self.samples[:n] = np.frombuffer(self.raw, dtype='>i2', count=n * 3).reshape(n, 3)
+        self.total_samples += n
+        self.samples_total.inc(n)
+        return n
+
+
+def report(delta_L, delta_R, left_connected, right_connected):
+    # --- Normalization ---
+    # Map 0-15000 to 0.0-1.0
+    left_norm = min(delta_L / 15000.0, 1.0)
+    right_norm = min(delta_R / 15000.0, 1.0)
+
+    # --- Reporting ---
+    if delta_L > REPORT_THRESHOLD or delta_R > REPORT_THRESHOLD:
+        data = {
+            'left': left_norm if left_connected else 0,
+            'right': right_norm if right_connected else 0,
+            'raw_left': delta_L,
+            'raw_right': delta_R
+        }
+        # Queued for the background sender, never blocks the loop
+        telemetry.post(SERVER_URL, data)
+        # print(f"💥 Vib -> L: {left_norm:.2f} | R: {right_norm:.2f}")
+
+
+def report_features(features, left_connected, right_connected, hazard=None):
+    # Compact per-window features instead of raw deltas. 'left'/'right' stay
+    # in 0.0-1.0 (peak relative to the crash threshold) for the dashboard.
+    peak = features["peak"]
+    data = vibration_features.compact(features)
+    data['left'] = min(float(peak[0]) / vibration_features.CRASH_PEAK_G, 1.0) if left_connected else 0
+    data['right'] = min(float(peak[1]) / vibration_features.CRASH_PEAK_G, 1.0) if right_connected else 0
+    if hazard is not None:
+        data['latitude'] = hazard['latitude']
+        data['longitude'] = hazard['longitude']
+        data['hits'] = hazard['hits']
+        data['confidence'] = hazard['confidence']
+    telemetry.post(SERVER_URL, data)
+
+
+def publish_samples(sensor, samples, n):
+    # Up to IMU_BATCH samples per record; t is the time of a record's last sample
+    now = time.time()
+    for i in range(0, n, sample_bus.IMU_BATCH):
+        end = min(n, i + sample_bus.IMU_BATCH)
+        sample_bus.publish("imu", t=now - (n - end) / SAMPLE_RATE_HZ, sensor=sensor, n=end - i,
+                           rate_hz=SAMPLE_RATE_HZ, lsb_per_g=LSB_PER_G, accel=samples[i:end])
+
+
+def event_confidence(features):
+    # How far past the pothole threshold the stronger wheel went (crashes are certain)
+    if features["class"] == "crash":
+        return 0.95
+    peak = float(max(features["peak"]))
+    return round(min(0.9, 0.4 + 0.5 * (peak - vibration_features.POTHOLE_PEAK_G) / vibration_features.POTHOLE_PEAK_G), 3)
+
+
+def legacy_loop():
+    left_connected = MPU_Init(Address_Left)
+    right_connected = MPU_Init(Address_Right)
+    print_sensor_status(left_connected, right_connected)
+
+    # State tracking
+    last_x_L, last_y_L, last_z_L = 0, 0, 0
+    last_x_R, last_y_R, last_z_R = 0, 0, 0
+
+    while True:
+        try:
+            # --- Read Left Sensor ---
+            acc_x_L, acc_y_L, acc_z_L = read_accel(Address_Left)
+
+            delta_L = (abs(acc_x_L - last_x_L) + abs(acc_y_L - last_y_L) + abs(acc_z_L - last_z_L)) / 3.0
+            last_x_L, last_y_L, last_z_L = acc_x_L, acc_y_L, acc_z_L
+
+            # --- Read Right Sensor ---
+            acc_x_R, acc_y_R, acc_z_R = read_accel(Address_Right)
+
+            delta_R = (abs(acc_x_R - last_x_R) + abs(acc_y_R - last_y_R) + abs(acc_z_R - last_z_R)) / 3.0
+            last_x_R, last_y_R, last_z_R = acc_x_R, acc_y_R, acc_z_R
+
+            report(delta_L, delta_R, left_connected, right_connected)
+
+            yield 0.1
+
+        except Exception as e:
+            print(f"Error: {e}")
+            yield 1
+
+
+def high_rate_loop():
+    left = FifoStream(Address_Left)
+    right = FifoStream(Address_Right)
+    left_connected = left.start()
+    right_connected = right.start()
+    print_sensor_status(left_connected, right_connected)
+    print(f"   High-Rate Mode: {SAMPLE_RATE_HZ} Hz per sensor via FIFO")
+
+    engine = vibration_features.WindowEngine(SAMPLE_RATE_HZ, LSB_PER_G)
+    hazards = hazard_store.get_store()
+    fusion = position_fusion.FusionStage(LSB_PER_G) if POSITION_FUSION else None
+    last_event = {}
+    next_poll = hal.monotonic()
+    last_stats = next_poll
+    last_summary = next_poll
+
+    while True:
+        try:
+            t0 = metrics.now()
+            n_L = left.drain() if left_connected else 0
+            n_R = right.drain() if right_connected else 0
+            t1 = metrics.now()
+            DRAIN_TIME.record(t1 - t0)
+
+            engine.push(0, left.samples, n_L)
+            engine.push(1, right.samples, n_R)
+            if PUBLISH_SAMPLES:
+                publish_samples(0, left.samples, n_L)
+                publish_samples(1, right.samples, n_R)
+            features = engine.process()
+            t2 = metrics.now()
+            FEATURES_TIME.record(t2 - t1)
+            if fusion is not None:
+                fusion.step((left.samples[:n_L], right.samples[:n_R]))
+                FUSION_TIME.record_since(t2)
+
+            now = hal.monotonic()
+            if features is not None:
+                label = features["class"]
+                if label in ("pothole", "crash"):
+                    if now - last_event.get(label, 0.0) >= EVENT_HOLDOFF:
+                        last_event[label] = now
+                        # Tag with the latest GPS fix; repeat hits merge into one hazard
+                        hazard = hazards.report_at_current_fix(label, event_confidence(features))
+                        report_features(features, left_connected, right_connected, hazard)
+                        where = f" @ {hazard['latitude']:.6f},{hazard['longitude']:.6f} (hit {hazard['hits']})" if hazard else ""
+                        # blackbox.py freezes the recording around a crash
+                        sample_bus.publish("events", t=time.time(), kind=label.encode(),
+                                           peak_g=float(max(features['peak'])))
+                        print(f"💥 {label.upper()} -> peak L: {features['peak'][0]:.2f}g | R: {features['peak'][1]:.2f}g{where}")
+                        if label == "crash":
+                            alert_dispatcher.raise_alert("crash", {"peak_g": round(float(max(features['peak'])), 2)})
+                elif now - last_summary >= SUMMARY_INTERVAL:
+                    last_summary = now
+                    report_features(features, left_connected, right_connected)
+
+            if now - last_stats >= 10.0:
+                rate_L = left.total_samples / (now - last_stats)
+                rate_R = right.total_samples / (now - last_stats)
+                print(f"📈 IMU Rate -> L: {rate_L:.0f} Hz | R: {rate_R:.0f} Hz | Overflows: {left.overflows}/{right.overflows}")
+                if fusion is not None:
+                    print(f"🧭 Fused position: {fusion.published / (now - last_stats):.0f} Hz")
+                    fusion.published = 0
+                left.total_samples = right.total_samples = 0
+                last_stats = now
+
+            # Fixed-rate polling (no drift from processing time)
+            next_poll += POLL_INTERVAL
+            delay = next_poll - hal.monotonic()
+            if delay <= 0:
+                next_poll = hal.monotonic()
+            yield max(delay, 0)
+
+        except Exception as e:
+            # The FIFOs are reset below: whatever they held is lost
+            metrics.dropped("vibration.high_rate_step")
+            print(f"Error: {e}")
+            yield 1
+            left_connected = left.start()
+            right_connected = right.start()
+
+
+def print_sensor_status(left_connected, right_connected):
+    if left_connected: print(f"   Left Sensor Connected (0x{Address_Left:X})")
+    else: print(f"   ❌ Left Sensor Not Found (0x{Address_Left:X})")
+
+    if right_connected: print(f"   Right Sensor Connected (0x{Address_Right:X})")
+    else: print(f"   ❌ Right Sensor Not Found (0x{Address_Right:X})")
+
+
+def monitor_loop():
+    open_bus()
+    print("✅ Dual MPU6050 Monitor Started")
+    if HIGH_RATE_MODE:
+        yield from high_rate_loop()
+    else:
+        yield from legacy_loop()
+
+
+if __name__ == "__main__":
+    service_loop.run_blocking(monitor_loop())
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import threading
+from collections import deque
+
+import metrics
+
+# --- Configuration ---
+# Pre-event footage for the camera apps. The stream's broadcaster already
+# JPEG-encodes frames; with a ring attached it also keeps the last
+# RING_SECONDS of them (at most RING_FPS, at most BUDGET_BYTES in total).
+# On an event (drowsy, pothole) the frames from PRE_S before it are taken
+# at once, the ones up to POST_S after are collected, and a writer thread
+# saves the clip to clips/<time>_<kind>/ as numbered JPEGs plus clip.json.
+# Detection only pays for a list copy; the disk writes happen elsewhere.
+# A clip folder is an image-folder source (frame_sources.py), so it can be
+# replayed with DROWSINESS_SOURCE=... or bench_vision.py.
+CLIPS_DIR = os.environ.get(
+    "ISARTHI_CLIPS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "clips"),
+)
+RING_SECONDS = 15.0
+RING_FPS = 10.0             # Frames kept per second (the stream itself may run faster)
+BUDGET_BYTES = 12 << 20     # Per camera; ~30-40 KB per 640x480 frame at quality 70-90
+PRE_S = 10.0
+POST_S = 5.0
+MAX_PENDING = 4             # Clips waiting for their post-event frames / the disk
+# Retention: after each clip, the oldest clips (all cameras) are deleted
+# until the folder is within both limits. The SD card is shared with the
+# telemetry spool, the black box and hazards.db.
+CLIPS_MAX_BYTES = 512 << 20
+CLIPS_MAX_COUNT = 200
+
+
+class JpegRing:
+    def __init__(self, name, seconds=RING_SECONDS, fps=RING_FPS, budget_bytes=BUDGET_BYTES):
+        self.name = name
+        self.seconds = seconds
+        self.interval = 1.0 / fps
+        self.budget_bytes = budget_bytes
+        self.frames = deque()       # (capture time, jpeg bytes), oldest first
+        self.bytes = 0
+        self.last = 0.0
+        self._lock = threading.Lock()
+        metrics.gauge("video_ring_bytes", lambda: self.bytes, camera=name)
+        metrics.gauge("video_ring_seconds", self.span, camera=name)
+
+    def due(self, t):
+        # Whether a frame captured at t should be kept (RING_FPS)
+        return t - self.last >= self.interval
+
+    def add(self, t, jpeg):
+        with self._lock:
+            self.last = t
+            self.frames.append((t, jpeg))
+            self.bytes += len(jpeg)
+            # Evict by age, then by bytes (always keeping the newest frame)
+            while len(self.frames) > 1 and (self.frames[0][0] < t - self.seconds or self.bytes > self.budget_bytes):
+                self.bytes -= len(self.frames.popleft()[1])
+
+    def since(self, t0, t1=None):
+        # Frames captured in [t0, t1]; the bytes are shared, not copied
+        with self._lock:
+            return [(t, jpeg) for t, jpeg in self.frames if t >= t0 and (t1 is None or t <= t1)]
+
+    def span(self):
+        with self._lock:
+            return self.frames[-1][0] - self.frames[0][0] if self.frames else 0.0
+
+
+class Clip:
+    def __init__(self, kind, t, pre):
+        self.kind = kind
+        self.t = t
+        self.end = t + POST_S
+        self.frames = pre
+        self.triggers = [t]
+
+
+class ClipRecorder:
+    # trigger() from the detection thread; everything else on the writer thread
+    def __init__(self, ring, directory=CLIPS_DIR):
+        self.ring = ring
+        self.directory = directory
+        self.pending = None
+        self.clips = 0
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._thread = None
+        self._write_time = metrics.histogram("clip_write_seconds", camera=ring.name)
+
+    def trigger(self, kind, t):
+        # A trigger inside the clip being collected joins it
+        pending = self.pending
+        if pending is not None and t <= pending.end:
+            pending.triggers.append(t)
+            return
+        clip = self.pending = Clip(kind, t, self.ring.since(t - PRE_S))
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(clip)
+        except queue.Full:
+            metrics.dropped(f"video.{self.ring.name}.clip")
+            print(f"⚠️ {self.ring.name}: clip writer behind, {kind} clip dropped")
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{self.ring.name}-clips", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            clip = self._queue.get()
+            # Post-event frames: wait until they have been captured (and encoded)
+            delay = clip.end - time.time() + self.ring.interval
+            if delay > 0:
+                time.sleep(delay)
+            if self.pending is clip:
+                self.pending = None
+            last = clip.frames[-1][0] if clip.frames else clip.t - PRE_S
+            clip.frames.extend(f for f in self.ring.since(last, clip.end) if f[0] > last)
+            try:
+                path, seconds = self.write(clip)
+                print(f"🎞️ {self.ring.name}: {clip.kind} clip, {len(clip.frames)} frames "
+                      f"in {seconds * 1000:.0f} ms -> {path}")
+                removed = prune(self.directory)
+                if removed:
+                    print(f"🧹 Clips over {CLIPS_MAX_COUNT} / {CLIPS_MAX_BYTES >> 20} MB: removed {', '.join(removed)}")
+            except OSError as e:
+                metrics.dropped(f"video.{self.ring.name}.clip")
+                print(f"⚠️ {self.ring.name}: clip not saved ({e})")
+
+    def write(self, clip):
+        t0 = time.perf_counter()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(clip.t))
+        path = os.path.join(self.directory, f"{stamp}_{clip.kind}")
+        os.makedirs(path, exist_ok=True)
+        nbytes = 0
+        for i, (_, jpeg) in enumerate(clip.frames):
+            with open(os.path.join(path, f"{i:06d}.jpg"), "wb") as f:
+                f.write(jpeg)
+                os.fsync(f.fileno())    # The car may lose power right after an event
+            nbytes += len(jpeg)
+        with open(os.path.join(path, "clip.json"), "w") as f:
+            json.dump({"camera": self.ring.name, "kind": clip.kind, "t": clip.t, "triggers": clip.triggers,
+                       "pre_s": PRE_S, "post_s": POST_S, "bytes": nbytes,
+                       "timestamps": [round(t, 3) for t, _ in clip.frames]}, f)
+        seconds = time.perf_counter() - t0
+        self._write_time.record(int(seconds * 1e9))
+        self.clips += 1
+        return path, seconds
+
+
+def prune(directory=CLIPS_DIR, max_bytes=CLIPS_MAX_BYTES, max_count=CLIPS_MAX_COUNT):
+    # Deletes the oldest clip folders beyond the limits; returns their names.
+    # Folder names start with the clip time, so name order is age order.
+    clips = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    for name in names:
+        path = os.path.join(directory, name)
+        if not os.path.isfile(os.path.join(path, "clip.json")):
+            continue    # Not a (finished) clip
+        try:
+            size = sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+        except OSError:
+            continue
+        clips.append((name, path, size))
+    total = sum(size for _, _, size in clips)
+    removed = []
+    # The newest clip always stays
+    while len(clips) > 1 and (total > max_bytes or len(clips) > max_count):
+        name, path, size = clips.pop(0)
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed.append(name)
+    return removed
+
+
+def attach(broadcaster):
+    # Ring + recorder for a FrameBroadcaster; returns the recorder
+    broadcaster.ring = JpegRing(broadcaster.name)
+    return ClipRecorder(broadcaster.ring)
+
+
+def bench(frames=300, width=640, height=480):
+    # Encode cost, ring footprint and clip write speed on this machine
+    import cv2
+    import numpy as np
+    import tempfile
+    rng = np.random.default_rng(0)
+    # Camera-like content: smooth gradients plus sensor noise
+    base = np.add.outer(np.arange(height), np.arange(width)).astype(np.float32) * (255.0 / (height + width))
+    ring = JpegRing("bench", seconds=1e9, budget_bytes=1 << 40)
+    for quality in (90, 70, 50):
+        ring.frames.clear()
+        ring.bytes = 0
+        t = time.perf_counter()
+        for i in range(frames):
+            frame = np.clip(base + rng.normal(0, 4, base.shape), 0, 255).astype(np.uint8)
+            ok, buf = cv2.imencode(".jpg", cv2.merge((frame, frame, frame)), [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            ring.add(i / RING_FPS, buf.tobytes())
+        encode_ms = (time.perf_counter() - t) / frames * 1000
+        per_frame = ring.bytes / len(ring.frames)
+        ring_mb = RING_SECONDS * RING_FPS * per_frame / 2**20
+        seconds = BUDGET_BYTES / per_frame / RING_FPS
+        with tempfile.TemporaryDirectory(dir=os.environ.get("TMPDIR")) as tmp:
+            recorder = ClipRecorder(ring, tmp)
+            clip = Clip("bench", 0.0, list(ring.frames)[:int((PRE_S + POST_S) * RING_FPS)])
+            _, write_s = recorder.write(clip)
+            written = sum(len(j) for _, j in clip.frames)
+        print(f"q{quality}: {per_frame / 1024:.0f} KB/frame, encode+noise {encode_ms:.1f} ms | "
+              f"{RING_SECONDS:.0f} s at {RING_FPS:.0f} fps = {ring_mb:.1f} MB (budget {BUDGET_BYTES >> 20} MB = {seconds:.0f} s) | "
+              f"{len(clip.frames)}-frame clip ({written / 2**20:.1f} MB) written in {write_s * 1000:.0f} ms "
+              f"({written / 2**20 / write_s:.0f} MB/s)")
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        bench()
+    else:
+        print("usage: python3 video_ring.py --bench    (set TMPDIR to measure a specific disk)")
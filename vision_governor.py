@@ -0,0 +1,188 @@
+import os
+import time
+import cv2
+
+import metrics
+
+# --- Configuration ---
+# Keeps a camera pipeline inside its latency budget when the host is busy.
+# Every ADJUST_INTERVAL it looks at the smoothed per-frame processing time,
+# the CPU load and the SoC temperature, and moves one step along LEVELS:
+# cheaper when any of them is over its limit, back towards full quality once
+# all of them have been comfortably under for RELAX_AFTER seconds. A level
+# sets the capture / processing resolution, the processing stride, the face
+# cascade's scaleFactor / minSize, and the JPEG quality of the video feed.
+#
+#   governor = VisionGovernor("pothole", budget_ms=40, grabber=grabber, broadcaster=broadcaster)
+#   ...
+#   if not governor.take(captured_at):
+#       continue
+#   frame = governor.fit(frame)
+#   t0 = time.perf_counter()
+#   ...
+#   governor.observe(t0)
+ENABLED = True
+LEVELS = (
+    # scale: of the camera's native resolution; stride: process every Nth frame;
+    # scale_factor / min_size: face cascade step and minSize multiplier
+    {"scale": 1.0, "stride": 1, "scale_factor": 1.1, "min_size": 1.0, "jpeg": 90},
+    {"scale": 0.75, "stride": 1, "scale_factor": 1.15, "min_size": 1.0, "jpeg": 80},
+    {"scale": 0.5, "stride": 1, "scale_factor": 1.2, "min_size": 1.0, "jpeg": 70},
+    {"scale": 0.5, "stride": 2, "scale_factor": 1.25, "min_size": 1.25, "jpeg": 60},
+    {"scale": 0.5, "stride": 3, "scale_factor": 1.3, "min_size": 1.5, "jpeg": 50},
+)
+ADJUST_INTERVAL = 2.0
+RELAX_AFTER = 10.0          # Seconds of headroom before stepping back up
+RELAX_FRACTION = 0.6        # Headroom = latency under this fraction of the budget...
+CPU_HIGH = 0.90             # ...and CPU busy fraction under CPU_LOW
+CPU_LOW = 0.70
+TEMP_HIGH_C = 75.0          # The Pi firmware starts throttling at 80-85 °C
+TEMP_LOW_C = 68.0
+MAX_FRAME_GAP = 0.2         # Never skip frames for longer than this (timing-sensitive consumers)
+LATENCY_ALPHA = 0.2
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+
+def soc_temperature():
+    # °C, or None off the Pi
+    try:
+        with open(THERMAL_ZONE) as f:
+            return int(f.read()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+class CpuLoad:
+    # Busy fraction of all cores since the previous call (/proc/stat),
+    # falling back to the 1-minute load average
+    def __init__(self):
+        self.last = self._read()
+
+    def _read(self):
+        try:
+            with open("/proc/stat") as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        return sum(fields), idle
+
+    def busy(self):
+        now = self._read()
+        if now is None or self.last is None:
+            try:
+                return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+            except OSError:
+                return 0.0
+        total, idle = now[0] - self.last[0], now[1] - self.last[1]
+        self.last = now
+        return 1.0 - idle / total if total > 0 else 0.0
+
+
+class VisionGovernor:
+    def __init__(self, name, budget_ms, grabber=None, broadcaster=None, on_change=None, levels=LEVELS):
+        self.name = name
+        self.budget = budget_ms / 1000.0
+        self.grabber = grabber
+        self.broadcaster = broadcaster
+        self.on_change = on_change
+        self.levels = levels
+        self.index = 0
+        self.latency = 0.0
+        self.cpu = 0.0
+        self.temp = None
+        self.changes = 0
+        self._cpu_load = CpuLoad()
+        self._next_adjust = time.monotonic() + ADJUST_INTERVAL
+        self._calm_since = None
+        self._taken = 0
+        self._last_taken = None
+        metrics.gauge("vision_level", lambda: self.index, app=name)
+        metrics.gauge("vision_latency_seconds", lambda: self.latency, app=name)
+        metrics.gauge("cpu_busy_ratio", lambda: self.cpu)
+        metrics.gauge("soc_temperature_celsius", lambda: self.temp if self.temp is not None else float("nan"))
+        self._apply()
+
+    @property
+    def level(self):
+        return self.levels[self.index]
+
+    def take(self, captured_at):
+        # Stride: whether to process this frame. Frames never go unprocessed
+        # for more than MAX_FRAME_GAP of capture (wall-clock) time.
+        self._taken += 1
+        if (self._last_taken is None or self._taken % self.level["stride"] == 0
+                or captured_at - self._last_taken >= MAX_FRAME_GAP):
+            self._last_taken = captured_at
+            return True
+        return False
+
+    def fit(self, frame):
+        # Down to the level's resolution, unless the camera already delivers it
+        native = self.grabber.native_size if self.grabber is not None and self.grabber.native_size else None
+        width = native[0] if native else frame.shape[1]
+        target = int(width * self.level["scale"])
+        if frame.shape[1] <= target:
+            return frame
+        scale = target / float(frame.shape[1])
+        return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    def observe(self, started, ended=None):
+        # One processed frame (perf_counter times); adjusts the level now and then
+        ended = time.perf_counter() if ended is None else ended
+        seconds = ended - started
+        self.latency = seconds if self.latency == 0.0 else self.latency + LATENCY_ALPHA * (seconds - self.latency)
+        now = time.monotonic()
+        if now >= self._next_adjust:
+            self._next_adjust = now + ADJUST_INTERVAL
+            self.adjust(now)
+
+    def adjust(self, now):
+        self.cpu = self._cpu_load.busy()
+        self.temp = soc_temperature()
+        hot = self.temp is not None and self.temp >= TEMP_HIGH_C
+        cool = self.temp is None or self.temp < TEMP_LOW_C
+        if not ENABLED:
+            return
+        if self.latency > self.budget or self.cpu > CPU_HIGH or hot:
+            self._calm_since = None
+            if self.index < len(self.levels) - 1:
+                self._step(+1)
+        elif self.latency < self.budget * RELAX_FRACTION and self.cpu < CPU_LOW and cool:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= RELAX_AFTER and self.index > 0:
+                self._calm_since = now
+                self._step(-1)
+        else:
+            self._calm_since = None
+
+    def _step(self, direction):
+        self.index += direction
+        self.changes += 1
+        self._apply()
+        level = self.level
+        temp = f", {self.temp:.0f}°C" if self.temp is not None else ""
+        print(f"⚙️ {self.name}: level {self.index} (scale {level['scale']}, stride {level['stride']}, "
+              f"scaleFactor {level['scale_factor']}, JPEG {level['jpeg']}) | "
+              f"{self.latency * 1000:.0f} ms/frame, CPU {self.cpu * 100:.0f}%{temp}")
+
+    def _apply(self):
+        level = self.level
+        if self.grabber is not None:
+            self.grabber.request_scale(level["scale"])
+        if self.broadcaster is not None:
+            self.broadcaster.jpeg_quality = level["jpeg"]
+        if self.on_change is not None:
+            self.on_change(level)
+
+    def snapshot(self):
+        return {
+            "level": self.index,
+            "latency_ms": round(self.latency * 1000, 1),
+            "budget_ms": round(self.budget * 1000, 1),
+            "cpu": round(self.cpu, 2),
+            "temp_c": self.temp,
+            "changes": self.changes,
+            **self.level,
+        }
@@ -0,0 +1,240 @@
+import cv2
+import time
+import threading
+
+import metrics
+
+# --- Shared building blocks for the camera analytics ---
+# Capture runs in its own thread and only ever keeps the newest frame, so a
+# slow consumer sees fresh frames (older ones are dropped, not queued).
+
+
+class StageStats:
+    # Per-stage throughput and latency (exponential moving averages), plus
+    # the full latency distribution in stage_seconds on /metrics
+    def __init__(self, name, alpha=0.1):
+        self.name = name
+        self.hist = metrics.histogram("stage_seconds", stage=name)
+        self.alpha = alpha
+        self.count = 0
+        self.latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self.fps = 0.0
+        self._last_end = None
+        self._lock = threading.Lock()
+
+    def record(self, started, ended=None):
+        ended = time.perf_counter() if ended is None else ended
+        latency_ms = (ended - started) * 1000.0
+        with self._lock:
+            self.hist.record(int((ended - started) * 1e9))
+            self.count += 1
+            if self.count == 1:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms += self.alpha * (latency_ms - self.latency_ms)
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+            if self._last_end is not None and ended > self._last_end:
+                rate = 1.0 / (ended - self._last_end)
+                self.fps = rate if self.fps == 0.0 else self.fps + self.alpha * (rate - self.fps)
+            self._last_end = ended
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "fps": round(self.fps, 1),
+                "latency_ms": round(self.latency_ms, 2),
+                "max_latency_ms": round(self.max_latency_ms, 2),
+            }
+
+
+class FrameGrabber:
+    # Owns a capture device and always holds the latest frame.
+    # open_capture() must return an opened cv2.VideoCapture-like object.
+    def __init__(self, open_capture, name="camera", retry_delay=1.0):
+        self.open_capture = open_capture
+        self.name = name
+        self.retry_delay = retry_delay
+        self.stats = StageStats(f"{name}.capture")
+
+        self.frame = None
+        self.timestamp = 0.0
+        self.seq = 0
+        self.dropped = 0
+        self.connected = False
+        # Capture resolution as a fraction of the camera's native one (see
+        # vision_governor.py); sources without set_size() stay native
+        self.native_size = None
+        self.scale = 1.0
+        metrics.gauge("frames_dropped_total", lambda: self.dropped, stage=f"{name}.capture")
+
+        self._taken_seq = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-capture", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def request_scale(self, scale):
+        # Applied by the capture thread before its next read
+        self.scale = scale
+
+    def _run(self):
+        capture = None
+        applied = 1.0
+        while not self._stop.is_set():
+            if capture is None or not capture.isOpened():
+                capture = self.open_capture()
+                if capture is None or not capture.isOpened():
+                    self.connected = False
+                    time.sleep(self.retry_delay)
+                    continue
+                self.connected = True
+                applied = 1.0
+
+            if self.scale != applied and self.native_size is not None:
+                set_size = getattr(capture, "set_size", None)
+                if set_size is not None:
+                    w, h = self.native_size
+                    set_size(int(w * self.scale), int(h * self.scale))
+                applied = self.scale
+
+            t0 = time.perf_counter()
+            success, frame = capture.read()
+            if not success:
+                # Camera unplugged / stream ended: reopen after a pause
+                self.connected = False
+                capture.release()
+                capture = None
+                time.sleep(self.retry_delay)
+                continue
+            self.stats.record(t0)
+            if applied == 1.0:
+                self.native_size = (frame.shape[1], frame.shape[0])
+
+            with self._cond:
+                if self.seq > self._taken_seq:
+                    self.dropped += 1  # Previous frame was never consumed
+                self.frame = frame
+                self.timestamp = time.time()
+                self.seq += 1
+                self._cond.notify_all()
+
+        if capture is not None:
+            capture.release()
+
+    def next_frame(self, last_seq, timeout=1.0):
+        # Waits for a frame newer than last_seq.
+        # Returns (seq, timestamp, frame) or None on timeout.
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > last_seq, timeout):
+                return None
+            self._taken_seq = self.seq
+            return self.seq, self.timestamp, self.frame
+
+
+class FrameBroadcaster:
+    # One producer, N viewers. Each published frame is JPEG-encoded once (on
+    # the broadcaster's own thread) and every subscriber gets the same bytes.
+    # A slow viewer just skips to the newest frame; nobody waits on it.
+    # With a ring attached (video_ring.py) it also keeps recent encoded frames,
+    # viewers or not.
+    def __init__(self, name="stream", jpeg_quality=95, ring=None):
+        self.name = name
+        self.jpeg_quality = jpeg_quality
+        self.ring = ring
+        self.stats = StageStats(f"{name}.encode")
+        self.subscribers = 0
+        self.skipped = 0
+        metrics.gauge("frames_dropped_total", lambda: self.skipped, stage=f"{name}.encode")
+        metrics.gauge("stream_viewers", lambda: self.subscribers, stream=name)
+
+        self._raw = None
+        self._raw_time = 0.0
+        self._raw_seq = 0
+        self._chunk = None
+        self._seq = 0
+        self._raw_cond = threading.Condition()
+        self._out_cond = threading.Condition()
+        self._thread = None
+
+    def has_viewers(self):
+        return self.subscribers > 0
+
+    def wants_frames(self, timestamp):
+        # Whether publish() would use a frame captured at timestamp
+        return self.subscribers > 0 or (self.ring is not None and self.ring.due(timestamp))
+
+    def publish(self, frame, timestamp=None):
+        # Hand over the newest frame; never blocks on encoding
+        if not self.subscribers and self.ring is None:
+            return
+        self._ensure_started()
+        with self._raw_cond:
+            self._raw = frame
+            self._raw_time = time.time() if timestamp is None else timestamp
+            self._raw_seq += 1
+            self._raw_cond.notify()
+
+    def publish_jpeg(self, jpeg_bytes):
+        # For producers that already hold an encoded frame
+        with self._out_cond:
+            self._chunk = (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg_bytes + b'\r\n')
+            self._seq += 1
+            self._out_cond.notify_all()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._raw_cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._encode_loop, name=f"{self.name}-encode", daemon=True)
+                    self._thread.start()
+
+    def _encode_loop(self):
+        seq = 0
+        while True:
+            with self._raw_cond:
+                self._raw_cond.wait_for(lambda: self._raw_seq != seq)
+                if self._raw_seq - seq > 1:
+                    self.skipped += self._raw_seq - seq - 1
+                frame, captured_at, seq = self._raw, self._raw_time, self._raw_seq
+            to_ring = self.ring is not None and self.ring.due(captured_at)
+            if not self.subscribers and not to_ring:
+                continue
+            t0 = time.perf_counter()
+            # Quality can change between frames (vision_governor.py)
+            ret, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+            self.stats.record(t0)
+            if ret:
+                jpeg = buffer.tobytes()
+                if self.subscribers:
+                    self.publish_jpeg(jpeg)
+                if to_ring:
+                    self.ring.add(captured_at, jpeg)
+
+    def stream(self):
+        # Generator for a multipart/x-mixed-replace response
+        with self._out_cond:
+            self.subscribers += 1
+        try:
+            seq = self._seq
+            while True:
+                with self._out_cond:
+                    if not self._out_cond.wait_for(lambda: self._seq != seq, timeout=1.0):
+                        continue
+                    chunk, seq = self._chunk, self._seq
+                yield chunk
+        finally:
+            with self._out_cond:
+                self.subscribers -= 1
@@ -0,0 +1,386 @@
+import os
+import sys
+import time
+import queue
+import signal
+import threading
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+from flask import Flask, Response, jsonify
+from werkzeug.serving import make_server
+
+import metrics
+import bus_uploader
+import service_loop
+import drowsiness_detector as dd
+import pothole_detector as pd
+from pothole_analysis import PotholeAnalyzer
+from vision_pipeline import FrameGrabber, StageStats
+from vision_governor import VisionGovernor
+
+# --- Configuration ---
+# All cameras in one service instead of one Flask app (and one GIL-bound
+# detection loop) per camera. Each camera keeps its capture thread
+# (FrameGrabber, V4L2 on Linux), governor and broadcaster here; its frames
+# are copied into shared-memory slots and detected on a pool of WORKERS
+# processes shared by every camera. Results come back in capture order and
+# go through the same state / overlay / clip code as the standalone apps,
+# which keep working (and serving the same routes) on their own.
+#
+#   python3 vision_service.py                   # :5001 drowsiness, :5002 pothole
+#   python3 vision_service.py --bench           # frames/s vs. worker count
+#
+# The pool detects every frame from scratch: face tracking keeps state
+# between frames, which can't follow frames that land on different workers.
+CAMERAS = {
+    # key: (detector module, port)
+    "drowsiness": (dd, 5001),
+    "pothole": (pd, 5002),
+}
+ENABLED_CAMERAS = [k for k in os.environ.get("ISARTHI_VISION_CAMERAS", ",".join(CAMERAS)).split(",") if k]
+HOST = "0.0.0.0"
+
+
+def usable_cores():
+    # Cores this process may run on (start_car.py pins modules to cores)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Capture, result handling and JPEG encoding stay in this process (mostly
+# GIL-free OpenCV calls); detection gets a process per usable core
+WORKERS = int(os.environ.get("ISARTHI_VISION_WORKERS", "0")) or usable_cores()
+# Heartbeats to start_car.py stop when a connected camera has had no
+# detection result for this long (stuck pool), so the supervisor restarts us
+STALL_S = 10.0
+
+
+# ---- Worker processes ----
+_face_cascade = None
+_eye_cascade = None
+_analyzer = None
+_slots = {}
+
+
+def init_worker():
+    global _face_cascade, _eye_cascade, _analyzer
+    cv2.setNumThreads(1)    # Parallelism comes from the pool, not from OpenCV threads
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # Ctrl+C stops the service, which shuts the pool down
+    _face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    _eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye_tree_eyeglasses.xml")
+    _analyzer = PotholeAnalyzer()
+
+
+def in_flight(workers, cameras):
+    # Frames a camera may have in the pool at once (one shared-memory slot each).
+    # Enough to keep every worker busy; any more only adds latency.
+    return max(2, workers // max(1, cameras) + 1)
+
+
+def _attach(name):
+    # Slots are created and unlinked by the service; workers map them once
+    # and keep the mapping, so the service must not churn through slot names
+    shm = _slots.get(name)
+    if shm is None:
+        shm = _slots[name] = shared_memory.SharedMemory(name=name)
+    return shm
+
+
+def detect_task(kind, slot, shape, params=None):
+    # One frame, read in place from a shared-memory slot. Returns plain
+    # values (pickled back to the service) and the time spent here.
+    t0 = time.perf_counter()
+    frame = np.ndarray(shape, np.uint8, buffer=_attach(slot).buf)
+    if kind == "drowsiness":
+        gray = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        faces, results = dd.detect(gray, _face_cascade, _eye_cascade, params)
+        out = {"faces": len(faces),
+               "results": [(tuple(int(v) for v in face), [tuple(int(v) for v in e) for e in eyes])
+                           for face, eyes in results]}
+    else:
+        regions, best = _analyzer.candidates(frame)
+        out = {"regions": regions, "best": best}
+    out["seconds"] = time.perf_counter() - t0
+    return out
+
+
+def _ping(hold):
+    time.sleep(hold)    # Long enough that the pool has to start another worker
+    return os.getpid()
+
+
+# ---- Service ----
+class DetectorPool:
+    # The process pool, restarted if a worker dies (BrokenProcessPool)
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        self.start()
+
+    def start(self):
+        # spawn: workers don't inherit the service's threads, sockets or camera handles
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=init_worker)
+        # Start (and load the cascades in) every worker before the first frame
+        pids = {f.result() for f in [self._pool.submit(_ping, 0.1) for _ in range(self.workers * 2)]}
+        print(f"🧠 Vision pool: {len(pids)} worker processes")
+
+    def submit(self, *args):
+        with self._lock:
+            try:
+                return self._pool.submit(detect_task, *args)
+            except BrokenProcessPool:
+                print("⚠️ Vision pool broken, restarting workers")
+                self.restarts += 1
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self.start()
+                return self._pool.submit(detect_task, *args)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class CameraPipeline:
+    # Capture -> slot -> pool -> (in order) state, overlay, broadcaster
+    def __init__(self, key, pool, depth=2):
+        self.key = key
+        self.module, self.port = CAMERAS[key]
+        self.pool = pool
+        self.broadcaster = self.module.broadcaster
+        self.grabber = FrameGrabber(self.module.open_camera, name=key)
+        self.governor = VisionGovernor(key, self.module.LATENCY_BUDGET_MS, grabber=self.grabber,
+                                       broadcaster=self.broadcaster)
+        # The standalone app's stage stats, plus the round trip through the pool
+        self.stats = self.module.stats
+        self.detect_stats = self.stats["detect" if key == "drowsiness" else "analyze"]
+        self.stats["pool"] = StageStats(f"{key}.pool")
+        self.analyzer = PotholeAnalyzer() if key == "pothole" else None
+        self.depth = depth
+        self.slots = []
+        self.free = queue.Queue()
+        self.in_flight = queue.Queue()      # Submission (= capture) order
+        self.failed = 0
+        self.last_result = time.monotonic()
+
+    def start(self):
+        self.grabber.start()
+        threading.Thread(target=self.schedule_loop, name=f"{self.key}-schedule", daemon=True).start()
+        threading.Thread(target=self.result_loop, name=f"{self.key}-results", daemon=True).start()
+        return self
+
+    def _slot_for(self, slot, frame):
+        # Slots hold a frame at the camera's native resolution, so the governor
+        # stepping capture back up never needs a bigger one. Only a camera mode
+        # change replaces a slot (workers keep a mapping of the old one).
+        nbytes = frame.nbytes
+        if self.grabber.native_size:
+            w, h = self.grabber.native_size
+            nbytes = max(nbytes, w * h * frame.nbytes // (frame.shape[0] * frame.shape[1]))
+        if slot is None or slot.size < nbytes:
+            if slot is not None:
+                self.slots.remove(slot)
+                slot.close()
+                slot.unlink()
+            slot = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.slots.append(slot)
+        return slot
+
+    def schedule_loop(self):
+        for _ in range(self.depth):
+            self.free.put(None)
+        seq = 0
+        slot = self.free.get()
+        while True:
+            # A free slot first, then the newest frame: while the pool is
+            # busy the grabber drops stale frames instead of queueing them
+            item = self.grabber.next_frame(seq, timeout=1.0)
+            if item is None:
+                continue
+            seq, captured_at, frame = item
+            if not self.governor.take(captured_at):
+                continue
+            slot = self._slot_for(slot, frame)
+            frame = self.governor.fit(frame)
+            np.ndarray(frame.shape, np.uint8, buffer=slot.buf)[...] = frame
+            params = dd.cascade_params(self.governor.level) if self.key == "drowsiness" else None
+            try:
+                future = self.pool.submit(self.key, slot.name, frame.shape, params)
+            except RuntimeError:
+                return      # Service shutting down
+            self.in_flight.put((future, slot, frame.shape, captured_at, time.perf_counter()))
+            slot = self.free.get()
+
+    def result_loop(self):
+        while True:
+            future, slot, shape, captured_at, submitted = self.in_flight.get()
+            try:
+                out = future.result()
+            except Exception as e:
+                self.failed += 1
+                metrics.dropped(f"vision.{self.key}")
+                print(f"⚠️ {self.key}: detection failed ({e!r})")
+                self.free.put(slot)
+                continue
+            ended = time.perf_counter()
+            self.last_result = time.monotonic()
+            self.stats["pool"].record(submitted, ended)
+            self.detect_stats.record(ended - out["seconds"], ended)
+            frame = np.ndarray(shape, np.uint8, buffer=slot.buf)
+            if self.key == "drowsiness":
+                self.drowsiness_result(out, frame, captured_at)
+            else:
+                self.pothole_result(out, frame, captured_at)
+            self.free.put(slot)
+            # The governor holds the detection time (not the queueing) to the budget
+            self.governor.observe(ended - out["seconds"], ended)
+
+    def drowsiness_result(self, out, frame, captured_at):
+        eyes_detected = sum(len(eyes) for _, eyes in out["results"])
+        dd.update_state(out["faces"], eyes_detected, captured_at)
+        if self.broadcaster.wants_frames(captured_at):
+            t0 = time.perf_counter()
+            frame = frame.copy()    # The slot goes back to the pool
+            dd.draw_overlay(frame, out["results"], out["faces"], eyes_detected)
+            self.stats["overlay"].record(t0)
+            self.broadcaster.publish(frame, captured_at)
+
+    def pothole_result(self, out, frame, captured_at):
+        result = self.analyzer.confirm(out["regions"], out["best"])
+        pd.update_state(result, captured_at)
+        if self.broadcaster.wants_frames(captured_at):
+            t0 = time.perf_counter()
+            frame = frame.copy()
+            pd.draw_overlay(frame, self.analyzer, result)
+            self.stats["overlay"].record(t0)
+            self.broadcaster.publish(frame, captured_at)
+
+    def healthy(self):
+        # Results are coming in, or there is no camera to get them from
+        return not self.grabber.connected or time.monotonic() - self.last_result < STALL_S
+
+    def status(self):
+        if self.key == "pothole":
+            return Response(pd.status_body, mimetype="application/json")
+        return jsonify({"drowsy": dd.current_drowsy, "events": dd.drowsiness_events_count})
+
+    def snapshot(self):
+        return {
+            "capture": dict(self.grabber.stats.snapshot(), dropped=self.grabber.dropped,
+                            connected=self.grabber.connected),
+            **{name: s.snapshot() for name, s in self.stats.items()},
+            "encode": dict(self.broadcaster.stats.snapshot(), skipped=self.broadcaster.skipped),
+            "viewers": self.broadcaster.subscribers,
+            "governor": self.governor.snapshot(),
+            "in_flight": self.depth - self.free.qsize(),
+            "failed": self.failed,
+            "workers": self.pool.workers,
+        }
+
+    def close(self):
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+
+
+def make_app(pipeline):
+    app = Flask(pipeline.key)
+
+    @app.route('/video_feed')
+    def video_feed():
+        return Response(pipeline.broadcaster.stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    @app.route('/status')
+    def status():
+        return pipeline.status()
+
+    @app.route('/stats')
+    def stats():
+        return jsonify(pipeline.snapshot())
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics.render(module="vision_service"), mimetype=metrics.CONTENT_TYPE)
+
+    return app
+
+
+def serve(keys=ENABLED_CAMERAS, workers=WORKERS):
+    pool = DetectorPool(workers)
+    depth = in_flight(workers, len(keys))
+    pipelines = [CameraPipeline(key, pool, depth).start() for key in keys]
+    if "drowsiness" in keys:
+        bus_uploader.start_background(("drowsiness",))
+    for p in pipelines:
+        server = make_server(HOST, p.port, make_app(p), threaded=True)
+        threading.Thread(target=server.serve_forever, name=f"{p.key}-http", daemon=True).start()
+        print(f"📷 {p.key}: http://{HOST}:{p.port}/video_feed")
+    # start_car.py stops modules with SIGTERM; the slots must still be unlinked
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    heartbeat = service_loop.Heartbeat()
+    heartbeat.ready()
+    try:
+        while not stop.wait(service_loop.BEAT_INTERVAL):
+            if all(p.healthy() for p in pipelines):
+                heartbeat.beat()
+    finally:
+        pool.shutdown()
+        for p in pipelines:
+            p.close()
+
+
+def bench(counts, frames=200):
+    # Frames/s through the pool for each worker count: both detectors on
+    # 640x480 frames, two frames per worker and detector queued
+    import hal
+    camera = hal.SimCamera()
+    road = pd.render_simulation()
+    _, face = camera.read()
+    inputs = [("drowsiness", face, dd.cascade_params()), ("pothole", road, None)]
+    for workers in counts:
+        pool = DetectorPool(workers)
+        slots = []
+        for kind, frame, params in inputs:
+            for _ in range(workers * 2):
+                slot = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+                np.ndarray(frame.shape, np.uint8, buffer=slot.buf)[...] = frame
+                slots.append((kind, slot, frame.shape, params))
+        t0 = time.perf_counter()
+        pending = []
+        busy = 0.0
+        for i in range(frames):
+            kind, slot, shape, params = slots[i % len(slots)]
+            if len(pending) >= len(slots) - 1:
+                busy += pending.pop(0).result()["seconds"]
+            pending.append(pool.submit(kind, slot.name, shape, params))
+        busy += sum(f.result()["seconds"] for f in pending)
+        seconds = time.perf_counter() - t0
+        pool.shutdown()
+        for _, slot, _, _ in slots:
+            slot.close()
+            slot.unlink()
+        print(f"{workers} workers: {frames / seconds:.1f} frames/s, "
+              f"{busy / frames * 1000:.1f} ms/frame in the worker")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="All cameras, one shared detector pool")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--bench", action="store_true", help="Measure frames/s for 1..--workers workers")
+    args = parser.parse_args()
+    if args.bench:
+        bench(range(1, max(args.workers, usable_cores()) + 1))
+        sys.exit(0)
+    print(f"Starting Vision Service ({', '.join(ENABLED_CAMERAS)}) with {args.workers} workers...")
+    serve(workers=args.workers)